@@ -1,57 +1,2964 @@
+# Отсчет времени запуска начинается до импорта остальных модулей
+import time
+STARTUP_TIME = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, scrolledtext, filedialog, messagebox, font, colorchooser
+from tkinter import ttk, scrolledtext
 import os
+import io
+import re
+import sys
+import random
 import json
+import mmap
+import zlib
+import queue
+import codecs
+import importlib
+import threading
+import operator
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, chain, count, islice
+from collections import namedtuple, Counter, deque
+
+
+class LazyModule:
+    """Модуль, который импортируется при первом обращении к нему"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+    
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attribute)
+
+
+# Диалоги и редко нужные модули не замедляют запуск
+filedialog = LazyModule("tkinter.filedialog")
+messagebox = LazyModule("tkinter.messagebox")
+colorchooser = LazyModule("tkinter.colorchooser")
+simpledialog = LazyModule("tkinter.simpledialog")
+font = LazyModule("tkinter.font")
+pickle = LazyModule("pickle")
+shutil = LazyModule("shutil")
+tempfile = LazyModule("tempfile")
+ctypes = LazyModule("ctypes")
+select = LazyModule("select")
+hashlib = LazyModule("hashlib")
+difflib = LazyModule("difflib")
+argparse = LazyModule("argparse")
+fnmatch = LazyModule("fnmatch")
+futures = LazyModule("concurrent.futures")
+
+
+def atomic_write(path, write, before_replace=None):
+    """Атомарная запись: временный файл в той же папке, fsync и os.replace"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".notefish-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        
+        # Сохраняем права доступа исходного файла
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        
+        if before_replace is not None:
+            before_replace()
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+# Дельта правки: вид операции ("insert"/"delete"), индекс начала,
+# вставленный/удаленный текст и соседние символы слева и справа
+TextDelta = namedtuple("TextDelta", "kind index text left right")
+
+
+def count_words(text):
+    """Подсчет слов в строке"""
+    return len(text.split())
+
+
+class TextDeltaHook:
+    """Перехват команд insert/delete виджета Text для получения дельт правок"""
+    
+    # Ошибку из Python-колбэка нельзя бросить в Tcl, не прервав mainloop,
+    # поэтому dispatch возвращает пару (статус, результат), а обертка
+    # превращает статус error в ошибку команды
+    WRAPPER = """
+        if {{$op in {{insert delete replace edit}}}} {{
+            lassign [{hook} $op {{*}}$args] status result
+            if {{$status eq "error"}} {{
+                return -code error $result
+            }}
+            return $result
+        }}
+        return [{orig} $op {{*}}$args]
+    """
+    
+    def __init__(self, widget):
+        self.widget = widget
+        self.tk = widget.tk
+        self.listeners = []
+        
+        # Переименовываем команду виджета и подставляем Tcl-обертку: в Python
+        # уходят только правки, остальные команды идут в исходную напрямую,
+        # и их ошибки (например, get sel.first без выделения) доходят до
+        # catch в привязках Tk как есть
+        self.orig = widget._w + "_orig"
+        hook = widget._w + "_hook"
+        self.tk.call("rename", widget._w, self.orig)
+        self.tk.createcommand(hook, self.dispatch)
+        self.tk.call("proc", widget._w, "op args", self.WRAPPER.format(hook=hook, orig=self.orig))
+        
+        self.handlers = {
+            "insert": self._insert,
+            "delete": self._delete,
+            "replace": self._replace,
+            "edit": self._edit
+        }
+        
+        # Обработчик команд отмены вместо встроенного механизма Tk
+        self.undo_handler = None
+    
+    def add_listener(self, callback):
+        """Подписка на дельты правок"""
+        self.listeners.append(callback)
+    
+    def call(self, *args):
+        """Вызов исходной команды виджета в обход перехвата"""
+        return self.tk.call((self.orig,) + args)
+    
+    def dispatch(self, operation, *args):
+        """Обработчик команд правки: пара (статус, результат) для Tcl-обертки"""
+        try:
+            if self.call("cget", "-state") != "disabled":
+                result = self.handlers[operation](*args)
+            else:
+                result = self.call(operation, *args)
+        except tk.TclError as e:
+            return ("error", str(e))
+        return ("ok", "" if result is None else result)
+    
+    def compare(self, index1, op, index2):
+        """Сравнение индексов в обход перехвата"""
+        return self.tk.getboolean(self.call("compare", index1, op, index2))
+    
+    def _normalize(self, index):
+        """Нормализует индекс, не выходя за последний перевод строки"""
+        index = self.call("index", index)
+        if self.compare(index, ">", "end-1c"):
+            index = self.call("index", "end-1c")
+        return index
+    
+    def _notify(self, kind, index, text, left, right):
+        delta = TextDelta(kind, index, text, left, right)
+        for callback in self.listeners:
+            callback(delta)
+    
+    def _insert(self, index, *chunks):
+        start = self._normalize(index)
+        text = "".join(chunks[::2])
+        left = self.call("get", f"{start}-1c", start)
+        right = self.call("get", start)
+        
+        self.call("insert", start, *chunks)
+        if text:
+            self._notify("insert", start, text, left, right)
+    
+    def _delete_range(self, index1, index2=None):
+        start = self._normalize(index1)
+        end = self._normalize(index2 if index2 is not None else f"{start}+1c")
+        if not self.compare(start, "<", end):
+            return
+        
+        text = self.call("get", start, end)
+        left = self.call("get", f"{start}-1c", start)
+        right = self.call("get", end)
+        
+        self.call("delete", start, end)
+        self._notify("delete", start, text, left, right)
+    
+    def _delete(self, *args):
+        if len(args) <= 2:
+            self._delete_range(*args)
+            return
+        
+        # Несколько диапазонов удаляем с конца, чтобы индексы не сдвигались
+        ranges = [args[i:i + 2] for i in range(0, len(args), 2)]
+        ranges.sort(key=lambda r: tuple(map(int, self.call("index", r[0]).split("."))),
+                    reverse=True)
+        for index_range in ranges:
+            self._delete_range(*index_range)
+    
+    def _replace(self, index1, index2, *chunks):
+        start = self._normalize(index1)
+        self._delete_range(start, index2)
+        self._insert(start, *chunks)
+    
+    def _edit(self, *args):
+        if self.undo_handler is not None and args and args[0] in UndoJournal.COMMANDS:
+            return self.undo_handler(args[0])
+        return self.call("edit", *args)
+
+
+class DocumentStats:
+    """Статистика документа, обновляемая по дельтам правок"""
+    
+    def __init__(self):
+        self.chars = 0
+        self.lines = 1
+        self.words = 0
+    
+    def apply(self, delta):
+        """Учет одной правки без обхода всего документа"""
+        sign = 1 if delta.kind == "insert" else -1
+        
+        self.chars += sign * len(delta.text)
+        self.lines += sign * delta.text.count("\n")
+        
+        # Слова на стыке правки зависят только от соседних символов
+        joined = delta.left + delta.text + delta.right
+        self.words += sign * (count_words(joined) - count_words(delta.left + delta.right))
+
+
+# Куски документа хранятся в декартовом дереве (treap) по неявному ключу -
+# смещению в тексте, поэтому вставка, удаление и поиск строки занимают O(log n)
+class _Piece:
+    """Кусок документа: диапазон буфера и узел дерева"""
+    
+    __slots__ = ("buf", "start", "length", "newlines", "prio",
+                 "left", "right", "size", "lines")
+    
+    def __init__(self, buf, start, length, newlines):
+        self.buf = buf
+        self.start = start
+        self.length = length
+        self.newlines = newlines
+        self.prio = random.random()
+        self.left = None
+        self.right = None
+        self.size = length
+        self.lines = newlines
+    
+    def update(self):
+        """Пересчет размеров поддерева"""
+        self.size = self.length
+        self.lines = self.newlines
+        if self.left is not None:
+            self.size += self.left.size
+            self.lines += self.left.lines
+        if self.right is not None:
+            self.size += self.right.size
+            self.lines += self.right.lines
+
+
+def _merge_nodes(left, right):
+    """Слияние двух декартовых деревьев с сохранением порядка"""
+    if left is None:
+        return right
+    if right is None:
+        return left
+    if left.prio > right.prio:
+        left.right = _merge_nodes(left.right, right)
+        left.update()
+        return left
+    right.left = _merge_nodes(left, right.left)
+    right.update()
+    return right
+
+
+class PieceTable:
+    """Модель документа: таблица кусков над неизменяемыми буферами"""
+    
+    # Буфер последней вставки дописывается, пока не превысит этот размер,
+    # чтобы набор текста не порождал по куску на символ
+    APPEND_LIMIT = 4096
+    
+    # Буферы пересобираются, когда их объем вдвое больше текста, но не
+    # меньше этого числа символов: иначе малый документ пересобирался бы часто
+    COMPACT_MIN_CHARS = 1 << 20
+    
+    def __init__(self, text=""):
+        self._reset(text)
+    
+    def _reset(self, text):
+        """Новые буферы с единственным куском текста; прежние освобождаются"""
+        self.buffers = []
+        self.newlines = []
+        self.stored = 0
+        self.root = None
+        self.append_buf = None
+        if text:
+            self.root = self._new_piece(text)
+    
+    def __len__(self):
+        return self.root.size if self.root is not None else 0
+    
+    @property
+    def line_count(self):
+        """Число строк (строка после последнего перевода строки тоже считается)"""
+        return (self.root.lines if self.root is not None else 0) + 1
+    
+    def _new_piece(self, text):
+        """Новый буфер и кусок, покрывающий его целиком"""
+        self.buffers.append(text)
+        self.newlines.append(self._scan_newlines(text))
+        self.stored += len(text)
+        buf = len(self.buffers) - 1
+        return _Piece(buf, 0, len(text), len(self.newlines[buf]))
+    
+    @staticmethod
+    def _scan_newlines(text, base=0):
+        """Позиции переводов строк в тексте"""
+        parts = text.split("\n")
+        positions = map(operator.add, accumulate(map(len, parts[:-1])), count(base))
+        return array("q", positions)
+    
+    def _count_newlines(self, buf, start, end):
+        positions = self.newlines[buf]
+        return bisect_left(positions, end) - bisect_left(positions, start)
+    
+    def _split(self, node, offset):
+        """Делит дерево на первые offset символов и остаток"""
+        if node is None:
+            return None, None
+        
+        left_size = node.left.size if node.left is not None else 0
+        if offset <= left_size:
+            left, node.left = self._split(node.left, offset)
+            node.update()
+            return left, node
+        
+        offset -= left_size
+        if offset >= node.length:
+            node.right, right = self._split(node.right, offset - node.length)
+            node.update()
+            return node, right
+        
+        # Граница приходится на середину куска
+        tail = _Piece(node.buf, node.start + offset, node.length - offset,
+                      self._count_newlines(node.buf, node.start + offset,
+                                           node.start + node.length))
+        node.length = offset
+        node.newlines -= tail.newlines
+        right = _merge_nodes(tail, node.right)
+        node.right = None
+        node.update()
+        return node, right
+    
+    def insert(self, offset, text):
+        """Вставка текста по смещению"""
+        if not text:
+            return
+        
+        left, right = self._split(self.root, offset)
+        if not self._extend_last(left, text):
+            piece = self._new_piece(text)
+            self.append_buf = piece.buf if len(text) < self.APPEND_LIMIT else None
+            left = _merge_nodes(left, piece)
+        self.root = _merge_nodes(left, right)
+        self._compact()
+    
+    def _extend_last(self, tree, text):
+        """Дописывает текст в буфер последнего куска, если он продолжает набор"""
+        if tree is None or self.append_buf is None:
+            return False
+        
+        spine = [tree]
+        while spine[-1].right is not None:
+            spine.append(spine[-1].right)
+        node = spine[-1]
+        
+        buf = node.buf
+        data = self.buffers[buf]
+        if (buf != self.append_buf or node.start + node.length != len(data)
+                or len(data) + len(text) > self.APPEND_LIMIT):
+            return False
+        
+        self.buffers[buf] = data + text
+        self.stored += len(text)
+        added = self._scan_newlines(text, len(data))
+        self.newlines[buf].extend(added)
+        node.length += len(text)
+        node.newlines += len(added)
+        for parent in reversed(spine):
+            parent.update()
+        return True
+    
+    def delete(self, offset, length):
+        """Удаление length символов начиная со смещения"""
+        if length <= 0:
+            return
+        left, rest = self._split(self.root, offset)
+        _, right = self._split(rest, length)
+        self.root = _merge_nodes(left, right)
+        self._compact()
+    
+    def _compact(self):
+        """Освобождение буферов, на которые почти не осталось кусков"""
+        if self.root is None:
+            if self.stored:
+                self._reset("")
+        elif self.stored > max(2 * len(self), self.COMPACT_MIN_CHARS):
+            self._reset(self.get_text())
+    
+    def get_text(self, start=0, end=None):
+        """Текст диапазона [start, end)"""
+        if end is None:
+            end = len(self)
+        chunks = []
+        if start < end:
+            self._collect(self.root, 0, start, end, chunks)
+        return "".join(chunks)
+    
+    def _collect(self, node, base, start, end, chunks):
+        """Сбор кусков диапазона с отсечением поддеревьев вне его"""
+        while node is not None:
+            piece_start = base + (node.left.size if node.left is not None else 0)
+            if start < piece_start:
+                self._collect(node.left, base, start, end, chunks)
+            if piece_start >= end:
+                return
+            
+            low = max(start, piece_start) - piece_start
+            high = min(end, piece_start + node.length) - piece_start
+            if low < high:
+                chunks.append(self.buffers[node.buf][node.start + low:node.start + high])
+            
+            base = piece_start + node.length
+            if base >= end:
+                return
+            node = node.right
+    
+    def line_start(self, line):
+        """Смещение начала строки (нумерация с 0)"""
+        if line <= 0:
+            return 0
+        
+        node = self.root
+        base = 0
+        while node is not None:
+            left_lines = node.left.lines if node.left is not None else 0
+            if line <= left_lines:
+                node = node.left
+                continue
+            
+            line -= left_lines
+            base += node.left.size if node.left is not None else 0
+            if line <= node.newlines:
+                positions = self.newlines[node.buf]
+                position = positions[bisect_left(positions, node.start) + line - 1]
+                return base + position - node.start + 1
+            
+            line -= node.newlines
+            base += node.length
+            node = node.right
+        
+        return len(self)
+    
+    def line_of(self, offset):
+        """Номер строки (с 0), в которой находится смещение"""
+        line = 0
+        node = self.root
+        while node is not None:
+            left_size = node.left.size if node.left is not None else 0
+            if offset < left_size:
+                node = node.left
+                continue
+            
+            offset -= left_size
+            line += node.left.lines if node.left is not None else 0
+            if offset < node.length:
+                return line + self._count_newlines(node.buf, node.start,
+                                                   node.start + offset)
+            
+            offset -= node.length
+            line += node.newlines
+            node = node.right
+        
+        return line
+    
+    def position(self, offset):
+        """Строка и колонка (с 0) для смещения"""
+        line = self.line_of(offset)
+        return line, offset - self.line_start(line)
+    
+    def offset(self, line, column=0):
+        """Смещение по строке и колонке (с 0)"""
+        return min(self.line_start(line) + column, len(self))
+    
+    def get_line(self, line):
+        """Текст строки без перевода строки"""
+        start = self.line_start(line)
+        end = self.line_start(line + 1)
+        text = self.get_text(start, end)
+        return text[:-1] if text.endswith("\n") else text
+
+
+# Файл оформления рядом с текстовым файлом
+FORMAT_SUFFIX = ".nfmt"
+
+# Запас строк вокруг видимой области для тегов оформления
+FORMAT_MARGIN_LINES = 50
+
+
+class _Span:
+    """Участок текста с одинаковым оформлением: узел дерева интервалов"""
+    
+    __slots__ = ("length", "attrs", "prio", "left", "right", "size")
+    
+    def __init__(self, length, attrs):
+        self.length = length
+        self.attrs = attrs
+        self.prio = random.random()
+        self.left = None
+        self.right = None
+        self.size = length
+    
+    def update(self):
+        """Пересчет длины поддерева"""
+        self.size = self.length
+        if self.left is not None:
+            self.size += self.left.size
+        if self.right is not None:
+            self.size += self.right.size
+
+
+class SpanStore:
+    """Оформление текста (жирный, курсив, подчеркивание, цвет) по участкам.
+    
+    Текст целиком покрыт участками в декартовом дереве с неявными
+    смещениями, поэтому правки сдвигают оформление за O(log n).
+    Соседние участки с одинаковым оформлением сливаются.
+    """
+    
+    ATTRIBUTES = ("bold", "italic", "underline", "color")
+    DEFAULT = (False, False, False, None)
+    
+    def __init__(self):
+        self.root = None
+    
+    def __len__(self):
+        return self.root.size if self.root is not None else 0
+    
+    def is_plain(self):
+        """Нет ни одного оформленного участка"""
+        root = self.root
+        return root is None or (root.attrs == self.DEFAULT and root.length == root.size)
+    
+    def _split(self, node, offset):
+        """Делит дерево на первые offset символов и остаток"""
+        if node is None:
+            return None, None
+        
+        left_size = node.left.size if node.left is not None else 0
+        if offset <= left_size:
+            left, node.left = self._split(node.left, offset)
+            node.update()
+            return left, node
+        
+        offset -= left_size
+        if offset >= node.length:
+            node.right, right = self._split(node.right, offset - node.length)
+            node.update()
+            return node, right
+        
+        tail = _Span(node.length - offset, node.attrs)
+        node.length = offset
+        right = _merge_nodes(tail, node.right)
+        node.right = None
+        node.update()
+        return node, right
+    
+    @staticmethod
+    def _edge(tree, side):
+        """Путь от корня до крайнего левого или правого участка"""
+        path = [tree]
+        while getattr(path[-1], side) is not None:
+            path.append(getattr(path[-1], side))
+        return path
+    
+    def _join(self, left, right):
+        """Слияние деревьев с объединением одинаковых участков на стыке"""
+        if left is None or right is None:
+            return _merge_nodes(left, right)
+        
+        last = self._edge(left, "right")
+        first = self._edge(right, "left")[-1]
+        if last[-1].attrs == first.attrs:
+            _, right = self._split(right, first.length)
+            last[-1].length += first.length
+            for node in reversed(last):
+                node.update()
+        return _merge_nodes(left, right)
+    
+    def insert(self, offset, length):
+        """Вставка текста: новые символы наследуют оформление слева"""
+        if length <= 0:
+            return
+        
+        left, right = self._split(self.root, offset)
+        if left is not None:
+            path = self._edge(left, "right")
+        elif right is not None:
+            path = self._edge(right, "left")
+        else:
+            self.root = _Span(length, self.DEFAULT)
+            return
+        
+        path[-1].length += length
+        for node in reversed(path):
+            node.update()
+        self.root = self._join(left, right)
+    
+    def delete(self, offset, length):
+        """Удаление участка текста"""
+        if length <= 0:
+            return
+        left, rest = self._split(self.root, offset)
+        _, right = self._split(rest, length)
+        self.root = self._join(left, right)
+    
+    def runs(self, start=0, end=None):
+        """Участки (начало, конец, оформление), пересекающие [start, end)"""
+        if end is None:
+            end = len(self)
+        result = []
+        if start < end:
+            self._collect(self.root, 0, start, end, result)
+        return result
+    
+    def _collect(self, node, base, start, end, result):
+        while node is not None:
+            run_start = base + (node.left.size if node.left is not None else 0)
+            if start < run_start:
+                self._collect(node.left, base, start, end, result)
+            if run_start >= end:
+                return
+            
+            run_end = run_start + node.length
+            if run_end > start:
+                result.append((run_start, run_end, node.attrs))
+            
+            base = run_end
+            node = node.right
+    
+    def _build(self, runs):
+        """Дерево из списка (длина, оформление) со слиянием соседей"""
+        tree = None
+        for length, attrs in runs:
+            if length > 0:
+                tree = self._join(tree, _Span(length, attrs))
+        return tree
+    
+    def is_set(self, start, end, attribute):
+        """Включен ли атрибут на всем участке"""
+        index = self.ATTRIBUTES.index(attribute)
+        return all(attrs[index] for _, _, attrs in self.runs(start, end))
+    
+    def set(self, start, end, attribute, value):
+        """Установка атрибута на участке [start, end)"""
+        if start >= end:
+            return
+        index = self.ATTRIBUTES.index(attribute)
+        
+        left, rest = self._split(self.root, start)
+        middle, right = self._split(rest, end - start)
+        
+        runs = []
+        self._collect(middle, 0, 0, end - start, runs)
+        middle = self._build([(run_end - run_start,
+                               attrs[:index] + (value,) + attrs[index + 1:])
+                              for run_start, run_end, attrs in runs])
+        
+        self.root = self._join(self._join(left, middle), right)
+    
+    def to_records(self):
+        """Компактная запись: [начало, конец, флаги, цвет] оформленных участков"""
+        records = []
+        for start, end, attrs in self.runs():
+            if attrs != self.DEFAULT:
+                bold, italic, underline, color = attrs
+                flags = bold | italic << 1 | underline << 2
+                records.append([start, end, flags, color])
+        return records
+    
+    def load(self, records, length):
+        """Восстановление оформления из записей для текста длины length"""
+        runs = []
+        position = 0
+        for start, end, flags, color in records:
+            if not position <= start <= end <= length:
+                raise ValueError("Участки оформления вне текста")
+            runs.append((start - position, self.DEFAULT))
+            attrs = (bool(flags & 1), bool(flags & 2), bool(flags & 4), color)
+            runs.append((end - start, attrs))
+            position = end
+        runs.append((length - position, self.DEFAULT))
+        self.root = self._build(runs)
+
+
+# Предел памяти журнала отмены, после которого старые шаги уходят на диск
+UNDO_MEMORY_LIMIT_MB = 32
+
+
+class UndoJournal:
+    """Журнал отмены из дельт с ограничением памяти и выгрузкой на диск"""
+    
+    # Команды "edit", которые обрабатывает журнал
+    COMMANDS = ("undo", "redo", "separator", "reset", "canundo", "canredo")
+    
+    # Примерные накладные расходы на одну дельту в байтах
+    DELTA_OVERHEAD = 64
+    
+    def __init__(self, memory_limit=UNDO_MEMORY_LIMIT_MB * 1024 * 1024):
+        self.memory_limit = memory_limit
+        self.spill_file = None
+        self.reset()
+    
+    def reset(self):
+        """Очистка истории"""
+        # Временный файл выгрузки закрывается сразу, а не при сборке мусора
+        if self.spill_file is not None:
+            self.spill_file.close()
+        
+        # Шаг - список дельт (вид, смещение, текст) в порядке применения
+        self.undo_stack = []
+        self.redo_stack = []
+        self.memory = 0
+        self.separated = True
+        self.grouping = False
+        
+        # Выгруженные шаги: сжатые пачки во временном файле, старые первыми
+        self.spilled = []
+        self.spill_file = None
+    
+    @classmethod
+    def step_size(cls, step):
+        return sum(len(text) + cls.DELTA_OVERHEAD for _, _, text in step)
+    
+    def separator(self):
+        """Граница шага: следующая правка начнет новый шаг"""
+        self.separated = True
+    
+    def begin_group(self):
+        """Начало шага, в который попадут все правки до end_group"""
+        self.separated = True
+        self.grouping = True
+    
+    def end_group(self):
+        self.grouping = False
+        self.separated = True
+    
+    def can_undo(self):
+        return bool(self.undo_stack or self.spilled)
+    
+    def can_redo(self):
+        return bool(self.redo_stack)
+    
+    def record(self, kind, offset, text):
+        """Запись правки; последовательный набор объединяется в один шаг"""
+        for step in self.redo_stack:
+            self.memory -= self.step_size(step)
+        self.redo_stack = []
+        
+        if self.grouping and not self.separated:
+            self.undo_stack[-1].append((kind, offset, text))
+            self.memory += len(text) + self.DELTA_OVERHEAD
+        elif not self.separated and self.undo_stack and self._merge(kind, offset, text):
+            self.memory += len(text)
+        else:
+            self.undo_stack.append([(kind, offset, text)])
+            self.memory += len(text) + self.DELTA_OVERHEAD
+        
+        # Перевод строки и вставка фрагмента завершают шаг, если он не групповой
+        self.separated = not self.grouping and (len(text) != 1 or text == "\n")
+        
+        if self.memory > self.memory_limit:
+            self.spill()
+    
+    def _merge(self, kind, offset, text):
+        """Попытка дописать односимвольную правку в последнюю дельту"""
+        step = self.undo_stack[-1]
+        last_kind, last_offset, last_text = step[-1]
+        if kind != last_kind or len(text) != 1:
+            return False
+        
+        if kind == "insert" and offset == last_offset + len(last_text):
+            step[-1] = (kind, last_offset, last_text + text)
+        elif kind == "delete" and offset + 1 == last_offset:
+            # Backspace
+            step[-1] = (kind, offset, text + last_text)
+        elif kind == "delete" and offset == last_offset:
+            # Delete
+            step[-1] = (kind, offset, last_text + text)
+        else:
+            return False
+        return True
+    
+    def spill(self):
+        """Сжатие и выгрузка старых шагов во временный файл"""
+        target = self.memory - self.memory_limit * 3 // 4
+        count = 0
+        freed = 0
+        
+        # Последний шаг всегда остается в памяти
+        while count < len(self.undo_stack) - 1 and freed < target:
+            freed += self.step_size(self.undo_stack[count])
+            count += 1
+        if not count:
+            return
+        
+        data = zlib.compress(pickle.dumps(self.undo_stack[:count]))
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="notefish-undo-")
+        
+        position = self.spill_file.seek(0, os.SEEK_END)
+        self.spill_file.write(data)
+        self.spilled.append((position, len(data)))
+        
+        del self.undo_stack[:count]
+        self.memory -= freed
+    
+    def restore(self):
+        """Загрузка последней выгруженной пачки обратно в память"""
+        position, length = self.spilled.pop()
+        self.spill_file.seek(position)
+        steps = pickle.loads(zlib.decompress(self.spill_file.read(length)))
+        
+        # Пачки читаются в обратном порядке, место в файле освобождается
+        self.spill_file.truncate(position)
+        self.undo_stack[:0] = steps
+        self.memory += sum(self.step_size(step) for step in steps)
+    
+    def undo(self):
+        """Шаг для отмены (применять обратные дельты в обратном порядке)"""
+        if not self.undo_stack and self.spilled:
+            self.restore()
+        if not self.undo_stack:
+            return None
+        
+        step = self.undo_stack.pop()
+        self.redo_stack.append(step)
+        self.separated = True
+        return step
+    
+    def redo(self):
+        """Шаг для повтора"""
+        if not self.redo_stack:
+            return None
+        
+        step = self.redo_stack.pop()
+        self.undo_stack.append(step)
+        self.separated = True
+        return step
+
+
+class UpdateScheduler:
+    """Планировщик обновлений интерфейса с объединением повторных запросов"""
+    
+    def __init__(self, root):
+        self.root = root
+        self.consumers = {}
+        self.delays = {}
+        self.waiting = {}
+        self.due = set()
+        self.idle_job = None
+        
+        # Счетчики запросов, выполнений и объединенных обновлений
+        self.requested = Counter()
+        self.executed = Counter()
+        self.coalesced = Counter()
+    
+    def register(self, name, callback, delay=0):
+        """Регистрация потребителя с окном задержки в миллисекундах"""
+        self.consumers[name] = callback
+        self.delays[name] = delay
+    
+    def set_delay(self, name, delay):
+        """Изменение окна задержки потребителя"""
+        if name in self.consumers:
+            self.delays[name] = max(0, int(delay))
+    
+    def request(self, name, event=None):
+        """Запрос обновления; повторные запросы до выполнения объединяются"""
+        self.requested[name] += 1
+        if name in self.due or name in self.waiting:
+            self.coalesced[name] += 1
+            return
+        
+        delay = self.delays.get(name, 0)
+        if delay:
+            self.waiting[name] = self.root.after(delay, self._make_due, name)
+        else:
+            self._make_due(name)
+    
+    def cancel(self, name):
+        """Отмена ожидающего обновления"""
+        job = self.waiting.pop(name, None)
+        if job is not None:
+            self.root.after_cancel(job)
+        self.due.discard(name)
+    
+    def pending(self, name):
+        """Запрошено ли обновление и еще не выполнено"""
+        return name in self.due or name in self.waiting
+    
+    def _make_due(self, name):
+        self.waiting.pop(name, None)
+        self.due.add(name)
+        if self.idle_job is None:
+            self.idle_job = self.root.after_idle(self.flush)
+    
+    def flush(self):
+        """Выполнение всех готовых обновлений за один проход"""
+        self.idle_job = None
+        due, self.due = self.due, set()
+        
+        # Порядок вызова совпадает с порядком регистрации
+        for name, callback in self.consumers.items():
+            if name in due:
+                self.executed[name] += 1
+                callback()
+    
+    def counters(self):
+        """Счетчики по каждому потребителю"""
+        return {
+            name: {
+                "requested": self.requested[name],
+                "executed": self.executed[name],
+                "coalesced": self.coalesced[name]
+            }
+            for name in self.consumers
+        }
+
+
+# Кодировка определяется по началу файла такого размера
+ENCODING_SNIFF_BYTES = 64 * 1024
+
+# Метки BOM; UTF-32 проверяется раньше UTF-16, их BOM начинаются одинаково
+ENCODING_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be")
+)
+
+# Названия кодировок в строке состояния
+ENCODING_NAMES = {
+    "utf-8": "UTF-8",
+    "utf-16-le": "UTF-16 LE",
+    "utf-16-be": "UTF-16 BE",
+    "utf-32-le": "UTF-32 LE",
+    "utf-32-be": "UTF-32 BE",
+    "cp1251": "Windows-1251",
+    "latin-1": "Latin-1"
+}
+
+NEWLINE_NAMES = {"\r\n": "CRLF", "\n": "LF", "\r": "CR"}
+
+# Кодировка, BOM, перевод строки файла и признак замены недопустимых байтов
+FileFormat = namedtuple("FileFormat", ["encoding", "bom", "newline", "lossy"])
+DEFAULT_FILE_FORMAT = FileFormat("utf-8", b"", os.linesep, False)
+
+
+# Слово из букв cp1251 с обычным для русского текста регистром: строчные,
+# с заглавной в начале или целиком заглавные
+CP1251_WORD_RE = re.compile(rb"[\xa8\xc0-\xdf]?[\xb8\xe0-\xff]+|[\xa8\xc0-\xdf]+")
+
+
+def guess_8bit_encoding(data):
+    """cp1251 или latin-1 по словам с байтами за пределами ASCII"""
+    # Русское слово в cp1251 не содержит латинских букв и не меняет регистр
+    # в середине, а буквы с диакритикой в latin-1 стоят среди латинских
+    # (Grüße: в cp1251 это было бы "GrьЯe"). Однобуквенные слова
+    # встречаются в обоих языках и не учитываются
+    cyrillic = latin = 0
+    for word in re.findall(rb"[A-Za-z\xa8\xb8\xc0-\xff]+", data):
+        if word.isascii():
+            continue
+        if CP1251_WORD_RE.fullmatch(word):
+            cyrillic += len(word) > 1
+        else:
+            latin += 1
+    return "cp1251" if cyrillic > latin else "latin-1"
+
+
+def detect_encoding(prefix):
+    """Кодировка и BOM по началу файла"""
+    for bom, encoding in ENCODING_BOMS:
+        if prefix.startswith(bom):
+            return encoding, bom
+
+    # UTF-16 без BOM: в латинице и цифрах нулевой каждый второй байт,
+    # всегда с одной стороны пары; иначе обилие нулей - двоичный файл,
+    # который latin-1 читает и записывает без потерь
+    sample = prefix[:4096]
+    sample = sample[:len(sample) // 2 * 2]
+    pairs = len(sample) // 2
+    if pairs and sample.count(0) > len(sample) // 4:
+        for encoding, high, low in (("utf-16-le", sample[1::2], sample[0::2]),
+                                    ("utf-16-be", sample[0::2], sample[1::2])):
+            if high.count(0) > pairs // 2 and low.count(0) <= pairs // 20:
+                try:
+                    sample.decode(encoding)
+                except UnicodeDecodeError:
+                    break
+                return encoding, b""
+        return "latin-1", b""
+
+    # Оборванная в конце префикса последовательность UTF-8 допустима
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(prefix, final=False)
+        return "utf-8", b""
+    except UnicodeDecodeError:
+        return guess_8bit_encoding(prefix), b""
+
+
+def sniff_encoding(path):
+    """Кодировка и BOM файла по его началу"""
+    with open(path, "rb") as f:
+        return detect_encoding(f.read(ENCODING_SNIFF_BYTES))
+
+
+def ascii_compatible(encoding):
+    """Совпадают ли ASCII и перевод строки с однобайтовыми"""
+    return not encoding.startswith(("utf-16", "utf-32"))
+
+
+def format_label(file_format):
+    """Текст строки состояния: кодировка и перевод строки"""
+    label = ENCODING_NAMES.get(file_format.encoding, file_format.encoding.upper())
+    if file_format.bom:
+        label += " BOM"
+    if file_format.lossy:
+        label += " (с заменами)"
+    return f"{label} · {NEWLINE_NAMES.get(file_format.newline, 'LF')}"
+
+
+# Файлы больше этого размера открываются в виртуальном режиме
+LARGE_FILE_THRESHOLD_MB = 64
+
+# Число строк в окне виджета и запас до края окна, после которого
+# окно перемещается вслед за областью просмотра
+LARGE_WINDOW_LINES = 3000
+LARGE_WINDOW_MARGIN = 500
+
+
+class LargeFileDocument:
+    """Документ большого файла, отображенного в память (mmap)
+
+    Кодировка должна быть совместима с ASCII (см. ascii_compatible):
+    строки ищутся по байту перевода строки.
+    """
+    
+    # Смещение запоминается для каждой BLOCK-й строки
+    BLOCK = 1024
+    CHUNK = 4 * 1024 * 1024
+    
+    def __init__(self, path):
+        self.path = path
+        self.open_mapping()
+        self.detect_format()
+        self.build_index()
+        
+        # Документ - последовательность кусков: диапазонов строк файла
+        # ("orig", начало, конец) и отредактированных строк ("text", строки)
+        self.pieces = [("orig", 0, self.orig_lines)]
+        self.line_count = self.orig_lines
+    
+    def open_mapping(self):
+        """Отображение файла в память"""
+        self.file = open(self.path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        
+        # Пустой файл отобразить нельзя
+        if self.size:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.mm = b""
+    
+    def detect_format(self):
+        """Кодировка, BOM и перевод строки по началу файла"""
+        prefix = self.mm[:ENCODING_SNIFF_BYTES]
+        self.encoding, self.bom = detect_encoding(prefix)
+        
+        # Стиль перевода строки - по первой строке
+        pos = prefix.find(b"\n")
+        self.newline = "\r\n" if pos > 0 and prefix[pos - 1] == 0x0D else "\n"
+    
+    @property
+    def file_format(self):
+        return FileFormat(self.encoding, self.bom, self.newline, False)
+    
+    def build_index(self):
+        """Построение разреженного индекса начала строк"""
+        self.block_offsets = array("q", [0])
+        newlines = 0
+        remaining = self.BLOCK
+        pos = 0
+        
+        while pos < self.size:
+            chunk = self.mm[pos:pos + self.CHUNK]
+            found = chunk.count(b"\n")
+            
+            if found >= remaining:
+                # Начала строк внутри блока считаются на стороне C
+                starts = map(operator.add,
+                             accumulate(map(len, chunk.split(b"\n"))), count(1))
+                for start in islice(starts, remaining - 1, found, self.BLOCK):
+                    self.block_offsets.append(pos + start)
+                remaining = self.BLOCK - (found - remaining) % self.BLOCK
+            else:
+                remaining -= found
+            
+            newlines += found
+            pos += len(chunk)
+        
+        self.orig_lines = newlines + 1
+    
+    def line_offset(self, line):
+        """Байтовое смещение начала строки исходного файла"""
+        if line >= self.orig_lines:
+            return self.size
+        
+        pos = self.block_offsets[line // self.BLOCK]
+        for _ in range(line % self.BLOCK):
+            pos = self.mm.find(b"\n", pos) + 1
+        return pos
+    
+    def orig_range(self, start, stop):
+        """Байтовый диапазон строк [start, stop) без последнего перевода строки"""
+        # BOM пишется отдельно и в текст первой строки не входит
+        begin = max(self.line_offset(start), len(self.bom))
+        end = self.line_offset(stop) - 1 if stop < self.orig_lines else self.size
+        if self.newline == "\r\n" and end > begin and self.mm[end - 1] == 0x0D:
+            end -= 1
+        return begin, end
+    
+    def orig_lines_text(self, start, stop):
+        """Строки исходного файла [start, stop)"""
+        if start >= stop:
+            return []
+        begin, end = self.orig_range(start, stop)
+        lines = self.mm[begin:end].decode(self.encoding, errors="replace").split("\n")
+        if self.newline == "\r\n":
+            lines = [line[:-1] if line.endswith("\r") else line for line in lines]
+        return lines
+    
+    @staticmethod
+    def piece_length(piece):
+        if piece[0] == "orig":
+            return piece[2] - piece[1]
+        return len(piece[1])
+    
+    def get_lines(self, start, stop):
+        """Строки документа [start, stop) с учетом правок"""
+        result = []
+        line = 0
+        
+        for piece in self.pieces:
+            length = self.piece_length(piece)
+            if line + length > start and line < stop:
+                low = max(start, line) - line
+                high = min(stop, line + length) - line
+                if piece[0] == "orig":
+                    result.extend(self.orig_lines_text(piece[1] + low, piece[1] + high))
+                else:
+                    result.extend(piece[1][low:high])
+            
+            line += length
+            if line >= stop:
+                break
+        
+        return result
+    
+    def blocks(self, pieces, size):
+        """Строки снимка кусков блоками до size строк: (номер первой строки, строки)"""
+        line = 0
+        for piece in pieces:
+            if piece[0] == "orig":
+                for start in range(piece[1], piece[2], size):
+                    stop = min(start + size, piece[2])
+                    yield line + start - piece[1], self.orig_lines_text(start, stop)
+            else:
+                for start in range(0, len(piece[1]), size):
+                    yield line + start, piece[1][start:start + size]
+            line += self.piece_length(piece)
+    
+    def split_piece(self, line):
+        """Разрезает кусок на границе строки, возвращает индекс следующего куска"""
+        position = 0
+        for i, piece in enumerate(self.pieces):
+            if line == position:
+                return i
+            
+            length = self.piece_length(piece)
+            if line < position + length:
+                k = line - position
+                if piece[0] == "orig":
+                    left = ("orig", piece[1], piece[1] + k)
+                    right = ("orig", piece[1] + k, piece[2])
+                else:
+                    left = ("text", piece[1][:k])
+                    right = ("text", piece[1][k:])
+                self.pieces[i:i + 1] = [left, right]
+                return i + 1
+            
+            position += length
+        
+        return len(self.pieces)
+    
+    def replace_lines(self, start, stop, lines):
+        """Замена строк [start, stop) отредактированными строками (оверлей)"""
+        first = self.split_piece(start)
+        last = self.split_piece(stop)
+        self.pieces[first:last] = [("text", list(lines))]
+        self.pieces = [p for p in self.pieces if self.piece_length(p)]
+        self.line_count += len(lines) - (stop - start)
+    
+    def write_to(self, file, pieces=None):
+        """Запись документа (или снимка его кусков) в двоичный файл потоково"""
+        newline = self.newline.encode(self.encoding)
+        file.write(self.bom)
+        
+        first = True
+        for piece in self.pieces if pieces is None else pieces:
+            if not first:
+                file.write(newline)
+            first = False
+            
+            if piece[0] == "orig":
+                begin, end = self.orig_range(piece[1], piece[2])
+                while begin < end:
+                    file.write(self.mm[begin:min(end, begin + self.CHUNK)])
+                    begin += self.CHUNK
+            else:
+                file.write(self.newline.join(piece[1]).encode(self.encoding))
+    
+    def save(self, path, pieces=None):
+        """Атомарное сохранение; после успешной записи документ закрыт"""
+        try:
+            # Отображение нужно закрыть до замены исходного файла
+            atomic_write(path, lambda file: self.write_to(file, pieces),
+                         before_replace=self.close)
+        except OSError:
+            # Исходный файл не изменился - правки остаются поверх него
+            if self.file.closed:
+                self.open_mapping()
+            raise
+    
+    def close(self):
+        """Освобождение отображения и файла"""
+        if isinstance(self.mm, mmap.mmap) and not self.mm.closed:
+            self.mm.close()
+        self.file.close()
+
+
+# Отметка файла на диске: размер, время изменения и inode
+FileStamp = namedtuple("FileStamp", ["size", "mtime", "inode"])
+
+
+def file_stamp(path):
+    """Отметка файла или None, если его нет"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return FileStamp(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+# Строка длиннее этого числа символов включает режим без переноса:
+# раскладка Tk на таких строках с переносом по словам сверхлинейна
+LONG_LINE_CHARS = 10_000
+LONG_LINE_RE = re.compile(r"[^\n]{%d}" % LONG_LINE_CHARS)
+
+# Период опроса очереди загрузки и бюджет вставки за один тик
+LOAD_POLL_MS = 10
+LOAD_SLICE_SECONDS = 0.015
+
+
+class ChunkReader:
+    """Основа фоновых читателей файла: поток, очередь порций и отмена"""
+    
+    CHUNK = 256 * 1024
+    
+    def __init__(self, path, encoding, bom=b""):
+        self.path = path
+        self.encoding = encoding
+        self.bom = bom
+        self.error = None
+        
+        # Ограниченная очередь не дает потоку обогнать интерфейс по памяти
+        self.queue = queue.Queue(maxsize=16)
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def start(self):
+        """Запуск потока чтения"""
+        self.thread.start()
+    
+    def cancel(self):
+        """Отмена чтения"""
+        self.cancelled.set()
+    
+    def make_decoder(self, errors="strict"):
+        # Переводы строк приводятся к \n, как при открытии в текстовом режиме
+        return io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(self.encoding)(errors), translate=True)
+    
+    def put(self, item):
+        """Передача порции в очередь с учетом отмены"""
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+
+class FileLoader(ChunkReader):
+    """Чтение и декодирование файла порциями в фоновом потоке"""
+    
+    # Первая порция маленькая, чтобы первый экран появился сразу
+    FIRST_CHUNK = 64 * 1024
+    
+    def __init__(self, path, encoding=None):
+        # Без явной кодировки она определяется по первой порции
+        super().__init__(path, encoding)
+        self.newline = None
+        self.lossy = False
+        self.size = os.path.getsize(path)
+        self.bytes_read = 0
+        self.digest = None
+        self.stamp = None
+        
+        # Найдена ли слишком длинная строка; длина незаконченной строки
+        self.long_lines = False
+        self.line_run = 0
+    
+    @property
+    def file_format(self):
+        return FileFormat(self.encoding, self.bom, self.newline or os.linesep, self.lossy)
+    
+    def progress(self):
+        """Доля прочитанного файла от 0 до 1"""
+        return self.bytes_read / self.size if self.size else 1.0
+    
+    def fallback_decoder(self, state, data, ascii_only):
+        """Декодер остатка файла и данные для него, когда кодировка не подошла"""
+        pending, flag = state
+        if ascii_only and self.encoding == "utf-8":
+            # Декодированное до сих пор - ASCII, он одинаков во всех
+            # 8-битных кодировках, поэтому перечитывать начало не нужно;
+            # заново декодируется только недоразобранный хвост прошлой порции
+            self.encoding = guess_8bit_encoding(pending + data)
+            decoder = self.make_decoder()
+            decoder.setstate((b"", flag))
+            return decoder, pending + data
+        
+        # Состояние переносится: не теряются \r и байты в конце порции
+        self.lossy = True
+        decoder = self.make_decoder("replace")
+        decoder.setstate(state)
+        return decoder, data
+    
+    def run(self):
+        try:
+            with open(self.path, "rb") as file:
+                for text in self.decode(self.read(file)):
+                    self.put(text)
+        except Exception as e:
+            self.error = e
+        
+        # Признак окончания чтения
+        self.put(None)
+    
+    def read(self, file):
+        """Порции файла до конца или отмены; по прочитанному считаются хэш и отметка"""
+        digest = hashlib.blake2b()
+        size = self.FIRST_CHUNK
+        while not self.cancelled.is_set():
+            data = file.read(size)
+            size = self.CHUNK
+            if not data:
+                # Размер в отметке - прочитанные байты, а не текущий размер
+                # файла: дописанное после чтения не считается увиденным
+                stat = os.fstat(file.fileno())
+                self.stamp = FileStamp(self.bytes_read, stat.st_mtime_ns, stat.st_ino)
+                self.digest = digest.hexdigest()
+                return
+            
+            digest.update(data)
+            self.bytes_read += len(data)
+            yield data
+    
+    def decode(self, chunks):
+        """Текст из порций байтов; без явной кодировки она определяется по первой"""
+        decoder = None
+        ascii_only = True
+        
+        # Пустая порция в конце - сигнал декодеру выдать остаток
+        for data in chain(chunks, [b""]):
+            if decoder is None:
+                if self.encoding is None:
+                    self.encoding, self.bom = detect_encoding(data)
+                data = data[len(self.bom):]
+                decoder = self.make_decoder()
+            
+            while True:
+                state = decoder.getstate()
+                try:
+                    text = decoder.decode(data, final=not data)
+                    break
+                except UnicodeDecodeError:
+                    decoder, data = self.fallback_decoder(state, data, ascii_only)
+            
+            ascii_only = ascii_only and text.isascii()
+            if self.newline is None and decoder.newlines:
+                newlines = decoder.newlines
+                if isinstance(newlines, tuple):
+                    # Смешанные переводы строк: CRLF сохраняется, если встречался
+                    newlines = "\r\n" if "\r\n" in newlines else newlines[-1]
+                self.newline = newlines
+            
+            if text:
+                if not self.long_lines:
+                    self.scan_lines(text)
+                yield text
+    
+    def scan_lines(self, text):
+        """Поиск слишком длинной строки, в том числе на стыке порций"""
+        first = text.find("\n")
+        if first < 0:
+            self.line_run += len(text)
+            longest = self.line_run
+        else:
+            longest = self.line_run + first
+            self.line_run = len(text) - text.rfind("\n") - 1
+        
+        if longest >= LONG_LINE_CHARS or self.line_run >= LONG_LINE_CHARS or \
+                LONG_LINE_RE.search(text):
+            self.long_lines = True
+
+
+# Слежение за файлом: период опроса очереди, период проверки файла
+# без inotify и предел числа строк в буфере (0 - без предела)
+FOLLOW_POLL_MS = 100
+FOLLOW_STAT_SECONDS = 0.5
+FOLLOW_MAX_LINES = 100_000
+
+
+class FileWatch:
+    """Ожидание изменений в папке файла: inotify на Linux, иначе пауза для опроса stat"""
+    
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    # | IN_CREATE | IN_DELETE: запись, ротация и пересоздание файла
+    MASK = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+    
+    def __init__(self, path):
+        self.fd = None
+        if not sys.platform.startswith("linux"):
+            return
+        
+        # Папка, а не файл: после ротации по тому же пути лежит новый файл
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return
+            if libc.inotify_add_watch(fd, os.fsencode(directory), self.MASK) < 0:
+                os.close(fd)
+                return
+            self.fd = fd
+        except (OSError, AttributeError):
+            pass
+    
+    def wait(self, timeout):
+        """Ожидание события или истечения timeout секунд"""
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if ready:
+            # События только будят поток - их содержимое не нужно
+            try:
+                while os.read(self.fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+    
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FileFollower(ChunkReader):
+    """Чтение дописываемого в файл в фоновом потоке, начиная с байта offset.
+    
+    В очередь идут ("text", текст, смещение после него) и ("reset", "", 0) -
+    файл заменен при ротации или усечен и читается заново; None - конец.
+    """
+    
+    def __init__(self, path, offset, file_format):
+        super().__init__(path, file_format.encoding, file_format.bom)
+        self.offset = offset
+    
+    def run(self):
+        watch = FileWatch(self.path)
+        file = None
+        try:
+            file = open(self.path, "rb")
+            self.decoder = self.make_decoder("replace")
+            while not self.cancelled.is_set():
+                file = self.check(file)
+                watch.wait(FOLLOW_STAT_SECONDS)
+        except Exception as e:
+            self.error = e
+        finally:
+            watch.close()
+            if file is not None:
+                file.close()
+        
+        # Признак окончания слежения
+        self.put(None)
+    
+    def check(self, file):
+        """Чтение дописанного; при ротации и усечении файл читается заново"""
+        # Старый файл дочитывается до конца и после ротации
+        self.read_new(file)
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # Файл переименован, а новый еще не создан
+            return file
+        
+        current = os.fstat(file.fileno())
+        if (stat.st_ino, stat.st_dev) != (current.st_ino, current.st_dev):
+            file.close()
+            file = open(self.path, "rb")
+            self.restart()
+        elif stat.st_size < self.offset:
+            # Усечение на месте (copytruncate)
+            self.restart()
+        else:
+            return file
+        
+        self.read_new(file)
+        return file
+    
+    def restart(self):
+        """Чтение с начала файла"""
+        self.offset = 0
+        self.decoder = self.make_decoder("replace")
+        self.put(("reset", "", 0))
+    
+    def read_new(self, file):
+        """Передача байтов, дописанных после offset"""
+        file.seek(self.offset)
+        while not self.cancelled.is_set():
+            data = file.read(self.CHUNK)
+            if not data:
+                return
+            if self.offset == 0 and self.bom and data.startswith(self.bom):
+                self.offset = len(self.bom)
+                data = data[len(self.bom):]
+            
+            self.offset += len(data)
+            # \r в конце порции ждет следующей - CRLF не разрывается
+            text = self.decoder.decode(data)
+            if text:
+                self.put(("text", text, self.offset))
+
+
+# Проверка файла на диске и опрос фоновой перезагрузки
+WATCH_POLL_MS = 2000
+RELOAD_POLL_MS = 20
+
+# Средняя часть различий больше этого числа строк заменяется целиком,
+# без построчного сравнения
+DIFF_MAX_LINES = 20000
+
+
+def diff_regions(old, new):
+    """Различия текстов: список (начало, конец) участка old и текст из new"""
+    if old == new:
+        return []
+    
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    
+    # Общие начало и конец отбрасываются: обычно меняется одно место
+    limit = min(len(old_lines), len(new_lines))
+    head = 0
+    while head < limit and old_lines[head] == new_lines[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and old_lines[-1 - tail] == new_lines[-1 - tail]:
+        tail += 1
+    
+    old_middle = old_lines[head:len(old_lines) - tail]
+    new_middle = new_lines[head:len(new_lines) - tail]
+    start = sum(map(len, old_lines[:head]))
+    
+    if len(old_middle) + len(new_middle) > DIFF_MAX_LINES:
+        end = start + sum(map(len, old_middle))
+        return [(start, end, "".join(new_middle))]
+    
+    offsets = list(accumulate(map(len, old_middle), initial=start))
+    matcher = difflib.SequenceMatcher(None, old_middle, new_middle, autojunk=False)
+    return [(offsets[i1], offsets[i2], "".join(new_middle[j1:j2]))
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+
+def shift_offset(offset, regions):
+    """Смещение после замены участков; внутри участка - его начало"""
+    delta = 0
+    for start, end, text in regions:
+        if offset <= start:
+            break
+        if offset < end:
+            return start + delta
+        delta += len(text) - (end - start)
+    return offset + delta
+
+
+def changed_region(old, new):
+    """Единственный участок, отличающий new от old: (начало, конец) в old и текст из new"""
+    # Общие начало и конец ищутся блоками, посимвольно - только последний блок
+    block = 4096
+    limit = min(len(old), len(new))
+    head = 0
+    while head + block <= limit and old[head:head + block] == new[head:head + block]:
+        head += block
+    while head < limit and old[head] == new[head]:
+        head += 1
+    
+    limit -= head
+    old_end, new_end = len(old), len(new)
+    tail = 0
+    while tail + block <= limit and \
+            old[old_end - tail - block:old_end - tail] == new[new_end - tail - block:new_end - tail]:
+        tail += block
+    while tail < limit and old[old_end - tail - 1] == new[new_end - tail - 1]:
+        tail += 1
+    
+    return head, old_end - tail, new[head:new_end - tail]
+
+
+class ReloadJob:
+    """Чтение изменившегося файла и сравнение с текстом в фоновом потоке"""
+    
+    def __init__(self, path, text, stamp, digest, file_format, revision):
+        self.path = path
+        self.text = text
+        # Номер правки текста, с которым идет сравнение
+        self.revision = revision
+        self.old_stamp = stamp
+        self.old_digest = digest
+        self.stamp = None
+        self.digest = None
+        self.file_format = file_format
+        self.regions = []
+        self.error = None
+        
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def start(self):
+        """Запуск потока"""
+        self.thread.start()
+    
+    def run(self):
+        try:
+            with open(self.path, "rb") as file:
+                stat = os.fstat(file.fileno())
+                data = file.read()
+            self.stamp = FileStamp(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            self.digest = hashlib.blake2b(data).hexdigest()
+            
+            if self.digest != self.old_digest and not self.reload_appended(data):
+                loader = FileLoader(self.path)
+                chunks = (data[i:i + loader.CHUNK] for i in range(0, len(data), loader.CHUNK))
+                self.regions = diff_regions(self.text, "".join(loader.decode(chunks)))
+                self.file_format = loader.file_format
+        except Exception as e:
+            self.error = e
+        
+        # Снимок текста больше не нужен
+        self.text = None
+        self.done.set()
+    
+    def reload_appended(self, data):
+        """Файл только дописан: декодируются лишь новые байты"""
+        old_size = self.old_stamp.size
+        if self.old_digest is None or len(data) < old_size:
+            return False
+        if hashlib.blake2b(data[:old_size]).hexdigest() != self.old_digest:
+            return False
+        
+        loader = FileLoader(self.path, self.file_format.encoding)
+        tail = "".join(loader.decode([data[old_size:]]))
+        
+        # Хвост в другой кодировке - сравнивается весь файл
+        if loader.encoding != self.file_format.encoding or loader.lossy:
+            return False
+        if tail:
+            self.regions = [(len(self.text), len(self.text), tail)]
+        return True
+
+
+# Период опроса результатов поиска
+SEARCH_POLL_MS = 20
+
+# Подсветка совпадений: запас строк вокруг видимой области
+# и предел числа подсвечиваемых совпадений
+HIGHLIGHT_MARGIN_LINES = 50
+HIGHLIGHT_MAX_MATCHES = 5000
+
+
+def compile_query(query, ignore_case=False, whole_word=False, regex=False):
+    """Регулярное выражение для строки поиска; ошибка в нем - re.error"""
+    pattern = query if regex else re.escape(query)
+    if whole_word:
+        pattern = rf"\b(?:{pattern})\b"
+    return re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+
+
+def substitute(pattern, replacement, text, regex=False):
+    """Замена всех совпадений за один проход: новый текст и число замен.
+    
+    В режиме regex в замене доступны группы (\\1, \\g<имя>); пустые
+    совпадения, как и при поиске, пропускаются.
+    """
+    count = 0
+    
+    def expand(match):
+        nonlocal count
+        if match.start() == match.end():
+            return ""
+        count += 1
+        return match.expand(replacement) if regex else replacement
+    
+    return pattern.sub(expand, text), count
+
+
+class SearchJob:
+    """Поиск по снимку текста в фоновом потоке с выдачей совпадений пачками"""
+    
+    BATCH = 1000
+    
+    def __init__(self, text, query, ignore_case=False, whole_word=False, regex=False):
+        # Ошибка в регулярном выражении возникает здесь, до запуска потока
+        self.regex = compile_query(query, ignore_case, whole_word, regex)
+        self.text = text
+        self.error = None
+        
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def start(self):
+        """Запуск потока поиска"""
+        self.thread.start()
+    
+    def cancel(self):
+        """Отмена поиска"""
+        self.cancelled.set()
+    
+    def spans(self):
+        """Начала и концы непустых совпадений по порядку"""
+        for match in self.regex.finditer(self.text):
+            # Пустые совпадения регулярного выражения пропускаем
+            start, end = match.span()
+            if start != end:
+                yield start, end
+    
+    def run(self):
+        batch = []
+        try:
+            for span in self.spans():
+                if self.cancelled.is_set():
+                    return
+                
+                batch.append(span)
+                if len(batch) >= self.BATCH:
+                    self.queue.put(batch)
+                    batch = []
+        except Exception as e:
+            self.error = e
+        
+        if batch:
+            self.queue.put(batch)
+        
+        # Признак окончания поиска
+        self.queue.put(None)
+
+
+# Позиция в большом файле - строка и колонка в одном числе: такие ключи,
+# как и смещения, упорядочены и ищутся bisect
+LINE_KEY_SHIFT = 32
+LINE_KEY_MASK = (1 << LINE_KEY_SHIFT) - 1
+
+
+def line_key(line, column):
+    """Ключ позиции по строке и колонке (с 0)"""
+    return line << LINE_KEY_SHIFT | min(column, LINE_KEY_MASK)
+
+
+def key_position(key):
+    """Строка и колонка по ключу позиции"""
+    return key >> LINE_KEY_SHIFT, key & LINE_KEY_MASK
+
+
+class LargeSearchJob(SearchJob):
+    """Поиск по всему большому файлу с правками; совпадения - ключи line_key.
+    
+    Текст ищется блоками строк, поэтому многострочное совпадение на стыке
+    блоков не находится.
+    """
+    
+    BLOCK_LINES = 4096
+    
+    def __init__(self, document, query, ignore_case=False, whole_word=False, regex=False):
+        super().__init__("", query, ignore_case, whole_word, regex)
+        self.document = document
+        # Снимок кусков: правки после запуска на поиск не влияют
+        self.pieces = list(document.pieces)
+    
+    def spans(self):
+        for first, lines in self.document.blocks(self.pieces, self.BLOCK_LINES):
+            if self.cancelled.is_set():
+                return
+            
+            starts = None
+            for match in self.regex.finditer("\n".join(lines)):
+                start, end = match.span()
+                if start == end:
+                    continue
+                if starts is None:
+                    starts = array("q", [0])
+                    starts.extend(accumulate(len(line) + 1 for line in lines))
+                yield self.key(starts, first, start), self.key(starts, first, end)
+    
+    @staticmethod
+    def key(starts, first, offset):
+        """Ключ позиции по смещению в тексте блока"""
+        index = bisect_right(starts, offset) - 1
+        return line_key(first + index, offset - starts[index])
+
+
+# Опрос фонового лексера и запас строк для тегов подсветки синтаксиса
+SYNTAX_POLL_MS = 10
+SYNTAX_MARGIN_LINES = 50
+
+# Язык подсветки по расширению файла
+SYNTAX_LANGUAGES = {
+    ".py": "python",
+    ".html": "html",
+    ".htm": "html",
+    ".css": "css",
+    ".js": "javascript",
+    ".md": "markdown"
+}
+
+# Правила лексеров: многострочные блоки (вид, начало, конец) и однострочные токены
+SYNTAX_RULES = {
+    "python": {
+        "blocks": [("string", r'[rRbBuUfF]{0,2}"""', r'"""'),
+                   ("string", r"[rRbBuUfF]{0,2}'''", r"'''")],
+        "tokens": [("comment", r"#.*"),
+                   ("string", r'''[rRbBuUfF]{0,2}(?:"(?:[^"\\]|\\.)*"?|'(?:[^'\\]|\\.)*'?)'''),
+                   ("keyword", r"\b(?:False|None|True|and|as|assert|async|await|break|class|"
+                               r"continue|def|del|elif|else|except|finally|for|from|global|if|"
+                               r"import|in|is|lambda|nonlocal|not|or|pass|raise|return|try|"
+                               r"while|with|yield)\b"),
+                   ("builtin", r"\b(?:self|cls|print|len|range|open|super|isinstance|int|str|"
+                               r"float|bool|list|dict|set|tuple|object|Exception)\b"),
+                   ("number", r"\b(?:0[xXoObB][\da-fA-F_]+|\d[\d_]*(?:\.\d*)?(?:[eE][+-]?\d+)?j?)\b"),
+                   ("decorator", r"@[\w.]+")]
+    },
+    "javascript": {
+        "blocks": [("comment", r"/\*", r"\*/"),
+                   ("string", r"`", r"(?<!\\)`")],
+        "tokens": [("comment", r"//.*"),
+                   ("string", r'''"(?:[^"\\]|\\.)*"?|'(?:[^'\\]|\\.)*'?'''),
+                   ("keyword", r"\b(?:async|await|break|case|catch|class|const|continue|default|"
+                               r"delete|do|else|export|extends|finally|for|function|if|import|"
+                               r"in|instanceof|let|new|of|return|switch|this|throw|try|typeof|"
+                               r"var|void|while|yield|true|false|null|undefined)\b"),
+                   ("number", r"\b(?:0[xXoObB][\da-fA-F]+|\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)\b")]
+    },
+    "css": {
+        "blocks": [("comment", r"/\*", r"\*/")],
+        "tokens": [("string", r'''"[^"]*"?|'[^']*'?'''),
+                   ("keyword", r"@[\w-]+|!important"),
+                   ("attribute", r"[\w-]+(?=\s*:(?!:))"),
+                   ("number", r"#[\da-fA-F]{3,8}\b|-?\b\d+(?:\.\d+)?(?:px|em|rem|%|vh|vw|s|ms|deg)?"),
+                   ("tag", r"[.#][\w-]+")]
+    },
+    "html": {
+        "blocks": [("comment", r"<!--", r"-->")],
+        "tokens": [("tag", r"</?[\w-]+|/?>"),
+                   ("attribute", r"\b[\w-]+(?==)"),
+                   ("string", r'''"[^"]*"|'[^']*\''''),
+                   ("number", r"&#?\w+;")]
+    },
+    "markdown": {
+        "blocks": [("code", r"^```", r"^```")],
+        "tokens": [("heading", r"^#{1,6}\s.*"),
+                   ("comment", r"^>.*"),
+                   ("keyword", r"^\s*(?:[-*+]|\d+\.)\s"),
+                   ("code", r"`[^`]*`"),
+                   ("attribute", r"!?\[[^\]]*\]\([^)]*\)"),
+                   ("emphasis", r"\*\*[^*]+\*\*|__[^_]+__|\*[^*\s][^*]*\*|\b_[^_\s][^_]*_\b")]
+    }
+}
+
+# Цвета видов токенов - ключи палитры темы
+SYNTAX_COLORS = {
+    "keyword": "primary",
+    "builtin": "secondary",
+    "string": "success",
+    "comment": "slate",
+    "number": "warning",
+    "decorator": "accent",
+    "tag": "secondary",
+    "attribute": "accent",
+    "heading": "primary",
+    "code": "violet",
+    "emphasis": "warning"
+}
+
+
+class SyntaxLexer:
+    """Построчный лексер на регулярных выражениях.
+    
+    Состояние строки - номер незакрытого многострочного блока (0 - вне блока),
+    поэтому строку можно разобрать, зная только состояние конца предыдущей.
+    """
+    
+    _languages = {}
+    
+    def __init__(self, blocks, tokens):
+        self.kinds = [kind for kind, _, _ in blocks] + [kind for kind, _ in tokens]
+        self.block_ends = [re.compile(end) for _, _, end in blocks]
+        patterns = [start for _, start, _ in blocks] + [pattern for _, pattern in tokens]
+        self.pattern = re.compile("|".join(f"(?P<g{i}>{pattern})"
+                                           for i, pattern in enumerate(patterns)))
+    
+    @classmethod
+    def for_path(cls, path):
+        """Лексер по расширению файла или None"""
+        if not path:
+            return None
+        language = SYNTAX_LANGUAGES.get(os.path.splitext(path)[1].lower())
+        if language is None:
+            return None
+        
+        # Выражения компилируются при первом открытии файла этого языка
+        if language not in cls._languages:
+            cls._languages[language] = cls(**SYNTAX_RULES[language])
+        return cls._languages[language]
+    
+    def lex(self, line, state):
+        """Токены (начало, конец, вид) строки и состояние в ее конце"""
+        tokens = []
+        position = 0
+        if state:
+            close = self.block_ends[state - 1].search(line)
+            if close is None:
+                return ([(0, len(line), self.kinds[state - 1])] if line else []), state
+            tokens.append((0, close.end(), self.kinds[state - 1]))
+            position = close.end()
+        
+        while True:
+            match = self.pattern.search(line, position)
+            if match is None:
+                return tokens, 0
+            
+            index = int(match.lastgroup[1:])
+            start, end = match.span()
+            if index < len(self.block_ends):
+                close = self.block_ends[index].search(line, end)
+                if close is None:
+                    tokens.append((start, len(line), self.kinds[index]))
+                    return tokens, index + 1
+                end = close.end()
+            
+            if end > start:
+                tokens.append((start, end, self.kinds[index]))
+            position = max(end, start + 1)
+
+
+class SyntaxJob:
+    """Лексинг пачки строк в фоновом потоке до схождения состояний"""
+    
+    def __init__(self, lexer, generation, first, state, lines, old_states):
+        self.lexer = lexer
+        self.generation = generation
+        self.first = first
+        self.state = state
+        self.lines = lines
+        self.old_states = old_states
+        self.tokens = []
+        self.states = []
+        self.converged = False
+        
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def start(self):
+        """Запуск потока лексинга"""
+        self.thread.start()
+    
+    def run(self):
+        state = self.state
+        for line, old_state in zip(self.lines, self.old_states):
+            tokens, state = self.lexer.lex(line, state)
+            self.tokens.append(tokens)
+            self.states.append(state)
+            
+            # Неизмененная строка закончилась в прежнем состоянии - дальше все верно
+            if old_state is not None and old_state == state:
+                self.converged = True
+                break
+        self.done.set()
+
+
+class SyntaxHighlighter:
+    """Кэш токенов и состояний лексера по строкам документа.
+    
+    Измененные строки помечаются состоянием None и перелексируются
+    пачками, пока состояние в конце строки не совпадет с прежним.
+    """
+    
+    BATCH_LINES = 2000
+    
+    def __init__(self):
+        self.lexer = None
+        self.tokens = []
+        self.states = []
+        self.generation = 0
+    
+    def reset(self, lexer, line_count):
+        """Новый язык или документ: все строки требуют лексинга"""
+        self.lexer = lexer
+        self.generation += 1
+        self.tokens = [None] * line_count if lexer is not None else []
+        self.states = list(self.tokens)
+    
+    def edit(self, line, removed, added):
+        """Правка строки line, удалившая removed и добавившая added переводов строк"""
+        if self.lexer is None:
+            return
+        self.generation += 1
+        self.tokens[line:line + removed + 1] = [None] * (added + 1)
+        self.states[line:line + removed + 1] = [None] * (added + 1)
+    
+    def make_job(self, document):
+        """Задание на лексинг от первой измененной строки или None"""
+        if self.lexer is None:
+            return None
+        try:
+            first = self.states.index(None)
+        except ValueError:
+            return None
+        
+        end = min(len(self.states), first + self.BATCH_LINES)
+        text = document.get_text(document.line_start(first), document.line_start(end))
+        lines = text.split("\n")[:end - first]
+        state = self.states[first - 1] if first > 0 else 0
+        return SyntaxJob(self.lexer, self.generation, first, state, lines,
+                         self.states[first:end])
+    
+    def apply(self, job):
+        """Перенос результата в кэш; устаревший после правок результат отбрасывается"""
+        if job.generation != self.generation:
+            return False
+        
+        first = job.first
+        end = first + len(job.states)
+        self.tokens[first:end] = job.tokens
+        self.states[first:end] = job.states
+        
+        # Состояние еще не сошлось - следующая строка тоже требует лексинга
+        if not job.converged and end < len(self.states):
+            self.tokens[end] = None
+            self.states[end] = None
+        return True
+
+
+# Период проверки задержки главного цикла и объем скользящих выборок
+LATENCY_HEARTBEAT_MS = 50
+LATENCY_SAMPLES = 1000
+LATENCY_TRACE_EVENTS = 100000
+
+# Границы корзин гистограммы задержек в миллисекундах
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class LatencyMonitor:
+    """Длительность обработчиков и задержка главного цикла Tk.
+    
+    Обработчики оборачиваются таймерами только при включенном замере,
+    задержка цикла измеряется по опозданию периодического after().
+    """
+    
+    LAG = "mainloop.lag"
+    
+    def __init__(self, root, heartbeat_ms=LATENCY_HEARTBEAT_MS):
+        self.root = root
+        self.heartbeat_ms = heartbeat_ms
+        self.samples = {}
+        self.totals = Counter()
+        self.trace = deque(maxlen=LATENCY_TRACE_EVENTS)
+        self.started = time.perf_counter()
+        self.expected = None
+        self.heartbeat_job = None
+    
+    def record(self, name, start, duration):
+        """Запись длительности в скользящую выборку и трассу"""
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=LATENCY_SAMPLES)
+        samples.append(duration)
+        self.totals[name] += 1
+        self.trace.append((name, start - self.started, duration))
+    
+    def wrap(self, name, callback):
+        """Обертка callback с замером времени"""
+        record = self.record
+        
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                record(name, start, time.perf_counter() - start)
+        return timed
+    
+    def instrument(self, owner, names):
+        """Замена методов объекта обертками с замером"""
+        for name in names:
+            setattr(owner, name, self.wrap(name, getattr(owner, name)))
+    
+    def start(self):
+        """Запуск периодической проверки задержки главного цикла"""
+        self.expected = time.perf_counter() + self.heartbeat_ms / 1000
+        self.heartbeat_job = self.root.after(self.heartbeat_ms, self.heartbeat)
+    
+    def stop(self):
+        if self.heartbeat_job is not None:
+            self.root.after_cancel(self.heartbeat_job)
+            self.heartbeat_job = None
+    
+    def heartbeat(self):
+        now = time.perf_counter()
+        self.record(self.LAG, self.expected, max(0.0, now - self.expected))
+        self.expected = now + self.heartbeat_ms / 1000
+        self.heartbeat_job = self.root.after(self.heartbeat_ms, self.heartbeat)
+    
+    def summary(self):
+        """Перцентили и гистограмма скользящей выборки по каждому имени, в мс"""
+        result = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(duration * 1000 for duration in samples)
+            pick = lambda p: round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3)
+            
+            histogram = Counter()
+            for duration in ordered:
+                index = bisect_left(LATENCY_BUCKETS_MS, duration)
+                bucket = (f"<={LATENCY_BUCKETS_MS[index]}" if index < len(LATENCY_BUCKETS_MS)
+                          else f">{LATENCY_BUCKETS_MS[-1]}")
+                histogram[bucket] += 1
+            
+            result[name] = {
+                "count": self.totals[name],
+                "p50": pick(0.5),
+                "p90": pick(0.9),
+                "p99": pick(0.99),
+                "max": round(ordered[-1], 3),
+                "histogram": dict(histogram)
+            }
+        return result
+    
+    def dump(self, path):
+        """Запись трассы: .csv - события построчно, иначе JSON со сводкой"""
+        if path.lower().endswith(".csv"):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                f.write("name,start_ms,duration_ms\n")
+                for name, start, duration in self.trace:
+                    f.write(f"{name},{start * 1000:.3f},{duration * 1000:.3f}\n")
+            return
+        
+        record = {
+            "summary": self.summary(),
+            "trace": [[name, round(start * 1000, 3), round(duration * 1000, 3)]
+                      for name, start, duration in self.trace]
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+
+
+# Папка журналов восстановления (рядом с файлом настроек)
+RECOVERY_DIR = "notefish_recovery"
+
+
+def process_alive(pid):
+    """Проверка, работает ли процесс с указанным PID"""
+    if os.name == "nt":
+        # SYNCHRONIZE; WAIT_TIMEOUT означает, что процесс еще работает
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x00100000, False, pid)
+        if not handle:
+            return False
+        try:
+            return kernel32.WaitForSingleObject(handle, 0) == 0x102
+        finally:
+            kernel32.CloseHandle(handle)
+    
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class EditJournal:
+    """Журнал правок документа для восстановления после сбоя"""
+    
+    # Журнал сворачивается в снимок, когда становится больше этого размера
+    # и заметно больше самого документа
+    COMPACT_BYTES = 4 * 1024 * 1024
+    
+    def __init__(self, directory=RECOVERY_DIR):
+        self.directory = directory
+        self.header = None
+        self.path = None
+        self.file = None
+        self.size = 0
+    
+    @staticmethod
+    def signature(doc_path):
+        """Размер и время изменения файла, от которого отсчитываются правки"""
+        try:
+            stat = os.stat(doc_path)
+        except (OSError, TypeError):
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+    
+    def start(self, doc_path=None, file_format=DEFAULT_FILE_FORMAT):
+        """Новый журнал для документа; файл создается при первой правке"""
+        self.discard()
+        encoding, bom, newline, lossy = file_format
+        self.header = {
+            "path": doc_path,
+            "pid": os.getpid(),
+            "base": self.signature(doc_path),
+            "format": [encoding, bom.hex(), newline, lossy]
+        }
+    
+    @staticmethod
+    def header_format(header):
+        """Кодировка документа из заголовка журнала"""
+        if "format" not in header:
+            return DEFAULT_FILE_FORMAT
+        encoding, bom, newline, lossy = header["format"]
+        return FileFormat(encoding, bytes.fromhex(bom), newline, lossy)
+    
+    def stop(self):
+        """Отключение журнала с удалением файла"""
+        self.discard()
+        self.header = None
+    
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{os.getpid()}-{time.time_ns()}.journal"
+        self.path = os.path.join(self.directory, name)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self._write(self.header)
+    
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        self.file.write(line)
+        self.size += len(line)
+    
+    def append(self, kind, offset, text):
+        """Дописывание дельты правки в конец журнала"""
+        if self.header is None:
+            return
+        if self.file is None:
+            self._open()
+        self._write([kind, offset, text])
+    
+    def flush(self):
+        """Сброс журнала на диск"""
+        if self.file is not None:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+    
+    def needs_compaction(self, document_length):
+        return self.size > self.COMPACT_BYTES and self.size > 2 * document_length
+    
+    def snapshot(self, text):
+        """Замена всех записей одним снимком текста"""
+        if self.header is None:
+            return
+        if self.file is None:
+            self._open()
+        
+        self.header = dict(self.header, base=None)
+        header_line = json.dumps(self.header, ensure_ascii=False) + "\n"
+        record_line = json.dumps(["insert", 0, text], ensure_ascii=False) + "\n"
+        
+        self.file.close()
+        atomic_write(self.path, lambda file: file.write(
+            (header_line + record_line).encode("utf-8")))
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = len(header_line) + len(record_line)
+    
+    def discard(self):
+        """Закрытие и удаление файла журнала"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+        self.size = 0
+    
+    @classmethod
+    def orphans(cls, directory=RECOVERY_DIR):
+        """Журналы завершившихся аварийно процессов, новые первыми"""
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        
+        result = []
+        for name in names:
+            if not name.endswith(".journal"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    header = json.loads(file.readline())
+            except (OSError, ValueError):
+                continue
+            
+            pid = header.get("pid")
+            if pid != os.getpid() and not process_alive(pid):
+                result.append((os.path.getmtime(path), path, header))
+        
+        result.sort(reverse=True)
+        return [(path, header) for _, path, header in result]
+    
+    @staticmethod
+    def replay(path):
+        """Восстановление текста: исходный файл плюс записанные дельты"""
+        with open(path, "r", encoding="utf-8") as file:
+            header = json.loads(file.readline())
+            
+            base = ""
+            if header.get("base") is not None:
+                if EditJournal.signature(header["path"]) != header["base"]:
+                    raise ValueError("Исходный файл изменился после начала журнала")
+                # Исходный файл декодируется так же, как при загрузке
+                encoding, bom, _, lossy = EditJournal.header_format(header)
+                with open(header["path"], "rb") as source:
+                    data = source.read()[len(bom):]
+                base = data.decode(encoding, "replace" if lossy else "strict")
+                base = base.replace("\r\n", "\n").replace("\r", "\n")
+            
+            document = PieceTable(base)
+            for line in file:
+                try:
+                    kind, offset, text = json.loads(line)
+                except ValueError:
+                    # Последняя запись могла оборваться при сбое
+                    break
+                if kind == "insert":
+                    document.insert(offset, text)
+                else:
+                    document.delete(offset, len(text))
+        
+        return header, document.get_text()
+
+
+# Период проверки завершения фонового сохранения
+SAVE_POLL_MS = 20
+
+
+class FileSaver:
+    """Атомарная запись снимка текста в фоновом потоке"""
+    
+    def __init__(self, path, content, file_format=DEFAULT_FILE_FORMAT, formatting=None):
+        self.path = path
+        self.content = content
+        self.file_format = file_format
+        self.formatting = formatting
+        self.stamp = None
+        self.digest = None
+        self.error = None
+        self.elapsed = 0.0
+        self.reported = False
+        
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+    
+    def start(self):
+        """Запуск потока записи"""
+        self.thread.start()
+    
+    def wait(self):
+        """Ожидание окончания записи"""
+        self.thread.join()
+    
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.write()
+            self.stamp = file_stamp(self.path)
+        except Exception as e:
+            self.error = e
+        
+        self.elapsed = time.perf_counter() - start
+        self.done.set()
+    
+    def write(self):
+        """Запись текста и его оформления"""
+        # Кодировка, BOM и переводы строк - как у открытого файла
+        encoding, bom, newline = self.file_format[:3]
+        data = bom + self.content.replace("\n", newline).encode(encoding)
+        atomic_write(self.path, lambda file: file.write(data))
+        self.digest = hashlib.blake2b(data).hexdigest()
+        self.write_formatting()
+    
+    def write_formatting(self):
+        """Запись оформления в соседний файл или удаление устаревшего"""
+        sidecar = self.path + FORMAT_SUFFIX
+        if not self.formatting:
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+            return
+        
+        record = {"version": 1, "length": len(self.content), "runs": self.formatting}
+        data = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        atomic_write(sidecar, lambda file: file.write(data))
+
+
+class LargeFileSaver(FileSaver):
+    """Атомарная запись большого файла с оверлеями правок в фоновом потоке.
+    
+    Поток читает отображение файла и закрывает его перед заменой файла,
+    поэтому до конца записи документ нельзя ни править, ни перечитывать.
+    """
+    
+    def __init__(self, path, document):
+        super().__init__(path, None, document.file_format)
+        self.document = document
+        # Снимок кусков: оверлеи правок на момент сохранения
+        self.pieces = list(document.pieces)
+    
+    def write(self):
+        self.document.save(self.path, self.pieces)
+
+
+# Неактивные вкладки с текстом больше этого размера хранятся сжатыми
+TAB_COMPRESS_MIN_CHARS = 256 * 1024
+
+
+class DocumentTab:
+    """Документ вкладки, пока он не показан в виджете.
+    
+    Хранит текст (крупный - сжатым), оформление, журналы отмены и правок,
+    позицию курсора и прокрутки. Большой файл остается открытым объектом
+    LargeFileDocument, в виджет возвращается только его окно. Вкладка
+    прошлого сеанса до первого показа хранит лишь запись сеанса.
+    """
+    
+    __slots__ = ("path", "saved", "file_format", "disk_stamp", "disk_digest",
+                 "long_lines", "data", "compressed", "spans", "undo_journal",
+                 "edit_journal", "cursor", "scroll", "large_doc", "window_start",
+                 "session")
+    
+    def __init__(self, undo_journal, edit_journal):
+        self.path = None
+        self.saved = True
+        self.file_format = DEFAULT_FILE_FORMAT
+        self.disk_stamp = None
+        self.disk_digest = None
+        self.long_lines = False
+        self.data = ""
+        self.compressed = False
+        self.spans = None
+        self.undo_journal = undo_journal
+        self.edit_journal = edit_journal
+        self.cursor = "1.0"
+        self.scroll = 0.0
+        self.large_doc = None
+        self.window_start = 0
+        self.session = None
+    
+    def store_text(self, text):
+        """Сохранение текста вкладки, крупного - в сжатом виде"""
+        self.compressed = len(text) >= TAB_COMPRESS_MIN_CHARS
+        self.data = zlib.compress(text.encode("utf-8"), 1) if self.compressed else text
+    
+    def load_text(self):
+        """Текст вкладки; память под сохраненный текст освобождается"""
+        data, compressed = self.data, self.compressed
+        self.data, self.compressed = "", False
+        return zlib.decompress(data).decode("utf-8") if compressed else data
+
+
+# Снимок сеанса: открытые документы, их кодировки и позиции
+SESSION_FILE = "notefish_session.json"
+
+
+class Session:
+    """Снимок сеанса в JSON: документы вкладок и индекс активной.
+    
+    Файл пишется только при изменении снимка и без fsync: потеря последней
+    записи при сбое возвращает лишь чуть более старые позиции. Отметка
+    файла в записи позволяет не определять кодировку и режим заново.
+    """
+    
+    VERSION = 1
+    
+    def __init__(self, path=SESSION_FILE):
+        self.path = path
+        self.written = None
+    
+    @staticmethod
+    def entry(path, file_format, cursor, scroll, stamp, large=False, window_start=0,
+              long_lines=False):
+        """Запись документа в снимке"""
+        encoding, bom, newline, lossy = file_format
+        return {
+            "path": path,
+            "format": [encoding, bom.hex(), newline, lossy],
+            "stamp": list(stamp) if stamp is not None else None,
+            "cursor": cursor,
+            "scroll": scroll,
+            "large": large,
+            "window_start": window_start,
+            "long_lines": long_lines
+        }
+    
+    def load(self):
+        """Записи документов и индекс активного; без снимка - пустой список"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return [], 0
+        if not isinstance(data, dict) or data.get("version") != self.VERSION:
+            return [], 0
+        return data.get("documents", []), data.get("active", 0)
+    
+    def write(self, documents, active):
+        """Запись снимка, если он изменился"""
+        data = json.dumps({"version": self.VERSION, "active": active, "documents": documents},
+                          ensure_ascii=False)
+        if data == self.written:
+            return
+        
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+            self.written = data
+        except OSError as e:
+            print(f"Ошибка сохранения сеанса: {e}")
+
+
+# Отступ номеров строк от краев полосы номеров
+GUTTER_PADDING = 8
+
+
+def gutter_rows(top_index, first_number, last_line, height, dlineinfo):
+    """Пары (y, номер) для видимых логических строк виджета.
+    
+    top_index - индекс в верхнем левом углу экрана, first_number - номер
+    первой строки виджета, dlineinfo - функция индекса, как у Text.
+    """
+    rows = []
+    index = top_index
+    while True:
+        info = dlineinfo(index)
+        if info is None:
+            break
+        
+        # Продолжение перенесенной строки вверху экрана номера не получает
+        line, column = map(int, index.split("."))
+        if column == 0:
+            rows.append((info[1], first_number + line - 1))
+        
+        if info[1] + info[3] >= height or line >= last_line:
+            break
+        index = f"{line + 1}.0"
+    return rows
+
+
+class LineGutter:
+    """Полоса номеров строк: рисуются только видимые строки.
+    
+    Положение берется из dlineinfo, поэтому номер стоит на первой строке
+    экрана логической строки и при переносе. Элементы холста переиспользуются,
+    так что перерисовка стоит O(видимых строк) при любом размере документа.
+    """
+    
+    def __init__(self, parent, text):
+        self.text = text
+        self.canvas = tk.Canvas(parent, width=0, highlightthickness=0, borderwidth=0)
+        self.items = []
+        self.shown = 0
+        self.digits = 0
+        self.width = 0
+        self.font = None
+        self.color = None
+    
+    def configure(self, font_spec, color):
+        """Шрифт и цвет номеров; ширина полосы пересчитывается"""
+        self.font = font_spec
+        self.color = color
+        self.digits = 0
+        for item in self.items:
+            self.canvas.itemconfigure(item, font=font_spec, fill=color)
+    
+    def set_digits(self, digits):
+        """Ширина полосы под номера из digits цифр"""
+        digits = max(digits, 2)
+        if digits == self.digits:
+            return
+        self.digits = digits
+        self.width = font.Font(font=self.font).measure("9" * digits) + 2 * GUTTER_PADDING
+        self.canvas.configure(width=self.width)
+    
+    def item(self, number):
+        """Текстовый элемент холста с номером number по порядку"""
+        if number == len(self.items):
+            self.items.append(self.canvas.create_text(
+                0, 0, anchor="ne", font=self.font, fill=self.color))
+        return self.items[number]
+    
+    def redraw(self, first_number, total_lines):
+        """Номера видимых строк; first_number - номер первой строки виджета"""
+        text = self.text
+        self.set_digits(len(str(total_lines)))
+        last_line = int(text.index("end-1c").split(".")[0])
+        rows = gutter_rows(text.index("@0,0"), first_number, last_line,
+                           text.winfo_height(), text.dlineinfo)
+        
+        x = self.width - GUTTER_PADDING
+        for shown, (y, number) in enumerate(rows):
+            item = self.item(shown)
+            self.canvas.coords(item, x, y)
+            self.canvas.itemconfigure(item, text=str(number), state="normal")
+        
+        shown = len(rows)
+        for item in self.items[shown:self.shown]:
+            self.canvas.itemconfigure(item, state="hidden")
+        self.shown = shown
+
+
+# Встроенные палитры тем
+THEMES = {
+    "light": {
+        "primary": "#667eea",
+        "primary_light": "#8e9ffa",
+        "secondary": "#764ba2",
+        "bg_light": "#f8fafc",
+        "bg_dark": "#1e293b",
+        "sidebar": "#334155",
+        "surface": "white",
+        "editor_bg": "white",
+        "text_light": "#f1f5f9",
+        "text_dark": "#0f172a",
+        "accent": "#06b6d4",
+        "success": "#10b981",
+        "warning": "#f59e0b",
+        "error": "#ef4444",
+        "violet": "#8b5cf6",
+        "slate": "#64748b"
+    },
+    "dark": {
+        "primary": "#4c51bf",
+        "primary_light": "#667eea",
+        "secondary": "#7f00ff",
+        "bg_light": "#1e293b",
+        "bg_dark": "#0f172a",
+        "sidebar": "#334155",
+        "surface": "#1e293b",
+        "editor_bg": "#0f172a",
+        "text_light": "#f1f5f9",
+        "text_dark": "#cbd5e1",
+        "accent": "#06b6d4",
+        "success": "#10b981",
+        "warning": "#f59e0b",
+        "error": "#ef4444",
+        "violet": "#8b5cf6",
+        "slate": "#64748b"
+    }
+}
+
+# Пользовательские темы: {"имя": {"ключ палитры": "цвет"}}
+THEMES_FILE = "notefish_themes.json"
+
+
+def load_themes(path=THEMES_FILE):
+    """Встроенные темы и темы из файла; недостающие цвета берутся из светлой"""
+    themes = {name: dict(colors) for name, colors in THEMES.items()}
+    if not os.path.exists(path):
+        return themes
+    
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for name, colors in json.load(f).items():
+                themes[name] = {**THEMES["light"], **colors}
+    except Exception as e:
+        print(f"Ошибка загрузки тем: {e}")
+    return themes
+
+
+class StyleRegistry:
+    """Виджеты по смысловым ролям; смена темы без обхода дерева виджетов.
+    
+    Роль задает параметры виджета ключами палитры (или готовыми цветами).
+    При смене темы перенастраиваются только роли, параметры которых изменились.
+    """
+    
+    ROLES = {
+        "window": {"bg": "bg_light"},
+        "sidebar": {"bg": "sidebar"},
+        "sidebar_title": {"bg": "sidebar", "fg": "white"},
+        "sidebar_subtitle": {"bg": "sidebar", "fg": "primary_light"},
+        "sidebar_text": {"bg": "sidebar", "fg": "text_light"},
+        "surface": {"bg": "surface"},
+        "surface_text": {"bg": "surface", "fg": "text_dark"},
+        "tool_button": {"bg": "surface", "fg": "text_dark", "activebackground": "surface"},
+        "editor": {"bg": "editor_bg", "fg": "text_dark",
+                   "insertbackground": "primary", "selectbackground": "primary_light"},
+        "status_button": {"bg": "error", "activebackground": "error"},
+        "gutter": {"bg": "editor_bg"},
+        "tab": {"bg": "bg_light"},
+        "tab_text": {"bg": "bg_light", "fg": "slate"},
+        "tab_active": {"bg": "surface"},
+        "tab_active_text": {"bg": "surface", "fg": "text_dark"},
+        "tab_active_close": {"bg": "surface", "fg": "slate"},
+        
+        # Цветные кнопки боковой панели
+        **{f"button_{key}": {"bg": key, "activebackground": key}
+           for key in ("primary", "secondary", "success", "warning", "accent", "violet", "slate")}
+    }
+    
+    def __init__(self, colors):
+        self.colors = colors
+        self.widgets = {}
+        self.applied = {}
+    
+    def config(self, role, colors):
+        """Параметры роли для палитры"""
+        return {option: colors.get(key, key) for option, key in self.ROLES[role].items()}
+    
+    def register(self, widget, role):
+        """Запоминание роли виджета и применение текущей темы"""
+        if role not in self.applied:
+            self.applied[role] = self.config(role, self.colors)
+        widget.configure(**self.applied[role])
+        self.widgets.setdefault(role, []).append(widget)
+        return widget
+    
+    def forget(self, widgets):
+        """Исключение виджетов, которые будут уничтожены"""
+        gone = set(widgets)
+        for role, registered in self.widgets.items():
+            self.widgets[role] = [widget for widget in registered if widget not in gone]
+    
+    def apply(self, colors):
+        """Применение палитры к виджетам с изменившимися ролями"""
+        self.colors = colors
+        for role, widgets in self.widgets.items():
+            config = self.config(role, colors)
+            if config == self.applied[role]:
+                continue
+            
+            self.applied[role] = config
+            for widget in widgets:
+                widget.configure(**config)
+
+
+# Начальный размер главного окна
+WINDOW_SIZE = (1200, 700)
+
+
+class StartupProfile:
+    """Замер этапов запуска до первой отрисовки окна"""
+    
+    def __init__(self, start=STARTUP_TIME):
+        self.marks = [("start", start)]
+    
+    def mark(self, stage):
+        """Отметка окончания этапа"""
+        self.marks.append((stage, time.perf_counter()))
+    
+    def report(self):
+        """Таблица длительностей этапов в миллисекундах"""
+        lines = []
+        previous = start = self.marks[0][1]
+        for stage, moment in self.marks[1:]:
+            lines.append(f"{stage:<24}{(moment - previous) * 1000:8.1f} мс")
+            previous = moment
+        lines.append(f"{'Всего':<24}{(previous - start) * 1000:8.1f} мс")
+        return "\n".join(lines)
+
 
 class Notefish:
-    def __init__(self, root):
+    # Обработчики, которые замеряет LatencyMonitor
+    INSTRUMENTED_HANDLERS = (
+        "on_text_modified", "update_stats_and_cursor", "on_text_yscroll", "sync_document",
+        "handle_undo_command", "open_file", "load_file", "poll_loading", "save_file",
+        "poll_saving", "do_find", "poll_search", "find_next", "find_previous",
+        "toggle_theme", "switch_tab", "poll_syntax", "update_large_window"
+    )
+    
+    def __init__(self, root, profile=None):
         self.root = root
         self.root.title("Notefish - Modern Text Editor")
-        self.root.geometry("1200x700")
+        self.root.geometry("{}x{}".format(*WINDOW_SIZE))
         self.root.minsize(900, 500)
         
-        # Современная цветовая схема
-        self.colors = {
-            "primary": "#667eea",
-            "primary_light": "#8e9ffa", 
-            "secondary": "#764ba2",
-            "bg_light": "#f8fafc",
-            "bg_dark": "#1e293b",
-            "sidebar": "#334155",
-            "text_light": "#f1f5f9",
-            "text_dark": "#0f172a",
-            "accent": "#06b6d4",
-            "success": "#10b981",
-            "warning": "#f59e0b",
-            "error": "#ef4444"
-        }
+        # Этапы запуска для --startup-profile
+        self.profile = profile or StartupProfile()
         
-        # Настройка основного фона
-        self.root.configure(bg=self.colors["bg_light"])
+        # Современная цветовая схема
+        self.themes = load_themes()
         
         # Текущий файл
         self.current_file = None
         self.saved = True
+        self.file_format = DEFAULT_FILE_FORMAT
         
         # Настройки
         self.current_font = "Segoe UI"
         self.current_font_size = 12
         self.current_theme = "light"
+        self.large_file_threshold_mb = LARGE_FILE_THRESHOLD_MB
+        self.follow_max_lines = FOLLOW_MAX_LINES
+        self.undo_memory_limit_mb = UNDO_MEMORY_LIMIT_MB
+        self.latency_monitor_enabled = False
+        self.latency_trace_file = None
+        
+        # Виртуальный режим больших файлов
+        self.large_doc = None
+        self.window_start = 0
+        self.window_lines = 0
+        self.window_dirty = False
+        self.paging = False
+        
+        # Фоновая загрузка и сохранение файла; отметка и хэш файла на диске,
+        # которому соответствует текст документа, и фоновая перезагрузка
+        self.loader = None
+        self.saver = None
+        self.disk_stamp = None
+        self.disk_digest = None
+        self.reload_job = None
+        self.revision = 0
+        
+        # Снимок сеанса; пишется только после восстановления прошлого,
+        # запись открываемого документа прошлого сеанса
+        self.session = Session()
+        self.session_restored = False
+        self.session_entry = None
+        
+        # Режим длинных строк: перенос выключен, подсветка синтаксиса тоже
+        self.long_lines = False
+        
+        # Слежение за дописываемым файлом
+        self.follower = None
+        self.follow_trimmed = False
+        
+        # Состояние поиска
+        self.find_window = None
+        self.search_job = None
+        self.search_starts = array("q")
+        self.search_ends = array("q")
+        self.search_current = -1
+        # Правка, к которой относится найденное; выделить следующее после поиска
+        self.search_revision = -1
+        self.search_select = False
+        
+        # Планировщик обновлений интерфейса
+        self.scheduler = UpdateScheduler(self.root)
+        self.scheduler.register("status", self.update_cursor_position, delay=0)
+        self.scheduler.register("title", self.update_title, delay=100)
+        self.scheduler.register("stats", self.update_stats, delay=50)
+        self.scheduler.register("window", self.update_large_window, delay=0)
+        self.scheduler.register("gutter", self.update_gutter, delay=0)
+        self.scheduler.register("search", self.do_find, delay=250)
+        self.scheduler.register("highlight", self.update_match_highlights, delay=16)
+        self.scheduler.register("journal", self.flush_journal, delay=2000)
+        self.scheduler.register("format", self.update_format_tags, delay=16)
+        self.scheduler.register("syntax", self.run_syntax, delay=30)
+        self.scheduler.register("syntax_tags", self.update_syntax_tags, delay=16)
+        self.scheduler.register("session", self.save_session, delay=1000)
+        
+        # Настройки читаются до создания виджетов, чтобы строить их один раз
+        self.load_settings()
+        if self.current_theme not in self.themes:
+            self.current_theme = "light"
+        self.colors = self.themes[self.current_theme]
+        self.profile.mark("Настройки и темы")
+        
+        # Замер задержек: обработчики оборачиваются до привязки к событиям
+        self.latency = None
+        self.latency_window = None
+        if self.latency_monitor_enabled or os.environ.get("NOTEFISH_LATENCY"):
+            self.setup_latency_monitor()
+        
+        # Роли виджетов для смены темы
+        self.styles = StyleRegistry(self.colors)
+        
+        # Настройка основного фона
+        self.styles.register(self.root, "window")
         
         # Настройка стилей
         self.setup_styles()
         
         # Создание интерфейса
         self.setup_ui()
-        
-        # Загрузка настроек
-        self.load_settings()
+        self.profile.mark("Создание интерфейса")
         
         # Центрирование окна
         self.center_window()
         
-        # Обновление статистики
-        self.update_stats()
+        # Предложение восстановить несохраненные правки после сбоя, затем
+        # вкладки прошлого сеанса; окно к этому моменту уже показано
+        self.root.after_idle(lambda: self.restore_session(activate=not self.offer_recovery()))
+        self.root.after(WATCH_POLL_MS, self.check_disk)
         
     def setup_styles(self):
         """Настройка стилей для виджетов"""
@@ -119,6 +3026,7 @@ class Notefish:
                                 width=220)
         sidebar_frame.grid(row=0, column=0, rowspan=3, sticky="nsew", padx=(0, 10))
         sidebar_frame.grid_propagate(False)
+        self.styles.register(sidebar_frame, "sidebar")
         
         # Заголовок
         title_label = tk.Label(sidebar_frame, text="NOTEFISH",
@@ -126,12 +3034,14 @@ class Notefish:
                               fg="white",
                               font=("Segoe UI", 18, "bold"))
         title_label.pack(pady=(20, 5))
+        self.styles.register(title_label, "sidebar_title")
         
         subtitle_label = tk.Label(sidebar_frame, text="Modern Text Editor",
                                  bg=self.colors["sidebar"],
                                  fg=self.colors["primary_light"],
                                  font=("Segoe UI", 9))
         subtitle_label.pack(pady=(0, 20))
+        self.styles.register(subtitle_label, "sidebar_subtitle")
         
         # Разделитель
         separator = ttk.Separator(sidebar_frame, orient=tk.HORIZONTAL)
@@ -139,22 +3049,23 @@ class Notefish:
         
         # Кнопки файловых операций
         buttons = [
-            ("📄 Новый файл", self.new_file, self.colors["primary"]),
-            ("📂 Открыть файл", self.open_file, self.colors["secondary"]),
-            ("💾 Сохранить", self.save_file, self.colors["success"]),
-            ("💾 Сохранить как", self.save_as_file, self.colors["warning"]),
-            ("🔍 Найти текст", self.find_text, self.colors["accent"]),
-            ("🎨 Цвет текста", self.choose_color, "#8b5cf6"),
-            ("🌙 Тема", self.toggle_theme, "#64748b")
+            ("📄 Новый файл", self.new_file, "primary"),
+            ("📂 Открыть файл", self.open_file, "secondary"),
+            ("💾 Сохранить", self.save_file, "success"),
+            ("💾 Сохранить как", self.save_as_file, "warning"),
+            ("🔍 Найти текст", self.find_text, "accent"),
+            ("📜 Слежение", self.toggle_follow, "secondary"),
+            ("🎨 Цвет текста", self.choose_color, "violet"),
+            ("🌙 Тема", self.toggle_theme, "slate")
         ]
         
         for text, command, color in buttons:
             btn = tk.Button(sidebar_frame, text=text, command=command,
-                           bg=color, fg="white", font=("Segoe UI", 10),
+                           fg="white", font=("Segoe UI", 10),
                            relief="flat", padx=15, pady=8,
-                           activebackground=color,
                            activeforeground="white")
             btn.pack(fill=tk.X, padx=20, pady=5)
+            self.styles.register(btn, f"button_{color}")
             self.add_hover_effect(btn, color)
         
         # Разделитель
@@ -164,6 +3075,7 @@ class Notefish:
         # Информация о файле
         info_frame = tk.Frame(sidebar_frame, bg=self.colors["sidebar"])
         info_frame.pack(fill=tk.X, padx=20, pady=10)
+        self.styles.register(info_frame, "sidebar")
         
         self.file_info_label = tk.Label(info_frame,
                                        text="Новый файл",
@@ -171,26 +3083,33 @@ class Notefish:
                                        fg="white",
                                        font=("Segoe UI", 10, "bold"))
         self.file_info_label.pack(anchor="w", pady=(0, 10))
+        self.styles.register(self.file_info_label, "sidebar_title")
         
         self.stats_label = tk.Label(info_frame,
-                                   text="Символов: 0\nСтрок: 0",
+                                   text="Символов: 0\nСтрок: 0\nСлов: 0",
                                    bg=self.colors["sidebar"],
                                    fg=self.colors["text_light"],
                                    font=("Segoe UI", 9),
                                    justify=tk.LEFT)
         self.stats_label.pack(anchor="w")
+        self.styles.register(self.stats_label, "sidebar_text")
     
     def add_hover_effect(self, button, color):
-        """Добавляет эффект наведения на кнопку"""
+        """Добавляет эффект наведения на кнопку; color - ключ палитры или цвет"""
         def on_enter(e):
-            button['bg'] = self.lighten_color(color, 10)
+            button['bg'] = self.lighten_color(self.hex_color(color), 10)
         
         def on_leave(e):
-            button['bg'] = color
+            button['bg'] = self.colors.get(color, color)
         
         button.bind("<Enter>", on_enter)
         button.bind("<Leave>", on_leave)
     
+    def hex_color(self, color):
+        """Цвет палитры в виде #rrggbb"""
+        red, green, blue = self.root.winfo_rgb(self.colors.get(color, color))
+        return f"#{red >> 8:02x}{green >> 8:02x}{blue >> 8:02x}"
+    
     def lighten_color(self, color, percent):
         """Осветляет цвет на указанный процент"""
         color = color.lstrip('#')
@@ -207,10 +3126,12 @@ class Notefish:
         toolbar_frame = tk.Frame(parent, bg="white", height=50)
         toolbar_frame.grid(row=0, column=1, sticky="ew", pady=(0, 10))
         toolbar_frame.grid_propagate(False)
+        self.styles.register(toolbar_frame, "surface")
         
         # Контейнер для кнопок форматирования
         format_frame = tk.Frame(toolbar_frame, bg="white")
         format_frame.pack(side=tk.LEFT, padx=15)
+        self.styles.register(format_frame, "surface")
         
         # Кнопки форматирования
         format_buttons = [
@@ -230,16 +3151,20 @@ class Notefish:
                            font=("Segoe UI", 10),
                            relief="flat", width=3)
             btn.grid(row=0, column=i, padx=2)
+            self.styles.register(btn, "tool_button")
             self.add_tooltip(btn, tooltip)
-            self.add_hover_effect(btn, "white")
+            self.add_hover_effect(btn, "surface")
         
         # Контейнер для настроек
         settings_frame = tk.Frame(toolbar_frame, bg="white")
         settings_frame.pack(side=tk.RIGHT, padx=15)
+        self.styles.register(settings_frame, "surface")
         
         # Выбор шрифта
-        tk.Label(settings_frame, text="Шрифт:", bg="white",
-                font=("Segoe UI", 9)).pack(side=tk.LEFT, padx=(0, 5))
+        font_label = tk.Label(settings_frame, text="Шрифт:", bg="white",
+                              font=("Segoe UI", 9))
+        font_label.pack(side=tk.LEFT, padx=(0, 5))
+        self.styles.register(font_label, "surface_text")
         
         self.font_var = tk.StringVar(value=self.current_font)
         font_combo = ttk.Combobox(settings_frame, textvariable=self.font_var,
@@ -251,8 +3176,10 @@ class Notefish:
         font_combo.bind("<<ComboboxSelected>>", self.change_font)
         
         # Размер шрифта
-        tk.Label(settings_frame, text="Размер:", bg="white",
-                font=("Segoe UI", 9)).pack(side=tk.LEFT, padx=(0, 5))
+        size_label = tk.Label(settings_frame, text="Размер:", bg="white",
+                              font=("Segoe UI", 9))
+        size_label.pack(side=tk.LEFT, padx=(0, 5))
+        self.styles.register(size_label, "surface_text")
         
         self.size_var = tk.StringVar(value=str(self.current_font_size))
         size_combo = ttk.Combobox(settings_frame, textvariable=self.size_var,
@@ -287,17 +3214,28 @@ class Notefish:
         # Фрейм для текстовой области с тенью
         text_frame = tk.Frame(parent, bg="white", relief="flat")
         text_frame.grid(row=1, column=1, sticky="nsew", pady=(0, 10))
+        self.styles.register(text_frame, "surface")
         
         # Добавляем тень
         text_frame.config(highlightbackground="#e2e8f0", highlightcolor="#e2e8f0", highlightthickness=1)
         
+        # Панель вкладок документов
+        self.tab_bar = tk.Frame(text_frame, bg="white")
+        self.tab_bar.pack(fill=tk.X)
+        self.styles.register(self.tab_bar, "window")
+        self.tab_labels = []
+        
+        # Номера строк слева от текста, в той же рамке
+        editor_frame = tk.Frame(text_frame, bg="white")
+        editor_frame.pack(fill=tk.BOTH, expand=True)
+        self.styles.register(editor_frame, "surface")
+        
         # Создание текстового редактора
         self.text_area = scrolledtext.ScrolledText(
-            text_frame,
+            editor_frame,
             wrap=tk.WORD,
             font=(self.current_font, self.current_font_size),
-            undo=True,
-            maxundo=-1,
+            undo=False,
             bg="white",
             fg=self.colors["text_dark"],
             insertbackground=self.colors["primary"],
@@ -307,18 +3245,65 @@ class Notefish:
             pady=15,
             borderwidth=0
         )
-        self.text_area.pack(fill=tk.BOTH, expand=True)
+        self.gutter = LineGutter(editor_frame, self.text_area)
+        self.gutter.canvas.pack(side=tk.LEFT, fill=tk.Y)
+        self.styles.register(self.gutter.canvas, "gutter")
+        self.configure_gutter()
+        
+        self.text_area.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.styles.register(self.text_area, "editor")
+        self.text_area.configure(yscrollcommand=self.on_text_yscroll)
+        self.text_area.bind("<Configure>", lambda e: self.scheduler.request("gutter"), add="+")
+        
+        # Модель документа и статистика, синхронизируемые по дельтам правок
+        self.document = PieceTable()
+        self.doc_stats = DocumentStats()
+        self.text_hook = TextDeltaHook(self.text_area)
+        self.text_hook.add_listener(self.sync_document)
+        
+        # Оформление хранится по смещениям, теги ставятся только в видимой области
+        self.spans = SpanStore()
+        self.font_cache = {}
+        self.format_tags = set()
+        
+        # Подсветка синтаксиса: кэш по строкам, лексинг в фоновом потоке
+        self.syntax = SyntaxHighlighter()
+        self.syntax_job = None
+        self.syntax_tags = set()
+        
+        # Собственный журнал отмены вместо неограниченной истории Tk
+        self.undo_journal = UndoJournal(self.undo_memory_limit_mb * 1024 * 1024)
+        self.undo_replaying = False
+        self.text_hook.undo_handler = self.handle_undo_command
+        
+        # Журнал правок для восстановления после сбоя
+        self.edit_journal = EditJournal()
+        self.edit_journal.start()
+        self.text_hook.add_listener(self.doc_stats.apply)
+        self.text_hook.add_listener(self.on_text_delta)
+        
+        # Вкладки: в виджете только активный документ, остальные хранятся вне его
+        self.tabs = [DocumentTab(self.undo_journal, self.edit_journal)]
+        self.active_tab = 0
+        self.refresh_tabs()
+        
+        # Подсветка найденного текста
+        self.text_area.tag_config("found", background="yellow", foreground="black")
+        self.text_area.tag_config("current_match", background="orange", foreground="black")
+        self.text_area.tag_raise("current_match", "found")
         
         # Привязка событий
         self.text_area.bind("<<Modified>>", self.on_text_modified)
         self.text_area.bind("<KeyRelease>", self.update_stats_and_cursor)
-        self.text_area.bind("<ButtonRelease>", self.update_cursor_position)
+        self.text_area.bind("<ButtonRelease>",
+                            lambda e: self.scheduler.request("status"))
     
     def setup_statusbar(self, parent):
         """Создание статусной строки"""
         status_frame = tk.Frame(parent, bg=self.colors["sidebar"], height=30)
         status_frame.grid(row=2, column=0, columnspan=2, sticky="ew")
         status_frame.grid_propagate(False)
+        self.styles.register(status_frame, "sidebar")
         
         # Информация о файле слева
         self.file_label = tk.Label(status_frame,
@@ -327,6 +3312,7 @@ class Notefish:
                                   fg="white",
                                   font=("Segoe UI", 9))
         self.file_label.pack(side=tk.LEFT, padx=15)
+        self.styles.register(self.file_label, "sidebar_title")
         
         # Позиция курсора по центру
         self.cursor_label = tk.Label(status_frame,
@@ -335,14 +3321,25 @@ class Notefish:
                                     fg=self.colors["text_light"],
                                     font=("Segoe UI", 9))
         self.cursor_label.pack(side=tk.LEFT, padx=15)
+        self.styles.register(self.cursor_label, "sidebar_text")
         
         # Кодировка справа
-        encoding_label = tk.Label(status_frame,
-                                 text="UTF-8",
-                                 bg=self.colors["sidebar"],
-                                 fg=self.colors["text_light"],
-                                 font=("Segoe UI", 9))
-        encoding_label.pack(side=tk.RIGHT, padx=15)
+        self.encoding_label = tk.Label(status_frame,
+                                       text=format_label(self.file_format),
+                                       bg=self.colors["sidebar"],
+                                       fg=self.colors["text_light"],
+                                       font=("Segoe UI", 9))
+        self.encoding_label.pack(side=tk.RIGHT, padx=15)
+        self.styles.register(self.encoding_label, "sidebar_text")
+        
+        # Признак режима длинных строк
+        self.long_lines_label = tk.Label(status_frame,
+                                         text="",
+                                         bg=self.colors["sidebar"],
+                                         fg=self.colors["text_light"],
+                                         font=("Segoe UI", 9))
+        self.long_lines_label.pack(side=tk.RIGHT, padx=15)
+        self.styles.register(self.long_lines_label, "sidebar_text")
         
         # Статистика символов
         self.char_count_label = tk.Label(status_frame,
@@ -351,14 +3348,33 @@ class Notefish:
                                         fg=self.colors["text_light"],
                                         font=("Segoe UI", 9))
         self.char_count_label.pack(side=tk.RIGHT, padx=15)
+        self.styles.register(self.char_count_label, "sidebar_text")
+        
+        # Индикатор загрузки и кнопка отмены (показываются во время загрузки)
+        self.load_progress = ttk.Progressbar(status_frame, length=150,
+                                             mode="determinate", maximum=100)
+        self.load_cancel_btn = tk.Button(status_frame, text="Отмена",
+                                         command=self.cancel_loading,
+                                         bg=self.colors["error"], fg="white",
+                                         font=("Segoe UI", 8), relief="flat",
+                                         padx=8)
+        self.styles.register(self.load_cancel_btn, "status_button")
     
     def bind_shortcuts(self):
         """Привязка горячих клавиш"""
         self.root.bind("<Control-n>", lambda e: self.new_file())
+        self.root.bind("<F12>", lambda e: self.show_latency_overlay())
+        self.root.bind("<Control-t>", lambda e: self.new_file())
+        self.root.bind("<Control-w>", lambda e: self.close_tab())
+        self.root.bind("<Control-Tab>", lambda e: self.next_tab())
         self.root.bind("<Control-o>", lambda e: self.open_file())
         self.root.bind("<Control-s>", lambda e: self.save_file())
         self.root.bind("<Control-Shift-S>", lambda e: self.save_as_file())
+        self.root.bind("<Control-Shift-L>", lambda e: self.toggle_follow())
         self.root.bind("<Control-f>", lambda e: self.find_text())
+        self.root.bind("<Control-g>", lambda e: self.ask_goto_line())
+        self.root.bind("<F3>", lambda e: self.find_next())
+        self.root.bind("<Shift-F3>", lambda e: self.find_previous())
         self.root.bind("<Control-x>", lambda e: self.cut_text())
         self.root.bind("<Control-c>", lambda e: self.copy_text())
         self.root.bind("<Control-v>", lambda e: self.paste_text())
@@ -369,88 +3385,1187 @@ class Notefish:
         self.root.bind("<Control-u>", lambda e: self.toggle_underline())
     
     def new_file(self, event=None):
-        """Создание нового файла"""
+        """Создание нового файла в новой вкладке"""
+        self.new_tab()
+        return "break"
+    
+    def open_file(self, event=None):
+        """Открытие файла; непустой документ остается в своей вкладке"""
+        file_path = filedialog.askopenfilename(
+            defaultextension=".txt",
+            filetypes=[
+                ("Текстовые файлы", "*.txt"),
+                ("Все файлы", "*.*"),
+                ("Python файлы", "*.py"),
+                ("HTML файлы", "*.html;*.htm"),
+                ("CSS файлы", "*.css"),
+                ("JavaScript файлы", "*.js"),
+                ("Markdown файлы", "*.md")
+            ]
+        )
+        
+        if file_path:
+            if not self.tab_is_blank() and not self.new_tab():
+                return
+            self.load_file(file_path)
+    
+    def tab_is_blank(self):
+        """Активная вкладка - пустой несохранявшийся документ"""
+        return (self.current_file is None and self.saved and self.large_doc is None
+                and len(self.document) == 0)
+    
+    def tab_title(self, index):
+        """Имя вкладки с отметкой несохраненных изменений"""
+        if index == self.active_tab:
+            path, saved = self.current_file, self.saved
+        else:
+            path, saved = self.tabs[index].path, self.tabs[index].saved
+        name = os.path.basename(path) if path else "Новый файл"
+        return name if saved else f"{name} *"
+    
+    def refresh_tabs(self):
+        """Перестроение панели вкладок"""
+        old = self.tab_bar.winfo_children()
+        self.styles.forget([grand for child in old for grand in child.winfo_children()] + old)
+        for child in old:
+            child.destroy()
+        self.tab_labels = []
+        
+        for index in range(len(self.tabs)):
+            active = index == self.active_tab
+            
+            tab = self.styles.register(tk.Frame(self.tab_bar),
+                                       "tab_active" if active else "tab")
+            tab.pack(side=tk.LEFT, padx=(0, 1))
+            label = self.styles.register(
+                tk.Label(tab, text=self.tab_title(index),
+                         font=("Segoe UI", 9, "bold" if active else "normal"),
+                         padx=10, pady=4),
+                "tab_active_text" if active else "tab_text")
+            label.pack(side=tk.LEFT)
+            close = self.styles.register(tk.Label(tab, text="×", font=("Segoe UI", 9), padx=4),
+                                         "tab_active_close" if active else "tab_text")
+            close.pack(side=tk.LEFT)
+            
+            label.bind("<Button-1>", lambda e, i=index: self.switch_tab(i))
+            label.bind("<Button-2>", lambda e, i=index: self.close_tab(i))
+            close.bind("<Button-1>", lambda e, i=index: self.close_tab(i))
+            self.tab_labels.append(label)
+    
+    def update_tab_label(self):
+        """Обновление имени активной вкладки"""
+        if self.tab_labels:
+            self.tab_labels[self.active_tab].config(text=self.tab_title(self.active_tab))
+    
+    def can_switch_tabs(self):
+        """Вкладки нельзя переключать во время загрузки; запись дожидается"""
+        if self.loader is not None:
+            return False
+        if self.saver is not None:
+            self.saver.wait()
+            self.finish_save(self.saver)
+        return True
+    
+    def park_tab(self):
+        """Перенос активного документа из виджета в его вкладку"""
+        self.stop_follow()
+        tab = self.tabs[self.active_tab]
+        tab.path = self.current_file
+        tab.saved = self.saved
+        tab.file_format = self.file_format
+        tab.disk_stamp = self.disk_stamp
+        tab.disk_digest = self.disk_digest
+        tab.long_lines = self.long_lines
+        tab.cursor = self.text_area.index(tk.INSERT)
+        tab.scroll = self.text_area.yview()[0]
+        tab.undo_journal = self.undo_journal
+        tab.edit_journal = self.edit_journal
+        
+        if self.large_doc is not None:
+            self.commit_window()
+            tab.large_doc = self.large_doc
+            tab.window_start = self.window_start
+            tab.spans = None
+            self.large_doc = None
+            self.text_area.vbar.configure(command=self.text_area.yview)
+        else:
+            tab.large_doc = None
+            tab.store_text(self.document.get_text())
+            tab.spans = self.spans
+    
+    def activate_tab(self, index):
+        """Показ документа вкладки в виджете"""
+        tab = self.tabs[index]
+        entry, tab.session = tab.session, None
+        self.active_tab = index
+        self.undo_journal = tab.undo_journal
+        self.edit_journal = tab.edit_journal
+        self.spans = SpanStore()
+        
+        # Найденное относится к прежнему документу
+        self.cancel_search()
+        self.text_area.tag_remove("found", 1.0, tk.END)
+        self.text_area.tag_remove("current_match", 1.0, tk.END)
+        self.search_starts = array("q")
+        self.search_ends = array("q")
+        self.search_current = -1
+        
+        if tab.large_doc is not None:
+            self.large_doc = tab.large_doc
+            self.window_lines = 0
+            self.window_dirty = False
+            self.text_area.vbar.configure(command=self.on_large_scrollbar)
+            self.load_window(tab.window_start)
+            tab.large_doc = None
+        else:
+            # Замена текста не попадает ни в отмену, ни в журнал правок;
+            # модель документа создается заново, а не переписывается
+            self.paging = True
+            try:
+                self.text_area.delete(1.0, tk.END)
+                self.document = PieceTable()
+                self.text_area.insert(1.0, tab.load_text())
+            finally:
+                self.paging = False
+            if tab.spans is not None:
+                self.spans = tab.spans
+                tab.spans = None
+        
+        self.text_area.edit_modified(False)
+        self.text_area.mark_set(tk.INSERT, tab.cursor)
+        self.text_area.yview_moveto(tab.scroll)
+        
+        self.current_file = tab.path
+        self.saved = tab.saved
+        self.file_format = tab.file_format
+        self.disk_stamp = tab.disk_stamp
+        self.disk_digest = tab.disk_digest
+        self.set_long_lines(tab.long_lines)
+        self.show_file_labels()
+        self.show_file_format()
+        self.update_syntax_language()
+        self.refresh_tabs()
+        self.update_stats()
+        self.scheduler.request("status")
+        self.scheduler.request("format")
+        if self.find_window is not None:
+            self.scheduler.request("search")
+        
+        # Документ прошлого сеанса читается при первом показе вкладки
+        if entry is not None:
+            self.open_session_document(entry)
+    
+    def set_long_lines(self, enabled):
+        """Режим длинных строк: без переноса, с отметкой в строке состояния"""
+        self.long_lines = enabled
+        self.text_area.config(wrap=tk.NONE if enabled else tk.WORD)
+        self.scheduler.request("gutter")
+        self.long_lines_label.config(text="Длинные строки: без переноса" if enabled else "")
+    
+    def show_file_format(self):
+        """Кодировка и перевод строки документа в строке состояния"""
+        self.encoding_label.config(text=format_label(self.file_format))
+    
+    def show_file_labels(self):
+        """Имя файла в заголовке, статусной строке и боковой панели"""
+        name = os.path.basename(self.current_file) if self.current_file else None
+        text = f"Файл: {name}" if name else "Новый файл"
+        title = f"Notefish - {name or 'Новый файл'}"
         if not self.saved:
-            response = messagebox.askyesnocancel("Notefish", 
+            text += " *"
+            title += " *"
+        self.file_label.config(text=text)
+        self.file_info_label.config(text=text)
+        self.root.title(title)
+    
+    def switch_tab(self, index):
+        """Переключение на вкладку index"""
+        if index == self.active_tab or not self.can_switch_tabs():
+            return
+        self.park_tab()
+        self.activate_tab(index)
+    
+    def session_tab(self, entry):
+        """Вкладка документа прошлого сеанса; файл читается при ее показе"""
+        tab = DocumentTab(UndoJournal(self.undo_memory_limit_mb * 1024 * 1024), EditJournal())
+        tab.path = entry["path"]
+        tab.file_format = EditJournal.header_format(entry)
+        tab.session = entry
+        return tab
+    
+    def restore_session(self, activate=True):
+        """Вкладки прошлого сеанса; сразу читается только файл активной"""
+        documents, active = self.session.load()
+        self.session_restored = True
+        
+        open_paths = {tab.path for tab in self.tabs} | {self.current_file}
+        tabs = []
+        target = 0
+        for index, entry in enumerate(documents):
+            path = entry.get("path")
+            if not path or path in open_paths or not os.path.isfile(path):
+                continue
+            if index == active:
+                target = len(tabs)
+            tabs.append(self.session_tab(entry))
+        if not tabs:
+            return
+        
+        # Пустой документ запуска заменяется документами сеанса
+        if activate and len(self.tabs) == 1 and self.tab_is_blank() and self.loader is None:
+            self.edit_journal.stop()
+            self.tabs = tabs
+            self.activate_tab(target)
+        else:
+            self.tabs.extend(tabs)
+            self.refresh_tabs()
+    
+    def open_session_document(self, entry):
+        """Открытие документа прошлого сеанса; позиция восстановится после загрузки"""
+        path = entry["path"]
+        stamp = entry.get("stamp")
+        self.session_entry = entry
+        
+        # Файл не менялся - кодировка, режим и длинные строки берутся из снимка
+        if stamp is not None and file_stamp(path) == FileStamp(*stamp):
+            try:
+                if entry.get("large"):
+                    self.open_large_file(path)
+                    self.set_current_file(path)
+                else:
+                    self.set_long_lines(entry.get("long_lines", False))
+                    self.start_loading(path, EditJournal.header_format(entry))
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{str(e)}")
+        else:
+            self.load_file(path)
+        
+        if self.loader is None:
+            self.restore_position()
+    
+    def restore_position(self):
+        """Курсор и прокрутка документа прошлого сеанса после его открытия"""
+        entry, self.session_entry = self.session_entry, None
+        if entry is None or entry["path"] != self.current_file:
+            return
+        
+        if self.large_doc is not None and entry.get("window_start"):
+            self.load_window(entry["window_start"])
+        self.text_area.mark_set(tk.INSERT, entry.get("cursor", "1.0"))
+        self.text_area.yview_moveto(entry.get("scroll", 0.0))
+        self.scheduler.request("status")
+    
+    def session_snapshot(self):
+        """Записи сеанса для вкладок с файлами и индекс активной среди них"""
+        documents = []
+        active = 0
+        for index, tab in enumerate(self.tabs):
+            if index == self.active_tab:
+                # Документ прошлого сеанса еще загружается
+                if self.session_entry is not None:
+                    entry = self.session_entry
+                elif self.current_file is None:
+                    continue
+                else:
+                    entry = Session.entry(self.current_file, self.file_format,
+                                          self.text_area.index(tk.INSERT),
+                                          self.text_area.yview()[0], self.disk_stamp,
+                                          self.large_doc is not None, self.window_start,
+                                          self.long_lines)
+                active = len(documents)
+            elif tab.session is not None:
+                entry = tab.session
+            elif tab.path is None:
+                continue
+            else:
+                entry = Session.entry(tab.path, tab.file_format, tab.cursor, tab.scroll,
+                                      tab.disk_stamp, tab.large_doc is not None,
+                                      tab.window_start, tab.long_lines)
+            documents.append(entry)
+        return documents, active
+    
+    def save_session(self):
+        """Запись снимка сеанса, если он изменился"""
+        if self.session_restored:
+            self.session.write(*self.session_snapshot())
+    
+    def next_tab(self):
+        """Переключение на следующую вкладку по кругу"""
+        self.switch_tab((self.active_tab + 1) % len(self.tabs))
+        return "break"
+    
+    def new_tab(self):
+        """Новая пустая вкладка; False, если переключиться нельзя"""
+        if not self.can_switch_tabs():
+            return False
+        
+        self.park_tab()
+        self.tabs.append(DocumentTab(UndoJournal(self.undo_memory_limit_mb * 1024 * 1024),
+                                     EditJournal()))
+        self.activate_tab(len(self.tabs) - 1)
+        self.reset_document()
+        return True
+    
+    def close_tab(self, index=None):
+        """Закрытие вкладки с предложением сохранить изменения"""
+        if index is not None and index != self.active_tab:
+            # Сохраненная фоновая вкладка закрывается без показа: загрузка
+            # и слежение активной не прерываются, файл прошлого сеанса не читается
+            if self.tabs[index].saved:
+                self.drop_tab(index)
+                return "break"
+            
+            # Для вопроса о сохранении вкладка показывается
+            self.switch_tab(index)
+            if index != self.active_tab:
+                return "break"
+        
+        self.cancel_loading()
+        self.stop_follow()
+        if not self.saved:
+            response = messagebox.askyesnocancel("Notefish",
                                                 "Сохранить изменения в текущем файле?")
             if response is None:
-                return
+                return "break"
             elif response:
-                if not self.save_file():
+                if not self.save_file(wait=True):
+                    return "break"
+        
+        if not self.can_switch_tabs():
+            return "break"
+        self.close_large_file()
+        self.edit_journal.stop()
+        
+        # Последняя вкладка не закрывается, а очищается
+        if len(self.tabs) == 1:
+            self.reset_document()
+            return "break"
+        
+        self.tabs.pop(self.active_tab)
+        self.activate_tab(min(self.active_tab, len(self.tabs) - 1))
+        return "break"
+    
+    def drop_tab(self, index):
+        """Удаление неактивной вкладки вместе с ее журналом и большим файлом"""
+        tab = self.tabs.pop(index)
+        tab.edit_journal.stop()
+        if tab.large_doc is not None:
+            tab.large_doc.close()
+        if index < self.active_tab:
+            self.active_tab -= 1
+        self.refresh_tabs()
+        self.scheduler.request("session")
+    
+    def load_file(self, file_path):
+        """Загрузка файла в редактор"""
+        try:
+            self.cancel_loading()
+            self.stop_follow()
+            size_mb = os.path.getsize(file_path) / (1024 * 1024)
+            # UTF-16 и UTF-32 нельзя резать на строки по байтам - такие
+            # файлы загружаются целиком при любом размере
+            if size_mb >= self.large_file_threshold_mb and \
+                    ascii_compatible(sniff_encoding(file_path)[0]):
+                self.open_large_file(file_path)
+                self.set_current_file(file_path)
+            else:
+                self.close_large_file()
+                self.start_loading(file_path)
+            
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{str(e)}")
+    
+    def set_current_file(self, file_path):
+        """Привязка редактора к открытому файлу"""
+        self.current_file = file_path
+        self.saved = True
+        filename = os.path.basename(file_path)
+        self.file_label.config(text=f"Файл: {filename}")
+        self.file_info_label.config(text=f"Файл: {filename}")
+        self.root.title(f"Notefish - {filename}")
+        self.show_file_format()
+        self.update_tab_label()
+        self.update_stats()
+        self.update_syntax_language()
+        
+        # Журнал правок отсчитывается от файла на диске
+        if self.large_doc is None:
+            self.edit_journal.start(file_path, self.file_format)
+        else:
+            self.edit_journal.stop()
+    
+    def start_loading(self, file_path, file_format=None):
+        """Запуск фоновой загрузки файла; с известной кодировкой она не определяется"""
+        if file_format is None:
+            loader = FileLoader(file_path)
+        else:
+            loader = FileLoader(file_path, file_format.encoding)
+            loader.bom = file_format.bom
+            loader.newline = file_format.newline
+        self.loader = loader
+        
+        # Во время загрузки текст только для чтения
+        self.syntax.reset(None, 0)
+        self.text_area.delete(1.0, tk.END)
+        self.text_area.config(state=tk.DISABLED)
+        
+        self.file_label.config(text=f"Загрузка: {os.path.basename(file_path)}")
+        self.load_progress["value"] = 0
+        self.load_cancel_btn.pack(side=tk.RIGHT, padx=(0, 15))
+        self.load_progress.pack(side=tk.RIGHT, padx=5)
+        
+        loader.start()
+        self.root.after(LOAD_POLL_MS, self.poll_loading, loader)
+    
+    def poll_loading(self, loader):
+        """Вставка готовых порций в пределах бюджета времени"""
+        if loader is not self.loader:
+            return
+        
+        deadline = time.perf_counter() + LOAD_SLICE_SECONDS
+        self.text_area.config(state=tk.NORMAL)
+        try:
+            while time.perf_counter() < deadline:
+                try:
+                    chunk = loader.queue.get_nowait()
+                except queue.Empty:
+                    break
+                
+                if chunk is None:
+                    self.finish_loading(loader)
                     return
+                
+                # Перенос выключается до вставки длинной строки
+                if loader.long_lines and not self.long_lines:
+                    self.set_long_lines(True)
+                self.text_area.insert("end-1c", chunk)
+        finally:
+            if self.loader is loader:
+                self.text_area.config(state=tk.DISABLED)
+        
+        self.load_progress["value"] = loader.progress() * 100
+        self.scheduler.request("stats")
+        self.root.after(LOAD_POLL_MS, self.poll_loading, loader)
+    
+    def finish_loading(self, loader):
+        """Завершение фоновой загрузки"""
+        self.stop_loading()
+        
+        if loader.error is not None:
+            self.reset_document()
+            messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{str(loader.error)}")
+            return
+        
+        # Порции загрузки не должны попадать в историю отмены
+        self.text_area.edit_reset()
+        self.text_area.edit_modified(False)
+        self.text_area.mark_set(tk.INSERT, 1.0)
+        self.file_format = loader.file_format
+        self.set_long_lines(loader.long_lines)
+        self.disk_stamp = loader.stamp
+        self.disk_digest = loader.digest
+        self.set_current_file(loader.path)
+        self.load_formatting(loader.path)
+        self.restore_position()
+    
+    def stop_loading(self):
+        """Скрытие индикатора загрузки и разблокировка текста"""
+        self.loader = None
+        self.text_area.config(state=tk.NORMAL)
+        self.load_progress.pack_forget()
+        self.load_cancel_btn.pack_forget()
+    
+    def cancel_loading(self):
+        """Отмена фоновой загрузки; частично загруженный текст отбрасывается"""
+        if self.loader is None:
+            return
+        
+        self.loader.cancel()
+        self.stop_loading()
+        self.reset_document()
+        self.file_label.config(text="Загрузка отменена")
+    
+    def toggle_follow(self):
+        """Включение и выключение слежения за дописываемым файлом"""
+        if self.follower is not None:
+            self.stop_follow()
+            return
+        
+        if self.current_file is None or self.loader is not None or self.reload_job is not None:
+            return
+        if self.large_doc is not None:
+            messagebox.showinfo("Notefish", "Слежение недоступно для больших файлов.")
+            return
+        if not self.saved or self.disk_stamp is None:
+            messagebox.showinfo("Notefish", "Сохраните изменения перед слежением за файлом.")
+            return
+        
+        # Чтение продолжается с байта, на котором закончилась загрузка:
+        # размер в отметке - число прочитанных, а не текущий размер файла
+        follower = FileFollower(self.current_file, self.disk_stamp.size, self.file_format)
+        self.follower = follower
+        self.follow_trimmed = False
+        
+        # Дописанное не попадает в историю, а урезание сдвигает ее смещения
+        self.undo_journal.reset()
+        self.apply_follow([])
+        self.text_area.see(tk.END)
+        self.file_label.config(text=f"Слежение: {os.path.basename(self.current_file)}")
+        
+        follower.start()
+        self.root.after(FOLLOW_POLL_MS, self.poll_follow, follower)
+    
+    def poll_follow(self, follower):
+        """Перенос прочитанного из очереди слежения в текст"""
+        if follower is not self.follower:
+            return
+        
+        items = []
+        deadline = time.perf_counter() + LOAD_SLICE_SECONDS
+        while time.perf_counter() < deadline:
+            try:
+                item = follower.queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if item is None:
+                self.apply_follow(items)
+                self.stop_follow()
+                if follower.error is not None:
+                    messagebox.showerror("Ошибка", f"Слежение за файлом остановлено:\n"
+                                                  f"{str(follower.error)}")
+                return
+            items.append(item)
+        
+        if items:
+            # Прокрутка следует за концом, только если он уже был виден
+            at_end = self.text_area.yview()[1] >= 1.0
+            self.apply_follow(items)
+            if at_end:
+                self.text_area.see(tk.END)
+            self.scheduler.request("stats")
+        
+        self.root.after(FOLLOW_POLL_MS, self.poll_follow, follower)
+    
+    def apply_follow(self, items):
+        """Дописывание прочитанного и удаление строк сверх предела"""
+        pending = []
+        self.text_area.config(state=tk.NORMAL)
+        # Как и загрузка, это не правки: журналы отмены и восстановления их не видят
+        self.paging = True
+        try:
+            for kind, text, offset in items:
+                if kind == "reset":
+                    pending = []
+                    self.text_area.delete(1.0, tk.END)
+                else:
+                    pending.append(text)
+                self.disk_stamp = FileStamp(offset, None, None)
+            if pending:
+                self.text_area.insert("end-1c", "".join(pending))
+            
+            # Запас в десятую часть предела: строки удаляются не на каждом тике
+            limit = self.follow_max_lines
+            lines = self.document.line_count
+            if limit and lines > limit + limit // 10:
+                self.text_area.delete(1.0, f"{lines - limit + 1}.0")
+                self.follow_trimmed = True
+        finally:
+            self.paging = False
+            self.text_area.config(state=tk.DISABLED)
+            self.text_area.edit_modified(False)
+    
+    def stop_follow(self):
+        """Выключение слежения"""
+        if self.follower is None:
+            return
+        
+        self.follower.cancel()
+        self.follower = None
+        self.text_area.config(state=tk.NORMAL)
+        
+        if self.follow_trimmed:
+            # Урезанный буфер - лишь хвост файла: сохранение поверх
+            # файла потеряло бы его начало, поэтому связь с файлом рвется
+            self.current_file = None
+            self.disk_stamp = None
+            self.edit_journal.start()
+        else:
+            # Дописанное после последней порции найдет проверка файла
+            stamp = file_stamp(self.current_file)
+            if stamp is not None and stamp.size == self.disk_stamp.size:
+                self.disk_stamp = stamp
+            self.disk_digest = None
+            self.edit_journal.start(self.current_file, self.file_format)
+        self.show_file_labels()
+        self.update_tab_label()
+    
+    def check_disk(self):
+        """Периодическая проверка, не изменила ли файл другая программа"""
+        self.root.after(WATCH_POLL_MS, self.check_disk)
+        busy = (self.loader, self.follower, self.saver, self.reload_job)
+        if self.current_file is None or self.disk_stamp is None or any(busy):
+            return
+        
+        stamp = file_stamp(self.current_file)
+        if stamp == self.disk_stamp:
+            return
+        
+        # Об одном изменении спрашиваем один раз
+        old_stamp, self.disk_stamp = self.disk_stamp, stamp
+        if stamp is None:
+            self.saved = False
+            self.update_title()
+            self.file_label.config(text=f"Файл удален: {os.path.basename(self.current_file)}")
+            return
+        
+        if self.large_doc is not None:
+            if self.ask_reload():
+                self.load_file(self.current_file)
+            else:
+                self.saved = False
+                self.update_title()
+            return
+        
+        # Чтение и сравнение идут в фоне; совпавший хэш - ложная тревога
+        job = ReloadJob(self.current_file, self.document.get_text(), old_stamp,
+                        self.disk_digest, self.file_format, self.revision)
+        self.reload_job = job
+        job.start()
+        self.root.after(RELOAD_POLL_MS, self.poll_reload, job)
+    
+    def ask_reload(self):
+        """Вопрос о перезагрузке изменившегося файла"""
+        text = f"Файл {os.path.basename(self.current_file)} изменен другой программой.\n"
+        if not self.saved:
+            text += "Несохраненные изменения будут заменены, их можно вернуть отменой.\n"
+        return messagebox.askyesno("Notefish", text + "Перезагрузить его?")
+    
+    def poll_reload(self, job):
+        """Ожидание фонового сравнения с файлом на диске"""
+        if not job.done.is_set():
+            self.root.after(RELOAD_POLL_MS, self.poll_reload, job)
+            return
+        self.reload_job = None
+        
+        if job.error is not None or job.path != self.current_file:
+            return
+        
+        # Текст правили, пока шло сравнение - проверка повторится
+        if job.revision != self.revision:
+            self.disk_stamp = job.old_stamp
+            return
+        
+        # Файл совпадает с текстом: только отметка или сохранение извне
+        if not job.regions:
+            self.disk_stamp, self.disk_digest = job.stamp, job.digest
+            if not self.saved:
+                self.saved = True
+                self.show_file_labels()
+                self.update_tab_label()
+            return
+        
+        if self.ask_reload():
+            self.apply_reload(job)
+        else:
+            self.saved = False
+            self.update_title()
+    
+    def apply_reload(self, job):
+        """Перенос в текст только изменившихся участков файла"""
+        regions = job.regions
+        cursor = self.document.offset(*self.widget_position(tk.INSERT))
+        top = self.document.offset(*self.widget_position("@0,0"))
+        
+        # Вся перезагрузка - один шаг отмены; участки идут с конца,
+        # чтобы смещения еще не обработанных оставались верными
+        self.undo_journal.begin_group()
+        try:
+            for start, end, text in reversed(regions):
+                first = "{}.{}".format(*self.text_position(start))
+                last = "{}.{}".format(*self.text_position(end))
+                if end > start:
+                    self.text_area.delete(first, last)
+                if text:
+                    self.text_area.insert(first, text)
+        finally:
+            self.undo_journal.end_group()
+        
+        self.text_area.mark_set(tk.INSERT, "{}.{}".format(
+            *self.text_position(shift_offset(cursor, regions))))
+        self.text_area.yview("{}.0".format(self.text_position(shift_offset(top, regions))[0]))
+        self.text_area.edit_modified(False)
         
+        self.file_format = job.file_format
+        self.disk_stamp, self.disk_digest = job.stamp, job.digest
+        self.saved = True
+        self.edit_journal.start(self.current_file, self.file_format)
+        self.show_file_labels()
+        self.show_file_format()
+        self.update_tab_label()
+        self.scheduler.request("status")
+        self.scheduler.request("stats")
+    
+    def widget_position(self, index):
+        """Строка (с 0) и колонка индекса виджета"""
+        line, column = map(int, self.text_area.index(index).split("."))
+        return line - 1, column
+    
+    def text_position(self, offset):
+        """Индекс виджета (строка с 1, колонка) для смещения в документе"""
+        line, column = self.document.position(offset)
+        return line + 1, column
+    
+    def reset_document(self):
+        """Очистка редактора до состояния нового файла"""
         self.text_area.delete(1.0, tk.END)
+        self.text_area.edit_reset()
+        self.text_area.edit_modified(False)
         self.current_file = None
         self.saved = True
+        self.file_format = DEFAULT_FILE_FORMAT
+        self.disk_stamp = None
+        self.disk_digest = None
+        self.set_long_lines(False)
         self.file_label.config(text="Новый файл")
         self.file_info_label.config(text="Новый файл")
         self.root.title("Notefish - Новый файл")
+        self.show_file_format()
+        self.update_tab_label()
         self.update_stats()
+        self.update_syntax_language()
+        self.edit_journal.start()
+        self.session_entry = None
     
-    def open_file(self, event=None):
-        """Открытие файла"""
-        if not self.saved:
-            response = messagebox.askyesnocancel("Notefish",
-                                                "Сохранить изменения в текущем файле?")
-            if response is None:
-                return
-            elif response:
-                if not self.save_file():
-                    return
+    def open_large_file(self, file_path):
+        """Открытие большого файла в виртуальном режиме"""
+        document = LargeFileDocument(file_path)
+        self.close_large_file()
+        
+        self.large_doc = document
+        self.file_format = document.file_format
+        self.disk_stamp = file_stamp(file_path)
+        self.disk_digest = None
+        self.set_long_lines(False)
+        self.window_lines = 0
+        self.window_dirty = False
+        
+        # Полоса прокрутки показывает положение во всем файле, а не в окне
+        self.text_area.vbar.configure(command=self.on_large_scrollbar)
+        
+        self.load_window(0)
+    
+    def close_large_file(self):
+        """Выход из виртуального режима"""
+        if self.large_doc is None:
+            return
+        
+        self.large_doc.close()
+        self.large_doc = None
+        self.text_area.vbar.configure(command=self.text_area.yview)
+    
+    def load_window(self, first_line):
+        """Подгрузка окна строк, начиная с first_line, в виджет"""
+        # Отображение файла сейчас читает и закрывает поток записи
+        if self.large_saving():
+            return
+        
+        self.commit_window()
+        document = self.large_doc
+        first = max(0, min(first_line, document.line_count - LARGE_WINDOW_LINES))
+        lines = document.get_lines(first, first + LARGE_WINDOW_LINES)
+        
+        self.paging = True
+        try:
+            self.text_area.delete(1.0, tk.END)
+            self.text_area.insert(1.0, "\n".join(lines))
+        finally:
+            self.paging = False
+        
+        self.window_start = first
+        self.window_lines = len(lines)
+        if not self.long_lines and any(len(line) >= LONG_LINE_CHARS for line in lines):
+            self.set_long_lines(True)
+        
+        # Смена окна не должна попадать в историю отмены
+        self.text_area.edit_reset()
+        self.text_area.edit_modified(False)
+    
+    def commit_window(self):
+        """Перенос правок окна в оверлей документа"""
+        if self.large_doc is None or not self.window_dirty:
+            return
+        
+        lines = self.document.get_text().split("\n")
+        self.large_doc.replace_lines(self.window_start,
+                                     self.window_start + self.window_lines, lines)
+        self.window_lines = len(lines)
+        self.window_dirty = False
+    
+    def sync_document(self, delta):
+        """Применение дельты правки виджета к модели документа"""
+        self.revision += 1
+        line, column = map(int, delta.index.split("."))
+        offset = self.document.offset(line - 1, column)
+        newlines = delta.text.count("\n")
+        if delta.kind == "insert":
+            self.document.insert(offset, delta.text)
+            self.spans.insert(offset, len(delta.text))
+            self.syntax.edit(line - 1, 0, newlines)
+        else:
+            self.document.delete(offset, len(delta.text))
+            self.spans.delete(offset, len(delta.text))
+            self.syntax.edit(line - 1, newlines, 0)
+        
+        if self.syntax.lexer is not None:
+            self.scheduler.request("syntax")
+        
+        if not self.spans.is_plain():
+            self.scheduler.request("format")
+        
+        # Загрузка файла и смена окна в журналы не попадают
+        if self.paging or self.loader is not None:
+            return
+        
+        if not self.undo_replaying:
+            self.undo_journal.record(delta.kind, offset, delta.text)
+        
+        self.edit_journal.append(delta.kind, offset, delta.text)
+        self.scheduler.request("journal")
+    
+    def flush_journal(self):
+        """Периодический сброс и сворачивание журнала правок"""
+        if self.edit_journal.needs_compaction(len(self.document)):
+            self.edit_journal.snapshot(self.document.get_text())
+        else:
+            self.edit_journal.flush()
+    
+    def offer_recovery(self):
+        """Восстановление документа из журнала аварийно завершенного сеанса; True, если восстановлен"""
+        for path, header in EditJournal.orphans():
+            name = os.path.basename(header.get("path") or "") or "Новый файл"
+            answer = messagebox.askyesno(
+                "Восстановление",
+                f"Найдены несохраненные изменения ({name}).\nВосстановить?")
+            
+            try:
+                if answer:
+                    header, text = EditJournal.replay(path)
+                    self.restore_recovered(header.get("path"), text,
+                                           EditJournal.header_format(header))
+            except Exception as e:
+                messagebox.showerror("Ошибка", f"Не удалось восстановить изменения:\n{str(e)}")
+                answer = False
+            finally:
+                os.remove(path)
+            
+            # Остальные журналы будут предложены при следующем запуске
+            if answer:
+                return True
+        return False
+    
+    def restore_recovered(self, file_path, text, file_format=DEFAULT_FILE_FORMAT):
+        """Загрузка восстановленного текста как несохраненного документа"""
+        self.reset_document()
+        self.edit_journal.stop()
+        self.text_area.insert(1.0, text)
+        self.text_area.edit_reset()
+        self.text_area.mark_set(tk.INSERT, 1.0)
+        
+        self.current_file = file_path
+        self.saved = False
+        self.file_format = file_format
+        self.show_file_format()
+        self.update_title()
+        self.update_stats()
+        self.update_syntax_language()
+        
+        # Новый журнал сразу содержит весь восстановленный текст
+        self.edit_journal.start(file_path, file_format)
+        self.edit_journal.snapshot(text)
+    
+    def handle_undo_command(self, command):
+        """Команды edit undo/redo/separator/reset виджета"""
+        journal = self.undo_journal
+        if command == "undo":
+            step = journal.undo()
+            if step is not None:
+                inverse = {"insert": "delete", "delete": "insert"}
+                self.apply_deltas([(inverse[kind], offset, text)
+                                   for kind, offset, text in reversed(step)])
+        elif command == "redo":
+            step = journal.redo()
+            if step is not None:
+                self.apply_deltas(step)
+        elif command == "separator":
+            journal.separator()
+        elif command == "reset":
+            journal.reset()
+        elif command == "canundo":
+            return int(journal.can_undo())
+        elif command == "canredo":
+            return int(journal.can_redo())
+        return ""
+    
+    def apply_deltas(self, deltas):
+        """Применение дельт к виджету без записи в журнал отмены"""
+        self.undo_replaying = True
+        try:
+            for kind, offset, text in deltas:
+                line, col = self.document.position(offset)
+                index = f"{line + 1}.{col}"
+                if kind == "insert":
+                    self.text_area.insert(index, text)
+                    index = f"{index}+{len(text)}c"
+                else:
+                    self.text_area.delete(index, f"{index}+{len(text)}c")
+        finally:
+            self.undo_replaying = False
+        
+        self.text_area.mark_set(tk.INSERT, index)
+        self.text_area.see(tk.INSERT)
+        self.scheduler.request("status")
+    
+    def on_text_delta(self, delta):
+        """Обработка дельты правки"""
+        # Перенос может сдвинуть строки экрана и без смены прокрутки
+        self.scheduler.request("gutter")
+        if self.large_doc is not None and not self.paging:
+            self.window_dirty = True
+        
+        # Смещения найденного устарели - поиск повторяется после паузы;
+        # смена окна большого файла документ не меняет
+        window_moved = self.large_doc is not None and self.paging
+        if self.find_window is not None and self.search_starts and not window_moved:
+            self.scheduler.request("search")
+    
+    def widget_line_count(self):
+        """Число строк в виджете"""
+        return self.document.line_count
+    
+    def large_line_count(self):
+        """Число строк большого файла с учетом правок в окне"""
+        return self.large_doc.line_count - self.window_lines + self.widget_line_count()
+    
+    def on_text_yscroll(self, first, last):
+        """Обработка изменения видимой области текста"""
+        if self.large_doc is not None:
+            self.on_large_yscroll(first, last)
+        else:
+            self.text_area.vbar.set(first, last)
+        
+        # Номера строк, подсветка совпадений и оформление зависят от видимой области
+        self.scheduler.request("gutter")
+        self.scheduler.request("session")
+        if self.search_starts:
+            self.scheduler.request("highlight")
+        if not self.spans.is_plain():
+            self.scheduler.request("format")
+        if self.syntax.lexer is not None:
+            self.scheduler.request("syntax_tags")
+    
+    def configure_gutter(self):
+        """Шрифт и цвет номеров строк по текущим настройкам"""
+        self.gutter.configure((self.current_font, self.current_font_size), self.colors["slate"])
+        self.scheduler.request("gutter")
+    
+    def update_gutter(self):
+        """Перерисовка номеров видимых строк"""
+        if self.large_doc is not None:
+            self.gutter.redraw(self.window_start + 1, self.large_line_count())
+        else:
+            self.gutter.redraw(1, self.document.line_count)
+    
+    def on_large_yscroll(self, first, last):
+        """Пересчет положения полосы прокрутки из окна на весь файл"""
+        total = max(1, self.large_line_count())
+        lines = self.widget_line_count()
+        first, last = float(first), float(last)
         
-        file_path = filedialog.askopenfilename(
-            defaultextension=".txt",
-            filetypes=[
-                ("Текстовые файлы", "*.txt"),
-                ("Все файлы", "*.*"),
-                ("Python файлы", "*.py"),
-                ("HTML файлы", "*.html;*.htm"),
-                ("CSS файлы", "*.css"),
-                ("JavaScript файлы", "*.js"),
-                ("Markdown файлы", "*.md")
-            ]
-        )
+        self.text_area.vbar.set((self.window_start + first * lines) / total,
+                                (self.window_start + last * lines) / total)
         
-        if file_path:
-            try:
-                with open(file_path, "r", encoding="utf-8") as file:
-                    content = file.read()
-                    self.text_area.delete(1.0, tk.END)
-                    self.text_area.insert(1.0, content)
-                
-                self.current_file = file_path
-                self.saved = True
-                filename = os.path.basename(file_path)
-                self.file_label.config(text=f"Файл: {filename}")
-                self.file_info_label.config(text=f"Файл: {filename}")
-                self.root.title(f"Notefish - {filename}")
-                self.update_stats()
-                
-            except Exception as e:
-                messagebox.showerror("Ошибка", f"Не удалось открыть файл:\n{str(e)}")
+        # Область просмотра подошла к краю окна
+        near_top = self.window_start > 0 and first * lines < LARGE_WINDOW_MARGIN
+        near_bottom = (self.window_start + lines < total
+                       and (1 - last) * lines < LARGE_WINDOW_MARGIN)
+        if near_top or near_bottom:
+            self.scheduler.request("window")
+    
+    def on_large_scrollbar(self, *args):
+        """Команда полосы прокрутки в виртуальном режиме"""
+        if args[0] != "moveto":
+            self.text_area.yview(*args)
+            return
+        
+        target = int(float(args[1]) * self.large_line_count())
+        if not self.window_start <= target < self.window_start + self.widget_line_count():
+            self.load_window(target - LARGE_WINDOW_LINES // 2)
+        self.text_area.yview(f"{target - self.window_start + 1}.0")
+    
+    def update_large_window(self):
+        """Перемещение окна вокруг области просмотра"""
+        if self.large_doc is None:
+            return
+        
+        top = self.window_start + int(self.text_area.index("@0,0").split(".")[0])
+        line, col = self.text_area.index(tk.INSERT).split(".")
+        cursor = self.window_start + int(line)
+        
+        self.load_window(top - LARGE_WINDOW_LINES // 2)
+        
+        # Восстанавливаем курсор, если он остался в новом окне
+        if self.window_start < cursor <= self.window_start + self.window_lines:
+            self.text_area.mark_set(tk.INSERT, f"{cursor - self.window_start}.{col}")
+        self.text_area.yview(f"{top - self.window_start}.0")
+    
+    def ask_goto_line(self):
+        """Диалог перехода к строке"""
+        line = simpledialog.askinteger("Перейти к строке", "Номер строки:",
+                                       parent=self.root, minvalue=1)
+        if line:
+            self.goto_line(line)
+    
+    def goto_line(self, line):
+        """Переход к строке (нумерация с 1)"""
+        if self.large_doc is not None:
+            line = min(line, self.large_line_count())
+            if not self.window_start < line <= self.window_start + self.widget_line_count():
+                self.load_window(line - 1 - LARGE_WINDOW_LINES // 2)
+            line -= self.window_start
+        
+        self.text_area.mark_set(tk.INSERT, f"{line}.0")
+        self.text_area.see(tk.INSERT)
+        self.text_area.focus_set()
+        self.scheduler.request("status")
     
-    def save_file(self, event=None):
-        """Сохранение файла"""
+    def save_file(self, event=None, wait=False):
+        """Сохранение файла; wait=True дожидается окончания записи"""
         if self.current_file is None:
-            return self.save_as_file()
+            return self.save_as_file(wait=wait)
+        
+        # Частично загруженный файл сохранять нельзя
+        if self.loader is not None:
+            return False
+        
+        # Под слежением может быть показан только хвост файла
+        if self.follower is not None:
+            messagebox.showinfo("Notefish", "Остановите слежение, чтобы сохранить файл.")
+            return False
+        
+        # Предыдущая запись должна завершиться раньше следующей и
+        # проверки файла на диске: иначе ее результат выглядит чужим изменением
+        if self.saver is not None:
+            self.saver.wait()
+            self.finish_save(self.saver)
+        
+        # Изменения другой программы не перезаписываются молча
+        stamp = file_stamp(self.current_file)
+        if self.disk_stamp is not None and stamp not in (None, self.disk_stamp):
+            if not messagebox.askyesno("Notefish", "Файл изменен другой программой.\n"
+                                                   "Перезаписать его?"):
+                return False
         
         try:
-            content = self.text_area.get(1.0, tk.END)
-            with open(self.current_file, "w", encoding="utf-8") as file:
-                file.write(content)
-            
-            self.saved = True
-            filename = os.path.basename(self.current_file)
-            self.file_label.config(text=f"Файл: {filename} ✓")
-            self.file_info_label.config(text=f"Файл: {filename} ✓")
-            messagebox.showinfo("Сохранение", f"Файл '{filename}' успешно сохранен!")
-            return True
+            if self.large_doc is not None:
+                saver = self.start_large_save()
+            else:
+                # Снимок берется из модели: текст файла без служебного перевода строки Tk
+                saver = FileSaver(self.current_file, self.document.get_text(),
+                                  self.file_format, formatting=self.spans.to_records())
+                saver.start()
             
         except Exception as e:
             messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{str(e)}")
             return False
+        
+        # Снимок текста уже сделан - дальнейшие правки его не затронут
+        self.saver = saver
+        self.saved = True
+        self.file_label.config(text=f"Сохранение: {os.path.basename(saver.path)}...")
+        
+        if wait:
+            saver.wait()
+            return self.finish_save(saver)
+        
+        self.root.after(SAVE_POLL_MS, self.poll_saving, saver)
+        return True
+    
+    def poll_saving(self, saver):
+        """Проверка завершения фонового сохранения"""
+        if not saver.done.is_set():
+            self.root.after(SAVE_POLL_MS, self.poll_saving, saver)
+            return
+        self.finish_save(saver)
+    
+    def finish_save(self, saver):
+        """Обработка результата фонового сохранения"""
+        if saver.reported:
+            return saver.error is None
+        saver.reported = True
+        if self.saver is saver:
+            self.saver = None
+        if isinstance(saver, LargeFileSaver):
+            self.finish_large_save(saver)
+        
+        if saver.error is not None:
+            self.saved = False
+            self.scheduler.request("title")
+            messagebox.showerror("Ошибка", f"Не удалось сохранить файл:\n{str(saver.error)}")
+            return False
+        
+        # На диске теперь записанное, даже если текст успел измениться
+        if saver.path == self.current_file:
+            self.disk_stamp = saver.stamp
+            self.disk_digest = saver.digest
+        
+        # Текст мог измениться, пока шла запись
+        if self.saved and saver.path == self.current_file:
+            # Замененные при чтении байты теперь записаны как есть
+            self.file_format = self.file_format._replace(lossy=False)
+            self.show_file_format()
+            self.show_saved(saver.elapsed)
+            self.edit_journal.start(self.current_file, self.file_format)
+            self.scheduler.request("session")
+        elif self.large_doc is None:
+            self.edit_journal.snapshot(self.document.get_text())
+        return True
+    
+    def show_saved(self, elapsed):
+        """Сообщение об успешном сохранении в статусной строке"""
+        filename = os.path.basename(self.current_file)
+        self.file_label.config(text=f"Файл: {filename} ✓ ({elapsed * 1000:.0f} мс)")
+        self.file_info_label.config(text=f"Файл: {filename} ✓")
+        self.root.title(f"Notefish - {filename}")
+        self.update_tab_label()
     
-    def save_as_file(self, event=None):
+    def start_large_save(self):
+        """Запуск фоновой записи большого файла; окно до ее конца только для чтения"""
+        self.commit_window()
+        self.cancel_search()
+        saver = LargeFileSaver(self.current_file, self.large_doc)
+        saver.start()
+        self.text_area.config(state=tk.DISABLED)
+        return saver
+    
+    def finish_large_save(self, saver):
+        """Возврат окна к правке; сохраненный файл отображается заново на потоке интерфейса"""
+        self.text_area.config(state=tk.NORMAL)
+        if saver.error is not None or self.large_doc is not saver.document:
+            return
+        
+        # Уже без оверлеев: правки записаны в файл
+        top = self.window_start + int(self.text_area.index("@0,0").split(".")[0])
+        self.large_doc = LargeFileDocument(saver.path)
+        self.window_lines = 0
+        self.load_window(top - LARGE_WINDOW_LINES // 2)
+        self.text_area.yview(f"{top - self.window_start}.0")
+    
+    def large_saving(self):
+        """Идет ли фоновая запись большого файла"""
+        return isinstance(self.saver, LargeFileSaver)
+    
+    def save_as_file(self, event=None, wait=False):
         """Сохранение файла как"""
         file_path = filedialog.asksaveasfilename(
             defaultextension=".txt",
@@ -466,82 +4581,420 @@ class Notefish:
         )
         
         if file_path:
+            # Перезапись выбранного файла уже подтверждена в диалоге
             self.current_file = file_path
-            return self.save_file()
+            self.disk_stamp = None
+            self.disk_digest = None
+            self.update_syntax_language()
+            return self.save_file(wait=wait)
         return False
     
     def find_text(self):
         """Поиск текста"""
-        # Создание диалогового окна поиска
+        if self.find_window is not None:
+            self.find_window.lift()
+            self.find_entry.focus()
+            return
+        
+        # Создание диалогового окна поиска (немодального)
         find_window = tk.Toplevel(self.root)
         find_window.title("Найти текст")
-        find_window.geometry("400x180")
+        find_window.geometry("400x330")
         find_window.resizable(False, False)
         find_window.configure(bg="white")
+        self.find_window = find_window
         
         # Центрирование
         find_window.transient(self.root)
-        find_window.grab_set()
         x = self.root.winfo_x() + (self.root.winfo_width() // 2) - 200
-        y = self.root.winfo_y() + (self.root.winfo_height() // 2) - 90
+        y = self.root.winfo_y() + (self.root.winfo_height() // 2) - 165
         find_window.geometry(f"+{x}+{y}")
         
         # Поле ввода
         tk.Label(find_window, text="Введите текст для поиска:", 
                 bg="white", font=("Segoe UI", 10)).pack(pady=(20, 5))
         
-        find_entry = tk.Entry(find_window, font=("Segoe UI", 10),
-                             bg="#f8fafc", relief="flat", width=40)
-        find_entry.pack(pady=5, padx=20, ipady=5)
-        find_entry.focus()
+        self.find_var = tk.StringVar()
+        self.find_entry = tk.Entry(find_window, textvariable=self.find_var,
+                                   font=("Segoe UI", 10),
+                                   bg="#f8fafc", relief="flat", width=40)
+        self.find_entry.pack(pady=5, padx=20, ipady=5)
+        self.find_entry.focus()
+        self.find_entry.bind("<Return>", lambda e: self.find_next())
+        self.find_entry.bind("<Shift-Return>", lambda e: self.find_previous())
+        
+        tk.Label(find_window, text="Заменить на:",
+                bg="white", font=("Segoe UI", 10)).pack(pady=(5, 0))
+        
+        self.replace_var = tk.StringVar()
+        replace_entry = tk.Entry(find_window, textvariable=self.replace_var,
+                                 font=("Segoe UI", 10),
+                                 bg="#f8fafc", relief="flat", width=40)
+        replace_entry.pack(pady=5, padx=20, ipady=5)
+        replace_entry.bind("<Return>", lambda e: self.replace_current())
+        
+        # Режимы поиска
+        options_frame = tk.Frame(find_window, bg="white")
+        options_frame.pack(pady=5)
+        
+        self.find_ignore_case = tk.BooleanVar(value=False)
+        self.find_whole_word = tk.BooleanVar(value=False)
+        self.find_regex = tk.BooleanVar(value=False)
+        for text, variable in [("Без учета регистра", self.find_ignore_case),
+                               ("Целые слова", self.find_whole_word),
+                               ("Рег. выражение", self.find_regex)]:
+            tk.Checkbutton(options_frame, text=text, variable=variable,
+                           bg="white", font=("Segoe UI", 9),
+                           command=self.do_find).pack(side=tk.LEFT, padx=3)
+        
+        # Смена запроса перезапускает поиск после паузы в наборе
+        self.find_var.trace_add("write", lambda *args: self.scheduler.request("search"))
+        
+        # Счетчик совпадений
+        self.match_label = tk.Label(find_window, text="", bg="white",
+                                    fg=self.colors["text_dark"],
+                                    font=("Segoe UI", 9))
+        self.match_label.pack()
         
         # Фрейм для кнопок
         button_frame = tk.Frame(find_window, bg="white")
-        button_frame.pack(pady=15)
+        button_frame.pack(pady=10)
+        
+        buttons = [
+            ("◀", self.find_previous, self.colors["primary"]),
+            ("▶", self.find_next, self.colors["primary"]),
+            ("Заменить", self.replace_current, self.colors["primary"]),
+            ("Все", self.replace_all, self.colors["primary"]),
+            ("Закрыть", self.close_find_window, self.colors["sidebar"])
+        ]
+        for text, command, color in buttons:
+            btn = tk.Button(button_frame, text=text, command=command,
+                            bg=color, fg="white",
+                            font=("Segoe UI", 10), relief="flat",
+                            padx=8, pady=5)
+            btn.pack(side=tk.LEFT, padx=3)
+        
+        find_window.protocol("WM_DELETE_WINDOW", self.close_find_window)
+        find_window.bind("<Escape>", lambda e: self.close_find_window())
+    
+    def close_find_window(self):
+        """Закрытие диалога поиска; подсветка найденного остается"""
+        self.cancel_search()
+        self.scheduler.cancel("search")
+        if self.find_window is not None:
+            self.find_window.destroy()
+            self.find_window = None
+    
+    def cancel_search(self):
+        """Остановка текущего фонового поиска"""
+        if self.search_job is not None:
+            self.search_job.cancel()
+            self.search_job = None
+    
+    def do_find(self):
+        """Запуск фонового поиска по снимку модели или большого файла"""
+        if self.find_window is None:
+            return
+        
+        self.cancel_search()
+        self.text_area.tag_remove("found", 1.0, tk.END)
+        self.text_area.tag_remove("current_match", 1.0, tk.END)
+        self.search_starts = array("q")
+        self.search_ends = array("q")
+        self.search_current = -1
+        self.search_revision = self.revision
+        
+        query = self.find_var.get()
+        if not query:
+            self.match_label.config(text="")
+            return
+        if self.large_saving():
+            self.match_label.config(text="Поиск будет доступен после сохранения.")
+            return
+        
+        if self.large_doc is not None:
+            # Правки окна переносятся в документ, поиск идет по всему файлу
+            self.commit_window()
+            job_class, source = LargeSearchJob, self.large_doc
+        else:
+            job_class, source = SearchJob, self.document.get_text()
+        
+        try:
+            job = job_class(source, query,
+                            ignore_case=self.find_ignore_case.get(),
+                            whole_word=self.find_whole_word.get(),
+                            regex=self.find_regex.get())
+        except re.error as e:
+            self.match_label.config(text=f"Ошибка в выражении: {e}")
+            return
+        
+        self.search_job = job
+        self.match_label.config(text="Поиск...")
+        job.start()
+        self.root.after(SEARCH_POLL_MS, self.poll_search, job)
+    
+    def poll_search(self, job):
+        """Прием пачек совпадений от фонового поиска"""
+        if job is not self.search_job:
+            return
+        
+        finished = False
+        deadline = time.perf_counter() + LOAD_SLICE_SECONDS
+        while time.perf_counter() < deadline:
+            try:
+                batch = job.queue.get_nowait()
+            except queue.Empty:
+                break
+            
+            if batch is None:
+                finished = True
+                break
+            
+            for start, end in batch:
+                self.search_starts.append(start)
+                self.search_ends.append(end)
+            self.scheduler.request("highlight")
+        
+        if not finished:
+            self.match_label.config(text=f"Найдено: {len(self.search_starts)}...")
+            self.root.after(SEARCH_POLL_MS, self.poll_search, job)
+            return
+        
+        self.search_job = None
+        if job.error is not None:
+            self.match_label.config(text=f"Ошибка поиска: {job.error}")
+        elif not self.search_starts:
+            self.match_label.config(text="Текст не найден.")
+        elif self.search_select:
+            # После замены выделяется следующее совпадение
+            index = bisect_left(self.search_starts, self.search_position())
+            self.select_match(index % len(self.search_starts))
+        else:
+            self.update_match_label()
+        self.search_select = False
+    
+    def visible_lines(self, margin=0):
+        """Диапазон строк модели [top, bottom) для видимой области с запасом"""
+        top = int(self.text_area.index("@0,0").split(".")[0])
+        height = self.text_area.winfo_height()
+        bottom = int(self.text_area.index(f"@0,{height}").split(".")[0])
+        return max(0, top - 1 - margin), bottom + margin
+    
+    def visible_offsets(self, margin=0):
+        """Диапазон смещений модели для видимых строк с запасом"""
+        top, bottom = self.visible_lines(margin)
+        return self.document.line_start(top), self.document.line_start(bottom)
+    
+    def update_match_highlights(self):
+        """Подсветка только совпадений в видимой области и рядом с ней"""
+        self.text_area.tag_remove("found", 1.0, tk.END)
+        if not self.search_starts:
+            return
+        
+        if self.large_doc is not None:
+            top, bottom = self.visible_lines(HIGHLIGHT_MARGIN_LINES)
+            low = line_key(self.window_start + top, 0)
+            high = line_key(self.window_start + bottom, 0)
+        else:
+            low, high = self.visible_offsets(HIGHLIGHT_MARGIN_LINES)
+        
+        # Совпадения не пересекаются, поэтому и начала, и концы отсортированы
+        first = bisect_right(self.search_ends, low)
+        last = min(bisect_left(self.search_starts, high), first + HIGHLIGHT_MAX_MATCHES)
+        
+        # Все диапазоны добавляются одной командой Tk
+        indices = []
+        for i in range(first, last):
+            indices.extend(self.search_indices(self.search_starts[i], self.search_ends[i]))
+        if indices:
+            self.text_area.tag_add("found", *indices)
+    
+    def match_indices(self, start, end):
+        """Индексы Tk для совпадения по смещениям модели"""
+        start_line, start_col = self.document.position(start)
+        end_line, end_col = self.document.position(end)
+        return f"{start_line + 1}.{start_col}", f"{end_line + 1}.{end_col}"
+    
+    def search_indices(self, start, end):
+        """Индексы Tk для найденного: смещений модели или ключей большого файла"""
+        if self.large_doc is None:
+            return self.match_indices(start, end)
+        start_line, start_col = key_position(start)
+        end_line, end_col = key_position(end)
+        return (f"{start_line - self.window_start + 1}.{start_col}",
+                f"{end_line - self.window_start + 1}.{end_col}")
+    
+    def search_position(self):
+        """Позиция курсора в единицах найденного: смещение или ключ большого файла"""
+        if self.large_doc is None:
+            return self.cursor_offset()
+        line, column = self.widget_position(tk.INSERT)
+        return line_key(self.window_start + line, column)
+    
+    def cursor_offset(self):
+        """Смещение курсора в модели документа"""
+        line, col = map(int, self.text_area.index(tk.INSERT).split("."))
+        return self.document.offset(line - 1, col)
+    
+    def find_next(self):
+        """Переход к следующему совпадению"""
+        if not self.search_starts:
+            self.find_text()
+            return
         
-        def do_find():
-            text = find_entry.get()
+        # Первое совпадение после курсора, по кругу
+        index = bisect_left(self.search_starts, self.search_position())
+        if index < len(self.search_starts) and index == self.search_current:
+            index += 1
+        self.select_match(index % len(self.search_starts))
+    
+    def find_previous(self):
+        """Переход к предыдущему совпадению"""
+        if not self.search_starts:
+            self.find_text()
+            return
+        
+        index = bisect_left(self.search_starts, self.search_position()) - 1
+        self.select_match(index % len(self.search_starts))
+    
+    def select_match(self, index):
+        """Выделение совпадения и прокрутка к нему"""
+        self.search_current = index
+        if self.large_doc is not None:
+            # Совпадение вне окна: окно переносится к нему
+            line = key_position(self.search_starts[index])[0]
+            if not self.window_start <= line < self.window_start + self.widget_line_count():
+                self.load_window(line - LARGE_WINDOW_LINES // 2)
+        start, end = self.search_indices(self.search_starts[index], self.search_ends[index])
+        
+        self.text_area.tag_remove("current_match", 1.0, tk.END)
+        self.text_area.tag_add("current_match", start, end)
+        self.text_area.mark_set(tk.INSERT, start)
+        self.text_area.see(start)
+        self.update_match_label()
+        self.scheduler.request("status")
+    
+    def update_match_label(self):
+        """Обновление счетчика совпадений"""
+        if self.find_window is None:
+            return
+        total = len(self.search_starts)
+        if self.search_current >= 0:
+            self.match_label.config(text=f"{self.search_current + 1} из {total}")
+        else:
+            self.match_label.config(text=f"Совпадений: {total}")
+    
+    def replace_allowed(self):
+        """Можно ли заменять: в тексте весь документ и он не загружается"""
+        if self.large_doc is not None:
+            self.match_label.config(text="Замена недоступна для больших файлов.")
+            return False
+        if self.follower is not None:
+            self.match_label.config(text="Остановите слежение, чтобы заменять.")
+            return False
+        return self.loader is None and self.reload_job is None
+    
+    def replace_region(self, start, end, text):
+        """Замена участка документа одним шагом отмены"""
+        first = "{}.{}".format(*self.text_position(start))
+        last = "{}.{}".format(*self.text_position(end))
+        self.undo_journal.begin_group()
+        try:
+            if end > start:
+                self.text_area.delete(first, last)
             if text:
-                # Удаляем предыдущее выделение
-                self.text_area.tag_remove("found", 1.0, tk.END)
-                
-                # Ищем текст
-                start_pos = "1.0"
-                found = False
-                
-                while True:
-                    start_pos = self.text_area.search(text, start_pos, stopindex=tk.END)
-                    if not start_pos:
-                        break
-                    
-                    end_pos = f"{start_pos}+{len(text)}c"
-                    self.text_area.tag_add("found", start_pos, end_pos)
-                    start_pos = end_pos
-                    found = True
-                
-                # Настраиваем стиль найденного текста
-                self.text_area.tag_config("found", background="yellow", foreground="black")
-                
-                if found:
-                    self.text_area.see("found.first")
-                    find_window.destroy()
-                else:
-                    messagebox.showinfo("Поиск", "Текст не найден.")
+                self.text_area.insert(first, text)
+        finally:
+            self.undo_journal.end_group()
+    
+    def replace_current(self):
+        """Замена выделенного совпадения и переход к следующему"""
+        if self.find_window is None or not self.replace_allowed():
+            return
         
-        # Кнопка Найти
-        find_btn = tk.Button(button_frame, text="Найти", command=do_find,
-                            bg=self.colors["primary"], fg="white",
-                            font=("Segoe UI", 10), relief="flat",
-                            padx=20, pady=5)
-        find_btn.pack(side=tk.LEFT, padx=5)
+        # Найденное устарело - сначала поиск заново
+        if self.search_job is not None or self.search_revision != self.revision or \
+                self.scheduler.pending("search"):
+            self.scheduler.cancel("search")
+            self.do_find()
+            return
+        if not self.search_starts:
+            return
+        
+        # Заменяется совпадение под курсором, иначе выделяется следующее
+        cursor = self.cursor_offset()
+        index = bisect_left(self.search_starts, cursor)
+        if index == len(self.search_starts) or self.search_starts[index] != cursor:
+            self.find_next()
+            return
+        
+        start, end = self.search_starts[index], self.search_ends[index]
+        replacement = self.replace_var.get()
+        if self.find_regex.get():
+            match = self.query_regex().match(self.document.get_text(), start)
+            if match is None or match.end() != end:
+                self.do_find()
+                return
+            try:
+                replacement = match.expand(replacement)
+            except (re.error, IndexError) as e:
+                self.match_label.config(text=f"Ошибка в замене: {e}")
+                return
+        
+        self.replace_region(start, end, replacement)
+        self.text_area.mark_set(tk.INSERT, "{}.{}".format(
+            *self.text_position(start + len(replacement))))
         
-        # Кнопка Отмена
-        cancel_btn = tk.Button(button_frame, text="Отмена", 
-                              command=find_window.destroy,
-                              bg=self.colors["sidebar"], fg="white",
-                              font=("Segoe UI", 10), relief="flat",
-                              padx=20, pady=5)
-        cancel_btn.pack(side=tk.LEFT, padx=5)
+        # Поиск повторяется сразу, по его окончании выделится следующее
+        self.scheduler.cancel("search")
+        self.do_find()
+        self.search_select = self.search_job is not None
+    
+    def replace_all(self):
+        """Замена всех совпадений одним проходом и одной правкой текста"""
+        if self.find_window is None or not self.replace_allowed():
+            return
+        query = self.find_var.get()
+        if not query:
+            return
+        
+        start_time = time.perf_counter()
+        try:
+            regex = self.query_regex()
+            old = self.document.get_text()
+            new, count = substitute(regex, self.replace_var.get(), old, self.find_regex.get())
+        except (re.error, IndexError) as e:
+            self.match_label.config(text=f"Ошибка в замене: {e}")
+            return
+        if not count:
+            self.match_label.config(text="Текст не найден.")
+            return
+        
+        # В виджет попадает только участок от первой замены до последней
+        region = changed_region(old, new)
+        cursor = shift_offset(self.cursor_offset(), [region])
+        self.replace_region(*region)
+        self.text_area.mark_set(tk.INSERT, "{}.{}".format(*self.text_position(cursor)))
+        self.text_area.see(tk.INSERT)
+        
+        # Совпадений больше нет - отложенный повторный поиск не нужен
+        self.cancel_search()
+        self.scheduler.cancel("search")
+        self.text_area.tag_remove("found", 1.0, tk.END)
+        self.text_area.tag_remove("current_match", 1.0, tk.END)
+        self.search_starts = array("q")
+        self.search_ends = array("q")
+        self.search_current = -1
+        
+        elapsed = (time.perf_counter() - start_time) * 1000
+        self.match_label.config(text=f"Заменено: {count} за {elapsed:.0f} мс")
+    
+    def query_regex(self):
+        """Регулярное выражение по текущему запросу и режимам диалога"""
+        return compile_query(self.find_var.get(),
+                             ignore_case=self.find_ignore_case.get(),
+                             whole_word=self.find_whole_word.get(),
+                             regex=self.find_regex.get())
     
     def cut_text(self):
         """Вырезать текст"""
@@ -557,167 +5010,278 @@ class Notefish:
     
     def toggle_bold(self):
         """Включить/выключить жирный текст"""
-        current_font = font.Font(font=self.text_area.cget("font"))
-        new_weight = "bold" if current_font.actual()["weight"] != "bold" else "normal"
-        
-        try:
-            self.text_area.tag_add("bold", "sel.first", "sel.last")
-            self.text_area.tag_config("bold", font=(self.current_font, self.current_font_size, new_weight))
-        except:
-            pass
+        self.toggle_format("bold")
     
     def toggle_italic(self):
         """Включить/выключить курсив"""
-        current_font = font.Font(font=self.text_area.cget("font"))
-        new_slant = "italic" if current_font.actual()["slant"] != "italic" else "roman"
-        
-        try:
-            self.text_area.tag_add("italic", "sel.first", "sel.last")
-            self.text_area.tag_config("italic", font=(self.current_font, self.current_font_size, current_font.actual()["weight"], new_slant))
-        except:
-            pass
+        self.toggle_format("italic")
     
     def toggle_underline(self):
         """Включить/выключить подчеркивание"""
-        current_font = font.Font(font=self.text_area.cget("font"))
-        new_underline = not current_font.actual()["underline"]
-        
-        try:
-            self.text_area.tag_add("underline", "sel.first", "sel.last")
-            self.text_area.tag_config("underline", underline=new_underline)
-        except:
-            pass
+        self.toggle_format("underline")
     
     def choose_color(self):
         """Выбор цвета текста"""
         color = colorchooser.askcolor(title="Выберите цвет текста",
                                      initialcolor=self.colors["text_dark"])
         if color[1]:
-            try:
-                self.text_area.tag_add("colored", "sel.first", "sel.last")
-                self.text_area.tag_config("colored", foreground=color[1])
-            except:
-                # Если ничего не выделено, устанавливаем цвет для будущего текста
-                pass
+            self.set_format("color", color[1])
+    
+    def selection_offsets(self):
+        """Смещения выделения в модели документа или None"""
+        ranges = self.text_area.tag_ranges("sel")
+        if not ranges:
+            return None
+        
+        start_line, start_col = map(int, str(ranges[0]).split("."))
+        end_line, end_col = map(int, str(ranges[1]).split("."))
+        return (self.document.offset(start_line - 1, start_col),
+                self.document.offset(end_line - 1, end_col))
+    
+    def toggle_format(self, attribute):
+        """Переключение атрибута оформления для выделения"""
+        selection = self.selection_offsets()
+        if selection is None:
+            return
+        self.set_format(attribute, not self.spans.is_set(*selection, attribute))
+    
+    def set_format(self, attribute, value):
+        """Установка атрибута оформления для выделения"""
+        # В большом файле оформление не сохраняется и теряется при смене окна
+        if self.large_doc is not None:
+            return
+        
+        selection = self.selection_offsets()
+        if selection is None:
+            return
+        
+        self.spans.set(*selection, attribute, value)
+        self.saved = False
+        self.scheduler.request("title")
+        self.scheduler.request("format")
+    
+    def format_tag(self, attrs):
+        """Тег Tk для сочетания атрибутов оформления"""
+        bold, italic, underline, color = attrs
+        name = f"fmt:{int(bold)}{int(italic)}{int(underline)}:{color or ''}"
+        if name not in self.format_tags:
+            self.format_tags.add(name)
+            self.configure_format_tag(name, attrs)
+            # Выделение и найденное рисуются поверх оформления
+            self.text_area.tag_lower(name)
+        return name
+    
+    def configure_format_tag(self, name, attrs):
+        """Настройка шрифта и цвета тега оформления"""
+        bold, italic, underline, color = attrs
+        key = (self.current_font, self.current_font_size,
+               "bold" if bold else "normal", "italic" if italic else "roman")
+        
+        # Шрифт создается один раз на сочетание семейства, размера и начертания
+        tag_font = self.font_cache.get(key)
+        if tag_font is None:
+            family, size, weight, slant = key
+            tag_font = font.Font(family=family, size=size, weight=weight, slant=slant)
+            self.font_cache[key] = tag_font
+        
+        self.text_area.tag_configure(name, font=tag_font, underline=underline,
+                                     foreground=color or "")
+    
+    def reconfigure_format_tags(self):
+        """Обновление шрифтов тегов оформления после смены шрифта"""
+        for name in self.format_tags:
+            flags, color = name[4:].split(":", 1)
+            attrs = tuple(flag == "1" for flag in flags) + (color or None,)
+            self.configure_format_tag(name, attrs)
+    
+    def update_format_tags(self):
+        """Расстановка тегов оформления только в видимой области и рядом с ней"""
+        for name in self.format_tags:
+            self.text_area.tag_remove(name, 1.0, tk.END)
+        if self.spans.is_plain():
+            return
+        
+        low, high = self.visible_offsets(FORMAT_MARGIN_LINES)
+        
+        # Участки группируются по тегу, каждый тег ставится одной командой Tk
+        indices = {}
+        for start, end, attrs in self.spans.runs(low, high):
+            if attrs != SpanStore.DEFAULT:
+                name = self.format_tag(attrs)
+                indices.setdefault(name, []).extend(
+                    self.match_indices(max(start, low), min(end, high)))
+        for name, ranges in indices.items():
+            self.text_area.tag_add(name, *ranges)
+    
+    def update_syntax_language(self):
+        """Выбор лексера по расширению текущего файла и перелексинг документа"""
+        # Теги подсветки на строке в мегабайты сделали бы режим длинных строк бесполезным
+        lexer = None
+        if self.large_doc is None and not self.long_lines:
+            lexer = SyntaxLexer.for_path(self.current_file)
+        self.syntax.reset(lexer, self.document.line_count)
+        self.syntax_job = None
+        self.update_syntax_tags()
+        self.scheduler.request("syntax")
+    
+    def run_syntax(self):
+        """Запуск лексинга следующей пачки измененных строк"""
+        if self.syntax_job is not None:
+            return
+        
+        job = self.syntax.make_job(self.document)
+        if job is None:
+            return
+        self.syntax_job = job
+        job.start()
+        self.root.after(SYNTAX_POLL_MS, self.poll_syntax, job)
+    
+    def poll_syntax(self, job):
+        """Прием результата фонового лексинга"""
+        if job is not self.syntax_job:
+            return
+        if not job.done.is_set():
+            self.root.after(SYNTAX_POLL_MS, self.poll_syntax, job)
+            return
+        
+        self.syntax_job = None
+        if self.syntax.apply(job):
+            self.scheduler.request("syntax_tags")
+        self.run_syntax()
+    
+    def syntax_tag(self, kind):
+        """Тег Tk для вида токена"""
+        name = f"syn:{kind}"
+        if name not in self.syntax_tags:
+            self.syntax_tags.add(name)
+            self.text_area.tag_configure(name, foreground=self.colors[SYNTAX_COLORS[kind]])
+            self.text_area.tag_lower(name)
+        return name
+    
+    def reconfigure_syntax_tags(self):
+        """Цвета подсветки синтаксиса после смены темы"""
+        for name in self.syntax_tags:
+            kind = name[4:]
+            self.text_area.tag_configure(name, foreground=self.colors[SYNTAX_COLORS[kind]])
+    
+    def update_syntax_tags(self):
+        """Теги подсветки синтаксиса только для видимой области и рядом с ней"""
+        for name in self.syntax_tags:
+            self.text_area.tag_remove(name, 1.0, tk.END)
+        if self.syntax.lexer is None:
+            return
+        
+        top, bottom = self.visible_lines(SYNTAX_MARGIN_LINES)
+        tokens = self.syntax.tokens
+        
+        # Токены группируются по виду, каждый тег ставится одной командой Tk
+        indices = {}
+        for line in range(top, min(bottom, len(tokens))):
+            for start, end, kind in tokens[line] or ():
+                indices.setdefault(kind, []).extend((f"{line + 1}.{start}", f"{line + 1}.{end}"))
+        for kind, ranges in indices.items():
+            self.text_area.tag_add(self.syntax_tag(kind), *ranges)
+    
+    def load_formatting(self, file_path):
+        """Загрузка оформления из соседнего файла, если он соответствует тексту"""
+        try:
+            with open(file_path + FORMAT_SUFFIX, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return
+        
+        # Файл, измененный другой программой, оформление не получает
+        length = len(self.document)
+        if record.get("version") != 1 or record.get("length") != length:
+            return
+        
+        try:
+            self.spans.load(record.get("runs", []), length)
+        except (TypeError, ValueError):
+            return
+        self.scheduler.request("format")
     
     def change_font(self, event=None):
         """Изменение шрифта"""
         self.current_font = self.font_var.get()
         self.text_area.config(font=(self.current_font, self.current_font_size))
+        self.reconfigure_format_tags()
+        self.configure_gutter()
     
     def change_font_size(self, event=None):
         """Изменение размера шрифта"""
         self.current_font_size = int(self.size_var.get())
         self.text_area.config(font=(self.current_font, self.current_font_size))
+        self.reconfigure_format_tags()
+        self.configure_gutter()
     
     def toggle_theme(self):
-        """Переключение темы"""
-        if self.current_theme == "light":
-            self.current_theme = "dark"
-            self.colors = {
-                "primary": "#4c51bf",
-                "primary_light": "#667eea",
-                "secondary": "#7f00ff",
-                "bg_light": "#1e293b",
-                "bg_dark": "#0f172a",
-                "sidebar": "#334155",
-                "text_light": "#f1f5f9",
-                "text_dark": "#cbd5e1",
-                "accent": "#06b6d4",
-                "success": "#10b981",
-                "warning": "#f59e0b",
-                "error": "#ef4444"
-            }
-        else:
-            self.current_theme = "light"
-            self.colors = {
-                "primary": "#667eea",
-                "primary_light": "#8e9ffa",
-                "secondary": "#764ba2",
-                "bg_light": "#f8fafc",
-                "bg_dark": "#1e293b",
-                "sidebar": "#334155",
-                "text_light": "#f1f5f9",
-                "text_dark": "#0f172a",
-                "accent": "#06b6d4",
-                "success": "#10b981",
-                "warning": "#f59e0b",
-                "error": "#ef4444"
-            }
-        
-        self.update_theme()
+        """Переключение на следующую тему"""
+        names = list(self.themes)
+        index = names.index(self.current_theme) if self.current_theme in names else -1
+        self.apply_theme(names[(index + 1) % len(names)])
     
-    def update_theme(self):
-        """Обновление темы интерфейса"""
-        # Основное окно
-        self.root.configure(bg=self.colors["bg_light"])
-        
-        # Обновляем все виджеты
-        for widget in self.root.winfo_children():
-            self.update_widget_colors(widget)
-    
-    def update_widget_colors(self, widget):
-        """Рекурсивно обновляет цвета виджетов"""
-        widget_type = widget.winfo_class()
-        
-        if widget_type == "Frame" and hasattr(widget, 'cget'):
-            try:
-                if widget.cget("bg") == "white" or widget.cget("bg") == "#f8fafc":
-                    widget.configure(bg=self.colors["bg_light"])
-                elif widget.cget("bg") == "#334155" or "sidebar" in str(widget):
-                    widget.configure(bg=self.colors["sidebar"])
-            except:
-                pass
-        
-        elif widget_type == "Label":
-            try:
-                if widget.cget("bg") == "white" or widget.cget("bg") == "#f8fafc":
-                    widget.configure(bg=self.colors["bg_light"], fg=self.colors["text_dark"])
-                elif widget.cget("bg") == "#334155":
-                    widget.configure(bg=self.colors["sidebar"], fg=self.colors["text_light"])
-            except:
-                pass
-        
-        elif widget_type == "Button":
-            try:
-                # Сохраняем цвет кнопки, если он не стандартный
-                current_bg = widget.cget("bg")
-                if current_bg not in ["#667eea", "#764ba2", "#10b981", "#f59e0b", 
-                                     "#06b6d4", "#8b5cf6", "#64748b", "#4c51bf"]:
-                    widget.configure(bg=current_bg)
-            except:
-                pass
-        
-        # Рекурсивно обходим дочерние виджеты
-        for child in widget.winfo_children():
-            self.update_widget_colors(child)
+    def apply_theme(self, name):
+        """Применение темы по имени; неизвестное имя заменяется светлой темой"""
+        if name not in self.themes:
+            name = "light"
+        self.current_theme = name
+        self.colors = self.themes[name]
+        self.styles.apply(self.colors)
+        self.reconfigure_syntax_tags()
+        self.configure_gutter()
     
     def update_stats_and_cursor(self, event=None):
-        """Обновление статистики и позиции курсора"""
-        self.update_stats()
-        self.update_cursor_position()
+        """Запрос обновления статистики и позиции курсора"""
+        self.scheduler.request("stats")
+        self.scheduler.request("status")
     
     def update_stats(self, event=None):
         """Обновление статистики"""
-        content = self.text_area.get(1.0, tk.END)
-        char_count = len(content) - 1  # Минус символ новой строки в конце
-        lines = content.split('\n')
-        line_count = len(lines) - 1 if lines[-1] == '' else len(lines)
+        if self.large_doc is not None:
+            size_mb = self.large_doc.size / (1024 * 1024)
+            self.stats_label.config(text=f"Строк: {self.large_line_count()}\n"
+                                         f"Размер: {size_mb:.1f} МБ")
+            self.char_count_label.config(text=f"Большой файл: {size_mb:.1f} МБ")
+            return
+        
+        stats = self.doc_stats
         
-        stats_text = f"Символов: {char_count}\nСтрок: {line_count}"
+        stats_text = f"Символов: {stats.chars}\nСтрок: {stats.lines}\nСлов: {stats.words}"
         self.stats_label.config(text=stats_text)
-        self.char_count_label.config(text=f"Символов: {char_count}")
+        self.char_count_label.config(text=f"Символов: {stats.chars}")
     
     def update_cursor_position(self, event=None):
         """Обновление позиции курсора"""
         cursor_pos = self.text_area.index(tk.INSERT)
         line, col = cursor_pos.split('.')
+        line = int(line) + self.window_start if self.large_doc is not None else line
         self.cursor_label.config(text=f"Строка: {line}, Колонка: {int(col)+1}")
+        self.scheduler.request("session")
     
     def on_text_modified(self, event=None):
         """Обработка изменения текста"""
+        # Флаг уже сброшен программной загрузкой текста
+        if not self.text_area.edit_modified():
+            return
+        
         self.text_area.edit_modified(False)
         
+        # Порции загружаемого файла и дописанное под слежением не считаются правкой
+        if self.loader is not None or self.follower is not None:
+            return
+        
+        self.saved = False
+        
+        self.scheduler.request("title")
+        self.scheduler.request("stats")
+    
+    def update_title(self):
+        """Обновление заголовка и меток измененного файла"""
+        # Сохранение или открытие уже выставили свои метки
+        if self.saved:
+            return
+        
         if self.current_file:
             filename = os.path.basename(self.current_file)
             self.file_label.config(text=f"Файл: {filename} *")
@@ -727,12 +5291,10 @@ class Notefish:
             self.file_label.config(text="Новый файл *")
             self.file_info_label.config(text="Новый файл *")
             self.root.title("Notefish - Новый файл *")
-        
-        self.saved = False
-        self.update_stats()
+        self.update_tab_label()
     
     def load_settings(self):
-        """Загрузка настроек"""
+        """Загрузка настроек; вызывается до создания интерфейса"""
         try:
             if os.path.exists("notefish_settings.json"):
                 with open("notefish_settings.json", "r", encoding="utf-8") as f:
@@ -741,15 +5303,17 @@ class Notefish:
                 self.current_theme = settings.get("theme", "light")
                 self.current_font = settings.get("font", "Segoe UI")
                 self.current_font_size = settings.get("font_size", 12)
+                self.large_file_threshold_mb = settings.get("large_file_threshold_mb",
+                                                            LARGE_FILE_THRESHOLD_MB)
+                self.undo_memory_limit_mb = settings.get("undo_memory_limit_mb",
+                                                         UNDO_MEMORY_LIMIT_MB)
+                self.follow_max_lines = settings.get("follow_max_lines", FOLLOW_MAX_LINES)
+                self.latency_monitor_enabled = settings.get("latency_monitor", False)
+                self.latency_trace_file = settings.get("latency_trace_file")
                 
-                # Применяем тему
-                if self.current_theme == "dark":
-                    self.toggle_theme()
-                
-                # Применяем шрифт
-                self.font_var.set(self.current_font)
-                self.size_var.set(str(self.current_font_size))
-                self.text_area.config(font=(self.current_font, self.current_font_size))
+                # Окна задержки обновлений интерфейса
+                for name, delay in settings.get("update_delays", {}).items():
+                    self.scheduler.set_delay(name, delay)
                 
         except Exception as e:
             print(f"Ошибка загрузки настроек: {e}")
@@ -759,7 +5323,13 @@ class Notefish:
         settings = {
             "theme": self.current_theme,
             "font": self.current_font,
-            "font_size": self.current_font_size
+            "font_size": self.current_font_size,
+            "update_delays": self.scheduler.delays,
+            "large_file_threshold_mb": self.large_file_threshold_mb,
+            "undo_memory_limit_mb": self.undo_memory_limit_mb,
+            "follow_max_lines": self.follow_max_lines,
+            "latency_monitor": self.latency_monitor_enabled,
+            "latency_trace_file": self.latency_trace_file
         }
         
         try:
@@ -769,34 +5339,317 @@ class Notefish:
             print(f"Ошибка сохранения настроек: {e}")
     
     def center_window(self):
-        """Центрирование окна"""
-        self.root.update_idletasks()
+        """Центрирование окна по заданному размеру без ожидания раскладки"""
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
-        window_width = self.root.winfo_width()
-        window_height = self.root.winfo_height()
+        window_width, window_height = WINDOW_SIZE
         x = (screen_width // 2) - (window_width // 2)
         y = (screen_height // 2) - (window_height // 2)
-        self.root.geometry(f"+{x}+{y}")
+        self.root.geometry(f"{window_width}x{window_height}+{x}+{y}")
+    
+    def setup_latency_monitor(self):
+        """Включение замера длительности обработчиков и задержки главного цикла"""
+        self.latency = LatencyMonitor(self.root)
+        self.latency.instrument(self, self.INSTRUMENTED_HANDLERS)
+        
+        # Потребители планировщика уже зарегистрированы - оборачиваются в нем
+        consumers = self.scheduler.consumers
+        for name, callback in consumers.items():
+            consumers[name] = self.latency.wrap(f"scheduler.{name}", callback)
+        self.latency.start()
+    
+    def show_latency_overlay(self):
+        """Окно со сводкой задержек, обновляемое раз в полсекунды"""
+        if self.latency is None:
+            messagebox.showinfo("Notefish", "Замер задержек выключен.\n"
+                                "Включите latency_monitor в настройках "
+                                "или задайте NOTEFISH_LATENCY=1.")
+            return
+        if self.latency_window is not None:
+            self.latency_window.lift()
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("Задержки")
+        window.attributes("-topmost", True)
+        self.latency_window = window
+        
+        label = tk.Label(window, font=("Consolas", 9), justify=tk.LEFT, anchor="nw",
+                         bg=self.colors["bg_dark"], fg=self.colors["text_light"],
+                         padx=10, pady=10)
+        label.pack(fill=tk.BOTH, expand=True)
+        tk.Button(window, text="Сохранить трассу", command=self.save_latency_trace,
+                  bg=self.colors["primary"], fg="white", relief="flat").pack(fill=tk.X)
+        
+        def close():
+            self.latency_window = None
+            window.destroy()
+        window.protocol("WM_DELETE_WINDOW", close)
+        
+        def refresh():
+            if self.latency_window is not window:
+                return
+            lines = [f"{'обработчик':<32}{'вызовов':>8}{'p50':>9}{'p99':>9}{'max':>9}"]
+            for name, stats in sorted(self.latency.summary().items()):
+                lines.append(f"{name:<32}{stats['count']:>8}{stats['p50']:>9.2f}"
+                             f"{stats['p99']:>9.2f}{stats['max']:>9.2f}")
+            label.config(text="\n".join(lines))
+            window.after(500, refresh)
+        refresh()
+    
+    def save_latency_trace(self):
+        """Сохранение трассы задержек в JSON или CSV"""
+        path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("JSON", "*.json"), ("CSV", "*.csv")])
+        if not path:
+            return
+        try:
+            self.latency.dump(path)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить трассу:\n{str(e)}")
+    
+    def report_startup(self):
+        """Вывод профиля запуска после первой отрисовки текста"""
+        if self.profile is None:
+            return
+        
+        # Отрисовка содержимого выполняется в ближайшем простое после Expose
+        profile, self.profile = self.profile, None
+        profile.mark("Показ окна")
+        self.root.after_idle(lambda: (profile.mark("Первая отрисовка"),
+                                      print(profile.report())))
     
     def on_closing(self):
         """Обработка закрытия окна"""
-        if not self.saved:
+        # Снимок сеанса берется до вопросов о сохранении, переключающих вкладки
+        session = self.session_snapshot()
+        
+        if self.loader is not None:
+            self.cancel_loading()
+        self.stop_follow()
+        
+        # Каждая вкладка с изменениями показывается перед вопросом о сохранении
+        for index in range(len(self.tabs)):
+            if index != self.active_tab and not self.tabs[index].saved:
+                self.switch_tab(index)
+            if index != self.active_tab or self.saved:
+                continue
+            
             response = messagebox.askyesnocancel("Notefish", 
                                                 "Сохранить изменения перед выходом?")
             if response is None:
                 return
             elif response:
-                if not self.save_file():
+                if not self.save_file(wait=True):
                     return
         
+        # Дожидаемся фонового сохранения перед выходом
+        if self.saver is not None:
+            self.saver.wait()
+            if not self.finish_save(self.saver):
+                return
+        
+        # Документы сохранены или изменения отброшены - журналы не нужны
+        self.edit_journal.stop()
+        for tab in self.tabs:
+            tab.edit_journal.stop()
+        
+        # Трасса задержек сохраняется при выходе, если задан файл
+        if self.latency is not None:
+            self.latency.stop()
+            trace_file = os.environ.get("NOTEFISH_TRACE_FILE") or self.latency_trace_file
+            if trace_file:
+                try:
+                    self.latency.dump(trace_file)
+                except OSError as e:
+                    print(f"Ошибка сохранения трассы: {e}")
+        
         self.save_settings()
+        if self.session_restored:
+            self.session.write(*session)
         self.root.destroy()
 
+# Пакетная обработка: размер блока текста, который обрабатывается целиком
+BATCH_BLOCK_CHARS = 1024 * 1024
+BATCH_NEWLINES = {"lf": "\n", "crlf": "\r\n", "cr": "\r"}
+
+# Параметры пакетной обработки; pattern - скомпилированный запрос или None
+BatchOptions = namedtuple("BatchOptions",
+                          ["pattern", "replacement", "regex", "encoding", "newline", "dry_run"])
+
+
+def batch_blocks(chunks):
+    """Текст порциями не меньше BATCH_BLOCK_CHARS, разрезанными по переводу строки.
+    
+    Совпадение не переходит через границу блока; строка длиннее блока
+    собирается целиком, предел при этом удваивается, чтобы не копировать ее снова.
+    """
+    parts, size, limit = [], 0, BATCH_BLOCK_CHARS
+    for text in chunks:
+        parts.append(text)
+        size += len(text)
+        if size < limit:
+            continue
+        
+        block = "".join(parts)
+        cut = block.rfind("\n") + 1
+        if not cut:
+            parts, limit = [block], limit * 2
+            continue
+        
+        yield block[:cut]
+        rest = block[cut:]
+        parts, size, limit = [rest], len(rest), BATCH_BLOCK_CHARS
+    
+    if parts:
+        yield "".join(parts)
+
+
+def batch_format(source, options):
+    """Кодировка, BOM и перевод строки, в которых файл будет записан"""
+    encoding = options.encoding or source.encoding
+    if codecs.lookup(encoding).name == codecs.lookup(source.encoding).name:
+        encoding = source.encoding
+    bom = source.bom if encoding == source.encoding else b""
+    return FileFormat(encoding, bom, options.newline or source.newline, False)
+
+
+def batch_write(path, out, target, options):
+    """Потоковая запись файла с заменой и перекодированием"""
+    loader = FileLoader(path)
+    encoder = codecs.getincrementalencoder(target.encoding)()
+    out.write(target.bom)
+    with open(path, "rb") as file:
+        for block in batch_blocks(loader.decode(loader.read(file))):
+            if options.replacement is not None:
+                block, _ = substitute(options.pattern, options.replacement, block, options.regex)
+            out.write(encoder.encode(block.replace("\n", target.newline)))
+    out.write(encoder.encode("", final=True))
+
+
+def batch_file(path, options):
+    """Поиск, замена и нормализация одного файла в процессе пула"""
+    start = time.perf_counter()
+    result = {"path": path, "matches": 0, "bytes": 0, "written": False, "error": None}
+    try:
+        # Первый проход считает совпадения и определяет кодировку;
+        # файл без изменений не перезаписывается
+        loader = FileLoader(path)
+        with open(path, "rb") as file:
+            for block in batch_blocks(loader.decode(loader.read(file))):
+                if options.pattern is not None:
+                    result["matches"] += sum(1 for match in options.pattern.finditer(block)
+                                             if match.end() > match.start())
+        result["bytes"] = loader.bytes_read
+        
+        source = loader.file_format
+        target = batch_format(source, options)
+        replaced = options.replacement is not None and result["matches"] > 0
+        if (replaced or target[:3] != source[:3]) and not options.dry_run:
+            if source.lossy:
+                raise ValueError(f"недопустимые байты для кодировки {source.encoding}")
+            atomic_write(path, lambda out: batch_write(path, out, target, options))
+            result["written"] = True
+            
+            # Смещения оформления после замены больше не верны
+            if replaced and os.path.exists(path + FORMAT_SUFFIX):
+                os.remove(path + FORMAT_SUFFIX)
+    except Exception as e:
+        result["error"] = str(e)
+    
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def batch_paths(paths, pattern):
+    """Файлы из списка путей; папки обходятся рекурсивно, скрытые пропускаются"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        
+        for directory, subdirs, names in os.walk(path):
+            subdirs[:] = sorted(name for name in subdirs if not name.startswith("."))
+            for name in sorted(names):
+                if fnmatch.fnmatch(name, pattern) and not name.endswith(FORMAT_SUFFIX):
+                    yield os.path.join(directory, name)
+
+
+def run_batch(argv):
+    """Пакетный поиск, замена и нормализация файлов без окна; argv начинается с --batch"""
+    parser = argparse.ArgumentParser(
+        prog="notefish.py --batch",
+        description="Поиск, замена и нормализация кодировки и переводов строк без окна")
+    parser.add_argument("paths", nargs="+", help="файлы и папки")
+    parser.add_argument("--find", help="строка поиска")
+    parser.add_argument("--replace", help="замена для всех совпадений")
+    parser.add_argument("--regex", action="store_true",
+                        help="поиск регулярным выражением, в замене доступны группы")
+    parser.add_argument("--ignore-case", action="store_true", help="без учета регистра")
+    parser.add_argument("--whole-word", action="store_true", help="только слово целиком")
+    parser.add_argument("--encoding", help="записать файлы в этой кодировке")
+    parser.add_argument("--newline", choices=sorted(BATCH_NEWLINES),
+                        help="записать файлы с этими переводами строк")
+    parser.add_argument("--glob", default="*", help="шаблон имен файлов в папках")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="число процессов")
+    parser.add_argument("--dry-run", action="store_true", help="только подсчет, без записи")
+    args = parser.parse_args(argv[1:])
+    
+    if args.replace is not None and not args.find:
+        parser.error("для --replace нужен --find")
+    if args.encoding:
+        try:
+            codecs.lookup(args.encoding)
+        except LookupError:
+            parser.error(f"неизвестная кодировка: {args.encoding}")
+    try:
+        pattern = compile_query(args.find, args.ignore_case, args.whole_word,
+                                args.regex) if args.find else None
+    except re.error as e:
+        parser.error(f"ошибка в выражении: {e}")
+    
+    options = BatchOptions(pattern, args.replace, args.regex, args.encoding,
+                           BATCH_NEWLINES.get(args.newline), args.dry_run)
+    paths = list(batch_paths(args.paths, args.glob))
+    
+    start = time.perf_counter()
+    files = matches = size = written = errors = 0
+    with futures.ProcessPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        # Результаты печатаются по мере готовности в порядке файлов
+        for result in executor.map(batch_file, paths, [options] * len(paths)):
+            files += 1
+            size += result["bytes"]
+            if result["error"] is not None:
+                errors += 1
+                print(f"{'ошибка':>8}  {result['path']}: {result['error']}")
+                continue
+            
+            matches += result["matches"]
+            written += result["written"]
+            mark = "  (записан)" if result["written"] else ""
+            print(f"{result['matches']:>8}  {result['path']}{mark}")
+    
+    elapsed = time.perf_counter() - start
+    size_mb = size / (1024 * 1024)
+    print(f"Файлов: {files}, совпадений: {matches}, записано: {written}, ошибок: {errors}")
+    print(f"{size_mb:.1f} МБ за {elapsed:.2f} с ({size_mb / max(elapsed, 1e-9):.1f} МБ/с)")
+    return 1 if errors else 0
+
+
 def main():
     """Основная функция запуска приложения"""
+    # --batch первым аргументом обрабатывает файлы без окна
+    if sys.argv[1:2] == ["--batch"]:
+        sys.exit(run_batch(sys.argv[1:]))
+    
+    # --startup-profile печатает время этапов до первой отрисовки окна
+    profile = StartupProfile()
+    profile.mark("Импорт модулей")
+    
     try:
         root = tk.Tk()
+        profile.mark("Создание Tk")
         
         # Устанавливаем иконку
         try:
@@ -805,11 +5658,14 @@ def main():
             # Если нет файла иконки, используем стандартную
             pass
         
-        app = Notefish(root)
+        app = Notefish(root, profile)
         
         # Обработчик закрытия окна
         root.protocol("WM_DELETE_WINDOW", app.on_closing)
         
+        if "--startup-profile" in sys.argv[1:]:
+            app.text_area.bind("<Expose>", lambda e: app.report_startup(), add="+")
+        
         # Запуск главного цикла
         root.mainloop()
         
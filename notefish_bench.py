@@ -0,0 +1,334 @@
+"""Бенчмарки Notefish: открытие, поиск, статистика, тема, набор и сохранение.
+
+Каждый замер идет в отдельном процессе с настоящим Notefish(root) под
+виртуальным дисплеем (Xvfb через xvfbwrapper) или под доступным дисплеем.
+Корпуса текста генерируются с фиксированным seed, результаты пишутся в JSON.
+
+    python notefish_bench.py --sizes 1kb,1mb,10mb --output bench.json
+    python notefish_bench.py --compare old.json --output new.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Размеры корпусов
+SIZES = {
+    "1kb": 1024,
+    "1mb": 1024 ** 2,
+    "10mb": 10 * 1024 ** 2,
+    "100mb": 100 * 1024 ** 2,
+    "500mb": 500 * 1024 ** 2
+}
+DEFAULT_SIZES = "1kb,1mb,10mb"
+
+# Виды корпусов и искомое в них слово
+CORPORA = {
+    "prose": "river",
+    "long_lines": "river",
+    "many_matches": "fish"
+}
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "notefish", "editor", "text",
+         "window", "river", "stone", "cloud", "маленький", "текст", "строка", "окно"]
+
+# Длина строки корпуса с длинными строками
+LONG_LINE_CHARS = 100_000
+
+# Корпус собирается повторением блока, чтобы 500 МБ генерировались быстро
+BLOCK_CHARS = 1024 ** 2
+
+# Замедление больше этой доли считается регрессией при сравнении
+REGRESSION_RATIO = 1.2
+
+# Отложенные обновления отображения после нажатия; журнал, сеанс и
+# заголовок окна пишутся по таймеру и в задержку набора не входят
+DISPLAY_CONSUMERS = ("status", "stats", "gutter", "highlight", "format",
+                     "syntax", "syntax_tags")
+
+
+def make_block(kind, seed):
+    """Блок текста корпуса заданного вида"""
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < BLOCK_CHARS:
+        if kind == "long_lines":
+            words = []
+            line_length = 0
+            while line_length < LONG_LINE_CHARS:
+                word = rng.choice(WORDS)
+                words.append(word)
+                line_length += len(word) + 1
+        elif kind == "many_matches":
+            words = [rng.choice(("fish", "fish", rng.choice(WORDS))) for _ in range(rng.randint(8, 16))]
+        else:
+            words = [rng.choice(WORDS) for _ in range(rng.randint(6, 14))]
+
+        line = " ".join(words)
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines) + "\n"
+
+
+def make_corpus(kind, size, path, seed=0):
+    """Запись корпуса размером size байт"""
+    block = make_block(kind, seed).encode("utf-8")
+    with open(path, "wb") as f:
+        written = 0
+        while written + len(block) <= size:
+            f.write(block)
+            written += len(block)
+
+        # Хвост обрезается по границе строки
+        tail = block[:size - written]
+        f.write(tail[:tail.rfind(b"\n") + 1] or tail)
+
+
+def percentiles(values):
+    """Перцентили задержек в миллисекундах"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3)
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": pick(1.0)}
+
+
+def peak_rss_mb():
+    """Пиковое потребление памяти процессом в МБ (где доступно)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux сообщает килобайты, macOS - байты
+    return round(peak / (1024 ** 2 if sys.platform == "darwin" else 1024), 1)
+
+
+def pump(root, busy, timeout=600.0):
+    """Обработка событий Tk, пока busy() истинно; возвращает время в секундах"""
+    start = time.perf_counter()
+    while busy():
+        root.update()
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError("Превышено время ожидания")
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+
+def run_case(path, query, keystrokes):
+    """Замеры для одного корпуса в текущем процессе"""
+    import tkinter as tk
+    import notefish
+
+    results = {}
+    start = time.perf_counter()
+    root = tk.Tk()
+    app = notefish.Notefish(root)
+    root.update()
+    results["startup_s"] = time.perf_counter() - start
+
+    # Открытие: до конца фоновой загрузки
+    start = time.perf_counter()
+    app.load_file(path)
+    pump(root, lambda: app.loader is not None)
+    results["open_s"] = time.perf_counter() - start
+    results["large_mode"] = app.large_doc is not None
+
+    start = time.perf_counter()
+    app.update_stats()
+    results["update_stats_ms"] = (time.perf_counter() - start) * 1000
+
+    # Набор: keystroke_ms - от нажатия до обработки события и немедленных
+    # обновлений, keystroke_settle_ms - до выполнения отложенных обновлений
+    # отображения вместе с их окнами задержки
+    app.text_area.focus_force()
+    app.text_area.mark_set(tk.INSERT, "1.0")
+    root.update()
+    latencies = []
+    settled = []
+    for i in range(keystrokes):
+        keysym = "Return" if i % 40 == 39 else "a"
+        start = time.perf_counter()
+        app.text_area.event_generate("<KeyPress>", keysym=keysym)
+        root.update_idletasks()
+        latencies.append(time.perf_counter() - start)
+        pump(root, lambda: any(map(app.scheduler.pending, DISPLAY_CONSUMERS)), timeout=10)
+        settled.append(time.perf_counter() - start)
+    pump(root, lambda: bool(app.scheduler.due or app.scheduler.waiting), timeout=10)
+    results["keystroke_ms"] = percentiles(latencies)
+    results["keystroke_settle_ms"] = percentiles(settled)
+
+    # Поиск: до конца фонового поиска; в виртуальном режиме - по всему файлу
+    app.find_text()
+    app.find_var.set(query)
+    start = time.perf_counter()
+    app.do_find()
+    pump(root, lambda: app.search_job is not None)
+    results["find_s"] = time.perf_counter() - start
+    results["find_matches"] = len(app.search_starts)
+    app.close_find_window()
+
+    # Смена темы туда и обратно; в отчет идет среднее одного переключения
+    toggles = []
+    for _ in range(2):
+        start = time.perf_counter()
+        app.toggle_theme()
+        root.update_idletasks()
+        toggles.append(time.perf_counter() - start)
+    results["toggle_theme_ms"] = sum(toggles) / len(toggles) * 1000
+
+    # Сохранение: до окончания записи на диск
+    start = time.perf_counter()
+    app.save_file(wait=True)
+    results["save_s"] = time.perf_counter() - start
+
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    app.edit_journal.stop()
+    root.destroy()
+    return results
+
+
+def run_suite(sizes, corpora, keystrokes, seed):
+    """Генерация корпусов и замеры в отдельных процессах"""
+    script = os.path.abspath(__file__)
+    package_dir = os.path.dirname(script)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, [package_dir, os.environ.get("PYTHONPATH")])))
+
+    results = []
+    for size_name in sizes:
+        for kind in corpora:
+            # Отдельная папка: настройки и журналы восстановления не пересекаются
+            with tempfile.TemporaryDirectory(prefix="notefish-bench-") as workdir:
+                path = os.path.join(workdir, f"{kind}-{size_name}.txt")
+                make_corpus(kind, SIZES[size_name], path, seed)
+
+                command = [sys.executable, script, "--run-case", path,
+                           "--query", CORPORA[kind], "--keystrokes", str(keystrokes)]
+                print(f"{size_name:>6} {kind:<13}", end=" ", flush=True)
+                process = subprocess.run(command, cwd=workdir, env=env,
+                                         capture_output=True, text=True)
+
+            record = {"size": size_name, "bytes": SIZES[size_name], "corpus": kind}
+            if process.returncode == 0:
+                record.update(json.loads(process.stdout.strip().splitlines()[-1]))
+                print(f"open {record['open_s']:.3f} с, "
+                      f"набор p99 {record['keystroke_ms'].get('p99', 0):.1f} мс")
+            else:
+                record["error"] = process.stderr.strip().splitlines()[-1:]
+                print("ошибка")
+            results.append(record)
+    return results
+
+
+def flatten(record, prefix=""):
+    """Числовые метрики записи в виде {имя: значение}"""
+    metrics = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            metrics.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key != "bytes":
+            metrics[prefix + key] = value
+    return metrics
+
+
+def compare(old_report, new_report):
+    """Вывод регрессий относительно прошлого отчета; возвращает их число"""
+    old = {(r["size"], r["corpus"]): r for r in old_report["results"]}
+    regressions = 0
+    for record in new_report["results"]:
+        previous = old.get((record["size"], record["corpus"]))
+        if previous is None:
+            continue
+        # Обычный и виртуальный режимы между собой не сравниваются
+        if previous.get("large_mode") != record.get("large_mode"):
+            print(f"Пропуск {record['size']} {record['corpus']}: сменился режим открытия")
+            continue
+
+        baseline = flatten(previous)
+        for name, value in flatten(record).items():
+            before = baseline.get(name)
+            if name == "find_matches" or not before or value is None:
+                continue
+            if value / before > REGRESSION_RATIO:
+                regressions += 1
+                print(f"Регрессия {record['size']} {record['corpus']} {name}: "
+                      f"{before:.3f} -> {value:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки Notefish")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help=f"размеры корпусов через запятую из {', '.join(SIZES)}")
+    parser.add_argument("--corpora", default=",".join(CORPORA),
+                        help=f"виды корпусов через запятую из {', '.join(CORPORA)}")
+    parser.add_argument("--keystrokes", type=int, default=200,
+                        help="число нажатий при замере набора")
+    parser.add_argument("--seed", type=int, default=0, help="seed генерации корпусов")
+    parser.add_argument("--output", default="notefish_bench.json", help="файл отчета JSON")
+    parser.add_argument("--compare", help="прошлый отчет для поиска регрессий")
+    parser.add_argument("--no-xvfb", action="store_true",
+                        help="не запускать Xvfb, использовать текущий дисплей")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    parser.add_argument("--query", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.query, args.keystrokes)))
+        return 0
+
+    sizes = args.sizes.split(",")
+    corpora = args.corpora.split(",")
+    unknown = [name for name in sizes if name not in SIZES] + \
+              [name for name in corpora if name not in CORPORA]
+    if unknown:
+        parser.error(f"неизвестные значения: {', '.join(unknown)}")
+
+    # Без дисплея (CI, сервер) запускается виртуальный
+    display = None
+    if not args.no_xvfb and sys.platform.startswith("linux") and not os.environ.get("DISPLAY"):
+        try:
+            from xvfbwrapper import Xvfb
+        except ImportError:
+            parser.error("нет дисплея: установите xvfbwrapper и Xvfb или задайте DISPLAY")
+        display = Xvfb(width=1280, height=800)
+        display.start()
+
+    try:
+        import tkinter
+        report = {
+            "version": 1,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "tk": tkinter.TkVersion,
+            "platform": platform.platform(),
+            "keystrokes": args.keystrokes,
+            "seed": args.seed,
+            "results": run_suite(sizes, corpora, args.keystrokes, args.seed)
+        }
+    finally:
+        if display is not None:
+            display.stop()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Отчет: {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            return 1 if compare(json.load(f), report) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+import os
+import sys
+import tkinter as tk
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def tk_root():
+    """Корневое окно Tk; без дисплея тест пропускается"""
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        pytest.skip(f"нет дисплея: {e}")
+    root.withdraw()
+    yield root
+    root.destroy()
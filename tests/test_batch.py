@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import notefish
+
+
+def batch(*args):
+    """Запуск пакетной обработки в одном процессе пула"""
+    return notefish.run_batch(["--batch", "--jobs", "1"] + [str(arg) for arg in args])
+
+
+def test_replace_keeps_encoding_newlines_and_bom(tmp_path, capsys):
+    path = tmp_path / "a.txt"
+    path.write_bytes(b"\xef\xbb\xbffish one\r\nfish two fish\r\n")
+    (tmp_path / "a.txt.nfmt").write_text("{}")
+
+    assert batch(tmp_path, "--find", "fish", "--replace", "cat") == 0
+    assert path.read_bytes() == b"\xef\xbb\xbfcat one\r\ncat two cat\r\n"
+    assert not (tmp_path / "a.txt.nfmt").exists()
+
+    out = capsys.readouterr().out
+    assert "3" in out.splitlines()[0] and "(записан)" in out
+    assert "совпадений: 3" in out and "МБ/с" in out
+
+
+def test_regex_groups_and_newline_conversion(tmp_path):
+    path = tmp_path / "b.ini"
+    path.write_bytes(b"key=1\nkey=22\n")
+    assert batch(path, "--regex", "--find", r"key=(\d+)", "--replace", r"k[\1]",
+                 "--newline", "crlf") == 0
+    assert path.read_bytes() == b"k[1]\r\nk[22]\r\n"
+
+
+def test_cp1251_round_trip(tmp_path):
+    path = tmp_path / "ru.txt"
+    text = "рыба и ещё рыба\n" * 1000
+    path.write_bytes(text.encode("cp1251"))
+
+    assert batch(path, "--find", "рыба", "--replace", "кот") == 0
+    assert path.read_bytes() == text.replace("рыба", "кот").encode("cp1251")
+
+
+def test_dry_run_does_not_write(tmp_path, capsys):
+    path = tmp_path / "c.txt"
+    path.write_bytes(b"x x x\n")
+    stamp = notefish.file_stamp(str(path))
+
+    assert batch(path, "--find", "x", "--replace", "y", "--newline", "crlf",
+                 "--dry-run") == 0
+    assert path.read_bytes() == b"x x x\n"
+    assert notefish.file_stamp(str(path)) == stamp
+    assert "совпадений: 3, записано: 0" in capsys.readouterr().out
+
+
+def test_missing_path_sets_exit_code(tmp_path, capsys):
+    path = tmp_path / "d.txt"
+    path.write_text("x\n")
+    assert batch(path, tmp_path / "missing.txt", "--find", "x") == 1
+    assert "ошибок: 1" in capsys.readouterr().out
+
+
+def test_batch_token_as_value_is_kept(tmp_path):
+    path = tmp_path / "e.txt"
+    path.write_bytes(b"--batch here\n")
+    assert batch("--find=--batch", "--replace=-b", path) == 0
+    assert path.read_bytes() == b"-b here\n"
+
+
+def test_hidden_directories_and_glob(tmp_path):
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".git" / "x.txt").write_bytes(b"x\n")
+    (tmp_path / "y.txt").write_bytes(b"x\n")
+    (tmp_path / "z.md").write_bytes(b"x\n")
+    paths = list(notefish.batch_paths([str(tmp_path)], "*.txt"))
+    assert paths == [os.path.join(str(tmp_path), "y.txt")]
+
+
+def test_bad_expression_is_usage_error(tmp_path):
+    with pytest.raises(SystemExit) as error:
+        batch(tmp_path, "--regex", "--find", "(")
+    assert error.value.code == 2
@@ -0,0 +1,35 @@
+import notefish_bench
+
+
+def test_corpus_has_requested_size_and_whole_lines(tmp_path):
+    path = tmp_path / "corpus.txt"
+    notefish_bench.make_corpus("prose", 100_000, path)
+    data = path.read_bytes()
+    assert 0 < len(data) <= 100_000
+    assert data.endswith(b"\n")
+
+
+def test_percentiles_in_milliseconds():
+    stats = notefish_bench.percentiles([0.001 * i for i in range(1, 101)])
+    assert stats["p50"] == 51.0
+    assert stats["max"] == 100.0
+    assert notefish_bench.percentiles([]) == {}
+
+
+def test_compare_reports_only_regressions():
+    def report(open_s, p99):
+        return {"results": [{"size": "1mb", "corpus": "prose", "bytes": 1,
+                             "open_s": open_s, "find_matches": 5,
+                             "keystroke_ms": {"p99": p99}}]}
+
+    assert notefish_bench.compare(report(1.0, 10.0), report(1.1, 9.0)) == 0
+    assert notefish_bench.compare(report(1.0, 10.0), report(2.0, 20.0)) == 2
+
+
+def test_compare_skips_records_from_another_mode():
+    def report(open_s, large_mode):
+        return {"results": [{"size": "100mb", "corpus": "prose", "bytes": 1,
+                             "open_s": open_s, "large_mode": large_mode}]}
+
+    assert notefish_bench.compare(report(1.0, False), report(5.0, True)) == 0
+    assert notefish_bench.compare(report(1.0, True), report(5.0, True)) == 1
@@ -0,0 +1,250 @@
+import random
+
+import pytest
+
+from notefish import PieceTable, SpanStore, UndoJournal
+
+
+def check_piece_table(table, text):
+    """Сверка всех запросов таблицы с обычной строкой"""
+    lines = text.split("\n")
+    assert len(table) == len(text)
+    assert table.get_text() == text
+    assert table.line_count == len(lines)
+
+    starts = [0]
+    for line in lines[:-1]:
+        starts.append(starts[-1] + len(line) + 1)
+    for number, line in enumerate(lines):
+        assert table.get_line(number) == line
+        assert table.line_start(number) == starts[number]
+    assert table.line_start(len(lines)) == len(text)
+
+    for offset in range(0, len(text) + 1, max(1, len(text) // 20)):
+        line = text.count("\n", 0, offset)
+        column = offset - (text.rfind("\n", 0, offset) + 1)
+        assert table.position(offset) == (line, column)
+        assert table.offset(line, column) == offset
+
+
+def test_initial_text():
+    text = "first\nsecond\n\nlast"
+    check_piece_table(PieceTable(text), text)
+    check_piece_table(PieceTable(""), "")
+
+
+def test_newlines_are_real_newlines():
+    table = PieceTable("a\\nb\nc")
+    assert table.line_count == 2
+    assert table.get_line(0) == "a\\nb"
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_edits_match_str(seed):
+    rng = random.Random(seed)
+    text = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 40)))
+    table = PieceTable(text)
+    cursor = 0
+    for _ in range(200):
+        if rng.random() < 0.6 or not text:
+            # Половина вставок - набор подряд у курсора, как при печати
+            offset = cursor if rng.random() < 0.5 else rng.randint(0, len(text))
+            chunk = "".join(rng.choice("xy\n") for _ in range(rng.randint(1, 5)))
+            table.insert(offset, chunk)
+            text = text[:offset] + chunk + text[offset:]
+            cursor = offset + len(chunk)
+        else:
+            offset = rng.randrange(len(text))
+            length = rng.randint(1, 6)
+            table.delete(offset, length)
+            text = text[:offset] + text[offset + length:]
+            cursor = min(offset, len(text))
+
+        start = rng.randint(0, len(text))
+        end = rng.randint(start, len(text))
+        assert table.get_text(start, end) == text[start:end]
+    check_piece_table(table, text)
+
+
+def test_buffers_released_when_text_replaced():
+    table = PieceTable()
+    text = "line\n" * 20_000
+    for _ in range(10):
+        table.delete(0, len(table))
+        assert table.buffers == [] and table.stored == 0
+        table.insert(0, text)
+    assert table.stored == len(text)
+    check_piece_table(table, text)
+
+
+def test_buffers_compacted_after_edits():
+    rng = random.Random(1)
+    text = "abc\n" * 1000
+    table = PieceTable(text)
+    for _ in range(2000):
+        offset = rng.randint(0, len(text))
+        chunk = "x\n" * rng.randint(1, 1000)
+        table.insert(offset, chunk)
+        table.delete(offset, len(chunk))
+        assert table.stored <= max(2 * len(table), PieceTable.COMPACT_MIN_CHARS)
+    check_piece_table(table, text)
+
+
+def span_model(store):
+    """Оформление каждого символа по участкам хранилища"""
+    attrs = []
+    for start, end, run_attrs in store.runs():
+        assert start == len(attrs)
+        attrs.extend([run_attrs] * (end - start))
+    return attrs
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_span_store_matches_model(seed):
+    rng = random.Random(seed)
+    store = SpanStore()
+    model = []
+    for _ in range(300):
+        action = rng.random()
+        if action < 0.4 or not model:
+            offset = rng.randint(0, len(model))
+            length = rng.randint(1, 5)
+            # Новые символы наследуют оформление слева, в начале - справа
+            if offset:
+                inherited = model[offset - 1]
+            else:
+                inherited = model[0] if model else SpanStore.DEFAULT
+            store.insert(offset, length)
+            model[offset:offset] = [inherited] * length
+        elif action < 0.7:
+            offset = rng.randrange(len(model))
+            length = rng.randint(1, 5)
+            store.delete(offset, length)
+            del model[offset:offset + length]
+        else:
+            start = rng.randrange(len(model))
+            end = rng.randint(start + 1, len(model))
+            index = rng.randrange(len(SpanStore.ATTRIBUTES))
+            value = rng.choice(["red", "blue"]) if index == 3 else rng.random() < 0.5
+            store.set(start, end, SpanStore.ATTRIBUTES[index], value)
+            for i in range(start, end):
+                attrs = model[i]
+                model[i] = attrs[:index] + (value,) + attrs[index + 1:]
+
+        assert len(store) == len(model)
+        assert span_model(store) == model
+
+    # Соседние участки с одинаковым оформлением слиты
+    runs = store.runs()
+    assert all(a[2] != b[2] for a, b in zip(runs, runs[1:]))
+    assert store.is_plain() == all(attrs == SpanStore.DEFAULT for attrs in model)
+
+
+def test_span_records_round_trip():
+    store = SpanStore()
+    store.insert(0, 20)
+    store.set(2, 8, "bold", True)
+    store.set(5, 12, "color", "#ff0000")
+
+    restored = SpanStore()
+    restored.load(store.to_records(), len(store))
+    assert restored.runs() == store.runs()
+
+    with pytest.raises(ValueError):
+        restored.load([[5, 30, 1, None]], 20)
+
+
+def test_span_queries_and_merging():
+    store = SpanStore()
+    store.insert(0, 10)
+    store.set(2, 5, "bold", True)
+    store.set(4, 8, "color", "#00ff00")
+
+    assert store.is_set(2, 5, "bold") and not store.is_set(1, 5, "bold")
+    assert [(start, end) for start, end, _ in store.runs(3, 6)] == [(2, 4), (4, 5), (5, 8)]
+
+    # Снятое оформление сливается с соседями в один участок
+    store.set(0, 10, "bold", False)
+    store.set(0, 10, "color", None)
+    assert store.runs() == [(0, 10, SpanStore.DEFAULT)] and store.is_plain()
+
+
+def apply_step(text, step, undo=False):
+    """Применение шага журнала к строке; при отмене - обратных дельт в обратном порядке"""
+    for kind, offset, chunk in reversed(step) if undo else step:
+        if (kind == "insert") != undo:
+            text = text[:offset] + chunk + text[offset:]
+        else:
+            assert text[offset:offset + len(chunk)] == chunk
+            text = text[:offset] + text[offset + len(chunk):]
+    return text
+
+
+def test_undo_merges_typing_and_backspace():
+    journal = UndoJournal()
+    for offset, char in enumerate("abc"):
+        journal.record("insert", offset, char)
+    for offset, char in [(2, "c"), (1, "b")]:
+        journal.record("delete", offset, char)
+    journal.record("insert", 1, "\n")
+
+    assert len(journal.undo_stack) == 3
+    assert journal.undo() == [("insert", 1, "\n")]
+    assert journal.undo() == [("delete", 1, "bc")]
+    assert journal.undo() == [("insert", 0, "abc")]
+    assert journal.undo() is None
+    assert journal.redo() == [("insert", 0, "abc")]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_undo_journal_matches_model(seed):
+    rng = random.Random(seed)
+    journal = UndoJournal(memory_limit=2000)
+    text = ""
+    cursor = 0
+    spilled = False
+    for _ in range(600):
+        action = rng.random()
+        if action < 0.6 or not text:
+            # Набор у курсора, иногда - вставка фрагмента в случайное место
+            offset = cursor if action < 0.5 else rng.randint(0, len(text))
+            chunk = rng.choice("ab\n") if action < 0.5 else "x" * rng.randint(2, 40)
+            journal.record("insert", offset, chunk)
+            text = text[:offset] + chunk + text[offset:]
+            cursor = offset + len(chunk)
+        elif action < 0.8 and cursor:
+            cursor -= 1
+            journal.record("delete", cursor, text[cursor])
+            text = text[:cursor] + text[cursor + 1:]
+        else:
+            offset = rng.randrange(len(text))
+            chunk = text[offset:offset + rng.randint(1, 5)]
+            journal.record("delete", offset, chunk)
+            text = text[:offset] + text[offset + len(chunk):]
+            cursor = offset
+        assert journal.memory <= journal.memory_limit + 64
+        spilled = spilled or bool(journal.spilled)
+    assert spilled
+
+    final = text
+    steps = 0
+    while journal.can_undo():
+        text = apply_step(text, journal.undo(), undo=True)
+        steps += 1
+    assert text == "" and journal.undo() is None
+
+    for _ in range(steps):
+        text = apply_step(text, journal.redo())
+    assert text == final and not journal.can_redo()
+
+
+def test_undo_reset_closes_spill_file():
+    journal = UndoJournal(memory_limit=200)
+    for offset in range(0, 400, 40):
+        journal.record("insert", offset, "y" * 40)
+    spill_file = journal.spill_file
+    assert spill_file is not None and journal.spilled
+
+    journal.reset()
+    assert spill_file.closed
+    assert journal.spill_file is None and not journal.can_undo()
@@ -0,0 +1,191 @@
+import json
+
+import pytest
+
+import notefish
+
+
+def load(path, encoding=None):
+    """Текст файла и загрузчик после чтения до конца"""
+    loader = notefish.FileLoader(str(path), encoding)
+    with open(path, "rb") as file:
+        text = "".join(loader.decode(loader.read(file)))
+    return text, loader
+
+
+def test_loader_stamp_counts_read_bytes(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_bytes(b"one\ntwo\n")
+
+    text, loader = load(path)
+    assert text == "one\ntwo\n"
+    assert loader.stamp == notefish.file_stamp(str(path))
+    assert loader.stamp.size == loader.bytes_read == 8
+
+    # Дописанное после загрузки меняет отметку - его найдет проверка файла
+    with open(path, "ab") as file:
+        file.write(b"three\n")
+    assert notefish.file_stamp(str(path)) != loader.stamp
+
+
+def drain(loader):
+    """Порции загрузчика до признака конца"""
+    chunks = []
+    while True:
+        chunk = loader.queue.get(timeout=5)
+        if chunk is None:
+            return chunks
+        chunks.append(chunk)
+
+
+def test_loader_thread_splits_multibyte_and_crlf(tmp_path):
+    path = tmp_path / "doc.txt"
+    text = "строка\r\nline\r\n" * 50
+    path.write_bytes(text.encode("utf-8"))
+
+    loader = notefish.FileLoader(str(path))
+    # Порции по 7 байт режут и русские буквы, и пары CRLF
+    loader.FIRST_CHUNK = loader.CHUNK = 7
+    loader.start()
+    chunks = drain(loader)
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == text.replace("\r\n", "\n")
+    assert loader.error is None and loader.progress() == 1.0
+    assert loader.file_format.newline == "\r\n"
+
+
+def test_loader_cancel_stops_reading(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_bytes(b"x\n" * 100_000)
+
+    loader = notefish.FileLoader(str(path))
+    loader.FIRST_CHUNK = loader.CHUNK = 1024
+    loader.cancel()
+    loader.run()
+    assert loader.queue.empty() and loader.progress() < 1.0
+
+
+@pytest.mark.parametrize("lines, expected", [
+    # Строка длиннее предела, порезанная порциями
+    (["short", "x" * notefish.LONG_LINE_CHARS, "tail"], True),
+    # Последняя строка без перевода строки
+    (["short", "y" * notefish.LONG_LINE_CHARS], True),
+    # Много строк чуть короче предела
+    (["z" * (notefish.LONG_LINE_CHARS - 1)] * 20, False)
+])
+def test_loader_detects_long_lines_across_chunks(tmp_path, lines, expected):
+    path = tmp_path / "min.js"
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+    loader = notefish.FileLoader(str(path))
+    loader.FIRST_CHUNK = loader.CHUNK = 997
+    with open(path, "rb") as file:
+        for _ in loader.decode(loader.read(file)):
+            pass
+    assert loader.long_lines is expected
+
+
+def test_follower_reads_appended_bytes(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_bytes(b"\xef\xbb\xbfone\r\n")
+    _, loader = load(path)
+
+    follower = notefish.FileFollower(str(path), loader.stamp.size, loader.file_format)
+    assert not isinstance(follower, notefish.FileLoader)
+    with open(path, "ab") as file:
+        file.write("два\r\n".encode("utf-8"))
+
+    follower.decoder = follower.make_decoder("replace")
+    with open(path, "rb") as file:
+        follower.read_new(file)
+    assert follower.queue.get_nowait() == ("text", "два\n", 16)
+
+
+def test_reload_job_appended_and_changed(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_bytes(b"alpha\nbeta\ngamma\n")
+    text, loader = load(path)
+
+    # Только дописано: новый текст - один участок в конце
+    with open(path, "ab") as file:
+        file.write(b"delta\n")
+    job = notefish.ReloadJob(str(path), text, loader.stamp, loader.digest,
+                             loader.file_format, 7)
+    job.run()
+    assert job.error is None and job.revision == 7
+    assert job.regions == [(len(text), len(text), "delta\n")]
+
+    # Изменена середина: заменяется только она
+    text = text + "delta\n"
+    path.write_bytes(b"alpha\nBETA\ngamma\ndelta\n")
+    job = notefish.ReloadJob(str(path), text, job.stamp, job.digest, loader.file_format, 8)
+    job.run()
+    assert job.regions == [(6, 11, "BETA\n")]
+
+
+@pytest.mark.parametrize("encoding", ["utf-16-le", "utf-16-be"])
+def test_utf16_without_bom(encoding):
+    data = "plain text, строка 1\n".encode(encoding) * 50
+    assert notefish.detect_encoding(data) == (encoding, b"")
+
+
+def test_binary_with_many_nuls_is_not_utf16():
+    # Нули идут блоками, а не через байт
+    data = (b"\x00" * 64 + bytes(range(1, 65))) * 40
+    assert notefish.detect_encoding(data) == ("latin-1", b"")
+
+    # Нули с обеих сторон пар
+    data = b"ab\x00\x00cd\x00\x00" * 300
+    assert notefish.detect_encoding(data) == ("latin-1", b"")
+
+
+def test_detect_encoding_basics():
+    assert notefish.detect_encoding(b"\xef\xbb\xbfx") == ("utf-8", b"\xef\xbb\xbf")
+    assert notefish.detect_encoding("привет".encode("utf-8")) == ("utf-8", b"")
+    assert notefish.detect_encoding("привет мир".encode("cp1251"))[0] == "cp1251"
+    assert notefish.detect_encoding("café naïve".encode("latin-1"))[0] == "latin-1"
+
+
+@pytest.mark.parametrize("text, encoding", [
+    ("Grüße", "latin-1"),
+    ("Grüße aus Köln, schöne Straße", "latin-1"),
+    ("Ça a été très élégant, où êtes-vous? Noël à Paris", "latin-1"),
+    ("¿Qué año es? Señor Muñoz", "latin-1"),
+    ("Привет, мир! Это тест. Ёлка стоит в доме, и я рад.", "cp1251"),
+    ("ВНИМАНИЕ: Файл не найден", "cp1251"),
+    ("Log: ошибка в модуле io, код 42", "cp1251")
+])
+def test_guess_8bit_encoding(text, encoding):
+    assert notefish.guess_8bit_encoding(text.encode(encoding)) == encoding
+
+def test_large_saver_writes_snapshot_of_overlays(tmp_path):
+    path = tmp_path / "big.txt"
+    path.write_bytes(b"one\r\ntwo\r\nthree")
+    document = notefish.LargeFileDocument(str(path))
+    document.replace_lines(1, 2, ["TWO", "2"])
+
+    saver = notefish.LargeFileSaver(str(path), document)
+    # Правка после снимка в запись не попадает
+    document.replace_lines(0, 1, [])
+    saver.run()
+
+    assert saver.error is None and saver.done.is_set()
+    assert path.read_bytes() == b"one\r\nTWO\r\n2\r\nthree"
+    assert saver.stamp == notefish.file_stamp(str(path))
+    assert document.file.closed
+
+
+def test_saver_writes_and_removes_formatting_sidecar(tmp_path):
+    path = tmp_path / "doc.txt"
+    sidecar = tmp_path / ("doc.txt" + notefish.FORMAT_SUFFIX)
+
+    saver = notefish.FileSaver(str(path), "hello\n", formatting=[[0, 5, 1, "#ff0000"]])
+    saver.run()
+    assert saver.error is None
+    record = json.loads(sidecar.read_text(encoding="utf-8"))
+    assert record == {"version": 1, "length": 6, "runs": [[0, 5, 1, "#ff0000"]]}
+
+    # Без оформления устаревший соседний файл удаляется
+    notefish.FileSaver(str(path), "plain", formatting=[]).run()
+    assert not sidecar.exists()
@@ -0,0 +1,89 @@
+import tkinter as tk
+
+import notefish
+
+
+LINE_HEIGHT = 10
+
+
+def layout(first_line, display_lines):
+    """dlineinfo для строк от first_line, занимающих display_lines строк экрана.
+
+    Первая строка может начинаться с середины - продолжение переноса.
+    """
+    info = {}
+    y = 0
+    for offset, (column, count) in enumerate(display_lines):
+        info[f"{first_line + offset}.{column}"] = (0, y, 100, LINE_HEIGHT, 8)
+        y += count * LINE_HEIGHT
+    return info.get
+
+
+def test_numbers_follow_scroll_position():
+    dlineinfo = layout(5, [(0, 1)] * 10)
+    rows = notefish.gutter_rows("5.0", 1, 100, 35, dlineinfo)
+    assert rows == [(0, 5), (10, 6), (20, 7), (30, 8)]
+
+
+def test_wrapped_lines_numbered_once():
+    # Строка 3 переносится на три строки экрана, строка 4 - на две
+    dlineinfo = layout(3, [(0, 3), (0, 2), (0, 1)])
+    rows = notefish.gutter_rows("3.0", 1, 100, 100, dlineinfo)
+    assert rows == [(0, 3), (30, 4), (50, 5)]
+
+
+def test_wrapped_continuation_at_top_has_no_number():
+    dlineinfo = layout(7, [(80, 1), (0, 1), (0, 1)])
+    rows = notefish.gutter_rows("7.80", 1, 100, 100, dlineinfo)
+    assert rows == [(10, 8), (20, 9)]
+
+
+def test_large_file_window_offset():
+    dlineinfo = layout(1, [(0, 1)] * 3)
+    rows = notefish.gutter_rows("1.0", 1001, 3, 100, dlineinfo)
+    assert rows == [(0, 1001), (10, 1002), (20, 1003)]
+
+
+def test_stops_at_last_line_and_hidden_lines():
+    dlineinfo = layout(1, [(0, 1)] * 5)
+    assert len(notefish.gutter_rows("1.0", 1, 2, 100, dlineinfo)) == 2
+    assert notefish.gutter_rows("9.0", 1, 20, 100, dlineinfo) == []
+
+
+def shown_numbers(gutter):
+    """Номера видимых элементов полосы сверху вниз"""
+    items = [item for item in gutter.items
+             if gutter.canvas.itemcget(item, "state") != "hidden"]
+    return [int(gutter.canvas.itemcget(item, "text")) for item in items]
+
+
+def test_line_gutter_in_widget(tk_root):
+    text = tk.Text(tk_root, height=10, width=20, wrap=tk.NONE)
+    text.insert("1.0", "\n".join(f"line {i} " + "x" * 50 for i in range(1, 201)))
+    gutter = notefish.LineGutter(tk_root, text)
+    gutter.configure(("Courier", 10), "black")
+    gutter.canvas.pack(side=tk.LEFT, fill=tk.Y)
+    text.pack(side=tk.LEFT)
+    tk_root.deiconify()
+    tk_root.update()
+
+    gutter.redraw(1, 200)
+    numbers = shown_numbers(gutter)
+    assert numbers[0] == 1 and numbers == list(range(1, len(numbers) + 1))
+
+    # Прокрутка: первый номер - верхняя строка экрана
+    text.yview("120.0")
+    tk_root.update()
+    gutter.redraw(1, 200)
+    assert shown_numbers(gutter)[0] == int(text.index("@0,0").split(".")[0]) == 120
+
+    # Перенос: номеров меньше, чем строк экрана
+    text.configure(wrap=tk.CHAR)
+    text.yview("1.0")
+    tk_root.update()
+    gutter.redraw(1, 200)
+    assert len(shown_numbers(gutter)) < 10
+
+    # Смена темы перекрашивает уже созданные элементы
+    gutter.configure(("Courier", 10), "red")
+    assert all(gutter.canvas.itemcget(item, "fill") == "red" for item in gutter.items)
@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import notefish
+
+
+def dead_pid():
+    """PID уже завершившегося процесса"""
+    process = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                             capture_output=True, text=True, check=True)
+    return int(process.stdout)
+
+
+def test_file_created_on_first_edit(tmp_path):
+    journal = notefish.EditJournal(str(tmp_path))
+    journal.append("insert", 0, "lost")
+    assert journal.path is None
+
+    journal.start()
+    assert journal.path is None
+    journal.append("insert", 0, "kept")
+    assert os.path.exists(journal.path)
+
+    path = journal.path
+    journal.stop()
+    assert not os.path.exists(path)
+
+
+def test_replay_applies_edits_to_base_file(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_bytes("первая\r\nвторая\r\n".encode("cp1251"))
+    file_format = notefish.FileFormat("cp1251", b"", "\r\n", False)
+
+    journal = notefish.EditJournal(str(tmp_path / "recovery"))
+    journal.start(str(doc), file_format)
+    journal.append("insert", 0, "новая\n")
+    journal.append("delete", 6, "первая\n")
+    journal.flush()
+
+    header, text = notefish.EditJournal.replay(journal.path)
+    assert text == "новая\nвторая\n"
+    assert notefish.EditJournal.header_format(header) == file_format
+
+    # Исходный файл изменился - к нему правки уже не применить
+    doc.write_bytes(b"other")
+    with pytest.raises(ValueError):
+        notefish.EditJournal.replay(journal.path)
+
+
+def test_replay_ignores_torn_last_record(tmp_path):
+    journal = notefish.EditJournal(str(tmp_path))
+    journal.start()
+    journal.append("insert", 0, "abc")
+    journal.flush()
+    with open(journal.path, "a", encoding="utf-8") as file:
+        file.write('["insert", 3, "de')
+    assert notefish.EditJournal.replay(journal.path)[1] == "abc"
+
+
+def test_snapshot_compacts_journal(tmp_path):
+    journal = notefish.EditJournal(str(tmp_path))
+    journal.COMPACT_BYTES = 1000
+    journal.start()
+    text = ""
+    for i in range(200):
+        journal.append("insert", len(text), "x")
+        text += "x"
+    assert journal.needs_compaction(len(text))
+
+    before = journal.size
+    journal.snapshot(text)
+    assert journal.size < before and not journal.needs_compaction(len(text))
+    journal.append("insert", 0, "y")
+    journal.flush()
+
+    header, replayed = notefish.EditJournal.replay(journal.path)
+    assert replayed == "y" + text and header["base"] is None
+    assert journal.size == os.path.getsize(journal.path)
+
+
+def test_orphans_are_journals_of_dead_processes(tmp_path):
+    own = notefish.EditJournal(str(tmp_path))
+    own.start()
+    own.append("insert", 0, "mine")
+    own.flush()
+
+    orphan = tmp_path / "1-1.journal"
+    orphan.write_text(json.dumps({"path": None, "pid": dead_pid(), "base": None}) + "\n"
+                      + json.dumps(["insert", 0, "lost work"]) + "\n", encoding="utf-8")
+
+    orphans = notefish.EditJournal.orphans(str(tmp_path))
+    assert [path for path, _ in orphans] == [str(orphan)]
+    assert notefish.EditJournal.replay(str(orphan))[1] == "lost work"
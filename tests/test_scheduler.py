@@ -0,0 +1,149 @@
+import json
+import time
+
+import pytest
+
+import notefish
+
+
+class FakeRoot:
+    """Таймеры after и after_idle, которые тест запускает вручную"""
+
+    def __init__(self):
+        self.timers = {}
+        self.idle = []
+        self.ids = 0
+
+    def after(self, delay, callback, *args):
+        self.ids += 1
+        self.timers[f"after#{self.ids}"] = (delay, callback, args)
+        return f"after#{self.ids}"
+
+    def after_cancel(self, job):
+        del self.timers[job]
+
+    def after_idle(self, callback):
+        self.idle.append(callback)
+        return "idle"
+
+    def fire(self):
+        """Срабатывание всех таймеров, затем обработка простоя"""
+        timers, self.timers = self.timers, {}
+        for _, callback, args in timers.values():
+            callback(*args)
+        self.run_idle()
+
+    def run_idle(self):
+        idle, self.idle = self.idle, []
+        for callback in idle:
+            callback()
+
+
+def make_scheduler():
+    root = FakeRoot()
+    scheduler = notefish.UpdateScheduler(root)
+    calls = []
+    scheduler.register("status", lambda: calls.append("status"))
+    scheduler.register("stats", lambda: calls.append("stats"), delay=50)
+    scheduler.register("gutter", lambda: calls.append("gutter"))
+    return root, scheduler, calls
+
+
+def test_requests_coalesce_until_flush():
+    root, scheduler, calls = make_scheduler()
+    for _ in range(100):
+        scheduler.request("gutter")
+        scheduler.request("status")
+
+    # Один проход простоя на все готовые обновления
+    assert len(root.idle) == 1
+    root.run_idle()
+    assert calls == ["status", "gutter"]
+    assert scheduler.counters()["gutter"] == {"requested": 100, "executed": 1, "coalesced": 99}
+
+    scheduler.request("gutter")
+    root.run_idle()
+    assert calls == ["status", "gutter", "gutter"]
+
+
+def test_delayed_consumer_waits_for_its_window():
+    root, scheduler, calls = make_scheduler()
+    scheduler.request("stats")
+    scheduler.request("stats")
+    assert scheduler.pending("stats") and not root.idle
+    assert [delay for delay, _, _ in root.timers.values()] == [50]
+
+    root.fire()
+    assert calls == ["stats"] and not scheduler.pending("stats")
+    assert scheduler.coalesced["stats"] == 1
+
+
+def test_cancel_and_set_delay():
+    root, scheduler, calls = make_scheduler()
+    scheduler.request("stats")
+    scheduler.request("status")
+    scheduler.cancel("stats")
+    scheduler.cancel("status")
+    assert not root.timers and not scheduler.pending("status")
+    root.fire()
+    assert calls == []
+
+    scheduler.set_delay("status", -5)
+    scheduler.set_delay("unknown", 10)
+    assert scheduler.delays["status"] == 0 and "unknown" not in scheduler.delays
+
+
+def test_wrapped_handler_is_timed():
+    monitor = notefish.LatencyMonitor(FakeRoot())
+
+    class Editor:
+        def on_key(self, char):
+            return char.upper()
+
+        def on_save(self):
+            raise OSError("disk full")
+
+    editor = Editor()
+    monitor.instrument(editor, ["on_key", "on_save"])
+    assert editor.on_key("a") == "A"
+    with pytest.raises(OSError):
+        editor.on_save()
+
+    assert monitor.totals == {"on_key": 1, "on_save": 1}
+    assert [name for name, _, _ in monitor.trace] == ["on_key", "on_save"]
+
+
+def test_heartbeat_measures_mainloop_lag():
+    root = FakeRoot()
+    monitor = notefish.LatencyMonitor(root, heartbeat_ms=50)
+    monitor.start()
+    assert [delay for delay, _, _ in root.timers.values()] == [50]
+
+    # Таймер сработал на 30 мс позже ожидаемого
+    monitor.expected = time.perf_counter() - 0.03
+    root.fire()
+    lag = monitor.samples[monitor.LAG][0]
+    assert 0.03 <= lag < 1.0
+    assert len(root.timers) == 1
+
+    monitor.stop()
+    assert not root.timers
+
+
+def test_summary_and_dump(tmp_path):
+    monitor = notefish.LatencyMonitor(FakeRoot())
+    for ms in [0.5, 1.5, 3, 3, 700, 2000]:
+        monitor.record("flush", monitor.started, ms / 1000)
+
+    summary = monitor.summary()["flush"]
+    assert summary["count"] == 6 and summary["max"] == 2000
+    assert summary["histogram"] == {"<=1": 1, "<=2": 1, "<=5": 2, "<=1000": 1, ">1000": 1}
+
+    monitor.dump(str(tmp_path / "trace.csv"))
+    lines = (tmp_path / "trace.csv").read_text(encoding="utf-8").splitlines()
+    assert lines[0] == "name,start_ms,duration_ms" and lines[1] == "flush,0.000,0.500"
+
+    monitor.dump(str(tmp_path / "trace.json"))
+    record = json.loads((tmp_path / "trace.json").read_text(encoding="utf-8"))
+    assert record["summary"]["flush"]["histogram"] == summary["histogram"]
+    assert len(record["trace"]) == 6
@@ -0,0 +1,102 @@
+import random
+import re
+
+import pytest
+
+import notefish
+
+
+def run_job(job):
+    """Совпадения задания, выполненного в текущем потоке"""
+    job.run()
+    spans = []
+    while True:
+        batch = job.queue.get_nowait()
+        if batch is None:
+            return spans
+        spans.extend(batch)
+
+
+def test_search_job_skips_empty_matches():
+    job = notefish.SearchJob("ab\nAb ab", "a?b", ignore_case=True, regex=True)
+    assert run_job(job) == [(0, 2), (3, 5), (6, 8)]
+
+
+def test_large_search_covers_whole_file(tmp_path):
+    path = tmp_path / "big.log"
+    path.write_bytes(b"".join(b"line %d\r\n" % i for i in range(20_000)) + b"needle")
+    document = notefish.LargeFileDocument(str(path))
+    # Правка в оверлее: строка 5000 заменена двумя
+    document.replace_lines(5000, 5001, ["a needle", "x"])
+
+    job = notefish.LargeSearchJob(document, "needle")
+    job.BLOCK_LINES = 1000
+    spans = [(notefish.key_position(start), notefish.key_position(end))
+             for start, end in run_job(job)]
+    assert spans == [((5000, 2), (5000, 8)), ((20_001, 0), (20_001, 6))]
+    document.close()
+
+
+def test_large_search_uses_snapshot(tmp_path):
+    path = tmp_path / "big.log"
+    path.write_bytes(b"one\ntwo\nthree\n")
+    document = notefish.LargeFileDocument(str(path))
+    job = notefish.LargeSearchJob(document, "two")
+    document.replace_lines(0, 2, [])
+    assert [notefish.key_position(start) for start, _ in run_job(job)] == [(1, 0)]
+    document.close()
+
+
+def test_line_keys_are_ordered():
+    keys = [notefish.line_key(line, column)
+            for line, column in [(0, 0), (0, 70_000), (1, 0), (2, 5)]]
+    assert keys == sorted(keys)
+    assert notefish.key_position(keys[1]) == (0, 70_000)
+
+
+def test_compile_query_modes():
+    assert notefish.compile_query("a.b").search("axb") is None
+    assert notefish.compile_query("a.b", regex=True).search("axb")
+    assert notefish.compile_query("fish", whole_word=True).findall("fish fishing fish") == ["fish"] * 2
+    assert notefish.compile_query("FISH", ignore_case=True).search("Fish")
+
+
+def test_substitute_plain_and_regex():
+    pattern = notefish.compile_query("fish")
+    # Без режима regex обратная косая черта в замене - обычный символ
+    assert notefish.substitute(pattern, r"c\1t", "fish and fish") == (r"c\1t and c\1t", 2)
+
+    pattern = notefish.compile_query(r"(\w+)@(\w+)", regex=True)
+    assert notefish.substitute(pattern, r"\2 at \1", "me@home, you@work", regex=True) == \
+        ("home at me, work at you", 2)
+
+    # Пустые совпадения не заменяются и не считаются
+    pattern = notefish.compile_query("x*", regex=True)
+    assert notefish.substitute(pattern, "-", "axxb", regex=True) == ("a-b", 1)
+
+    with pytest.raises(re.error):
+        notefish.substitute(notefish.compile_query("a", regex=True), r"\3", "a", regex=True)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_changed_region_is_minimal(seed):
+    rng = random.Random(seed)
+    old = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 10_000)))
+    start = rng.randint(0, len(old))
+    end = rng.randint(start, min(len(old), start + rng.randint(0, 50)))
+    new = old[:start] + "".join(rng.choice("abc") for _ in range(rng.randint(0, 20))) + old[end:]
+
+    head, end, text = notefish.changed_region(old, new)
+    assert old[:head] + text + old[end:] == new
+
+    # Общие начало и конец не входят в участок
+    suffix = len(old) - end
+    limit = min(len(old), len(new))
+    assert head == limit or old[head] != new[head]
+    assert head + suffix == limit or old[end - 1] != new[len(new) - suffix - 1]
+
+
+def test_shift_offset_through_regions():
+    regions = [(2, 4, "XYZ"), (10, 12, "")]
+    assert [notefish.shift_offset(offset, regions) for offset in (0, 2, 3, 4, 8, 11, 12, 20)] == \
+        [0, 2, 2, 5, 9, 11, 11, 19]
@@ -0,0 +1,55 @@
+import notefish
+
+
+def test_entry_round_trip(tmp_path):
+    doc = tmp_path / "doc.txt"
+    doc.write_bytes(b"\xef\xbb\xbfhello\r\n")
+    file_format = notefish.FileFormat("utf-8", b"\xef\xbb\xbf", "\r\n", True)
+    stamp = notefish.file_stamp(str(doc))
+    entry = notefish.Session.entry(str(doc), file_format, "1.3", 0.25, stamp,
+                                   large=True, window_start=1200, long_lines=True)
+
+    session = notefish.Session(str(tmp_path / "session.json"))
+    session.write([entry], 0)
+    documents, active = notefish.Session(session.path).load()
+
+    assert (documents, active) == ([entry], 0)
+    restored = documents[0]
+    assert notefish.EditJournal.header_format(restored) == file_format
+    assert notefish.FileStamp(*restored["stamp"]) == stamp
+    assert restored["large"] and restored["window_start"] == 1200 and restored["long_lines"]
+
+
+def test_unchanged_snapshot_is_not_rewritten(tmp_path):
+    session = notefish.Session(str(tmp_path / "session.json"))
+    entry = notefish.Session.entry("a.txt", notefish.DEFAULT_FILE_FORMAT, "1.0", 0.0, None)
+    session.write([entry], 0)
+
+    (tmp_path / "session.json").unlink()
+    session.write([entry], 0)
+    assert not (tmp_path / "session.json").exists()
+
+    session.write([entry, entry], 1)
+    assert session.load()[1] == 1
+
+
+def test_missing_or_foreign_snapshot_is_empty(tmp_path):
+    path = tmp_path / "session.json"
+    assert notefish.Session(str(path)).load() == ([], 0)
+    path.write_text("{broken", encoding="utf-8")
+    assert notefish.Session(str(path)).load() == ([], 0)
+    path.write_text('{"version": 99, "documents": [{"path": "x"}]}', encoding="utf-8")
+    assert notefish.Session(str(path)).load() == ([], 0)
+
+
+def test_tab_text_compressed_and_released():
+    tab = notefish.DocumentTab(None, None)
+    text = "строка текста\n" * notefish.TAB_COMPRESS_MIN_CHARS
+    tab.store_text(text)
+    assert tab.compressed and len(tab.data) < len(text) // 10
+
+    assert tab.load_text() == text
+    assert tab.data == "" and not tab.compressed
+
+    tab.store_text("short")
+    assert not tab.compressed and tab.load_text() == "short"
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+import notefish
+
+
+# Модули, которые загружаются только при первом обращении
+LAZY_MODULES = ("tkinter.filedialog", "tkinter.messagebox", "tkinter.colorchooser",
+                "tkinter.simpledialog", "pickle", "difflib", "argparse",
+                "concurrent.futures")
+
+
+def test_lazy_module_imports_on_first_use(monkeypatch):
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    lazy = notefish.LazyModule("colorsys")
+    assert lazy.module is None and "colorsys" not in sys.modules
+
+    assert lazy.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert lazy.module is sys.modules["colorsys"]
+
+
+def test_import_does_not_load_deferred_modules():
+    code = ("import sys, notefish; "
+            f"print([name for name in {LAZY_MODULES!r} if name in sys.modules])")
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             check=True, cwd=os.path.dirname(notefish.__file__))
+    assert process.stdout.strip() == "[]"
+
+
+def test_startup_profile_report():
+    profile = notefish.StartupProfile(start=1.0)
+    profile.marks += [("settings", 1.002), ("widgets", 1.0125)]
+    lines = profile.report().splitlines()
+    assert lines[0].split() == ["settings", "2.0", "мс"]
+    assert lines[1].split() == ["widgets", "10.5", "мс"]
+    assert lines[2].split() == ["Всего", "12.5", "мс"]
@@ -0,0 +1,38 @@
+import notefish
+
+
+class FakeWidget:
+    """Виджет, запоминающий последние параметры"""
+
+    def __init__(self):
+        self.options = {}
+
+    def configure(self, **options):
+        self.options.update(options)
+
+
+def test_button_roles_built_for_every_color():
+    for key in ("primary", "secondary", "success", "warning", "accent", "violet", "slate"):
+        assert notefish.StyleRegistry.ROLES[f"button_{key}"] == {"bg": key, "activebackground": key}
+    assert not hasattr(notefish.StyleRegistry, "key")
+
+
+def test_tab_roles_follow_theme():
+    light, dark = notefish.THEMES["light"], notefish.THEMES["dark"]
+    styles = notefish.StyleRegistry(light)
+    tab = styles.register(FakeWidget(), "tab_active_text")
+    assert tab.options == {"bg": light["surface"], "fg": light["text_dark"]}
+
+    styles.apply(dark)
+    assert tab.options == {"bg": dark["surface"], "fg": dark["text_dark"]}
+
+
+def test_forgotten_widgets_not_reconfigured():
+    styles = notefish.StyleRegistry(notefish.THEMES["light"])
+    kept = styles.register(FakeWidget(), "tab")
+    dropped = styles.register(FakeWidget(), "tab")
+    styles.forget([dropped])
+
+    styles.apply(notefish.THEMES["dark"])
+    assert kept.options["bg"] == notefish.THEMES["dark"]["bg_light"]
+    assert dropped.options["bg"] == notefish.THEMES["light"]["bg_light"]
@@ -0,0 +1,107 @@
+import random
+
+import pytest
+
+from notefish import PieceTable, SyntaxHighlighter, SyntaxLexer
+
+
+PYTHON = SyntaxLexer.for_path("script.py")
+
+
+def highlight(highlighter, document):
+    """Лексинг пачками до пустого задания; число перелексированных строк"""
+    lexed = 0
+    while True:
+        job = highlighter.make_job(document)
+        if job is None:
+            return lexed
+        job.run()
+        assert highlighter.apply(job)
+        lexed += len(job.states)
+
+
+def full_lex(lexer, text):
+    """Токены и состояния всех строк, разобранных подряд с начала"""
+    tokens, states = [], []
+    state = 0
+    for line in text.split("\n"):
+        line_tokens, state = lexer.lex(line, state)
+        tokens.append(line_tokens)
+        states.append(state)
+    return tokens, states
+
+
+def test_lexer_for_path():
+    assert SyntaxLexer.for_path("notes.txt") is None
+    assert SyntaxLexer.for_path(None) is None
+    assert SyntaxLexer.for_path("a.PY") is PYTHON
+
+
+def test_block_state_carries_across_lines():
+    tokens, state = PYTHON.lex('x = """doc', 0)
+    assert state and tokens[-1] == (4, 10, "string")
+    tokens, state = PYTHON.lex("still doc", state)
+    assert tokens == [(0, 9, "string")] and state
+    tokens, state = PYTHON.lex('end""" # note', state)
+    assert tokens == [(0, 6, "string"), (7, 13, "comment")] and state == 0
+
+
+def test_edit_relexes_until_states_converge():
+    text = "\n".join(f"value_{i} = {i}  # line" for i in range(5000))
+    document = PieceTable(text)
+    highlighter = SyntaxHighlighter()
+    highlighter.reset(PYTHON, document.line_count)
+    assert highlight(highlighter, document) == 5000
+
+    # Правка без смены состояния: перелексируются измененная строка
+    # и следующая, на которой состояние сходится с прежним
+    document.insert(document.offset(100), "x")
+    highlighter.edit(100, 0, 0)
+    assert highlight(highlighter, document) == 2
+
+    # Открытая строка меняет состояние всех строк до конца
+    document.insert(document.offset(4000), '"""')
+    highlighter.edit(4000, 0, 0)
+    assert highlight(highlighter, document) == 1000
+    assert (highlighter.tokens, highlighter.states) == full_lex(PYTHON, document.get_text())
+
+
+def test_stale_job_is_discarded():
+    document = PieceTable("a = 1\nb = 2")
+    highlighter = SyntaxHighlighter()
+    highlighter.reset(PYTHON, document.line_count)
+    job = highlighter.make_job(document)
+    job.run()
+    highlighter.edit(0, 0, 0)
+    assert not highlighter.apply(job)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_matches_full_lex(seed):
+    rng = random.Random(seed)
+    pieces = ['"""', "'''", "# c", "x = 1", "def f():", "\n", " ", "'s'"]
+    text = "".join(rng.choice(pieces) for _ in range(300))
+    document = PieceTable(text)
+    highlighter = SyntaxHighlighter()
+    highlighter.BATCH_LINES = 7
+    highlighter.reset(PYTHON, document.line_count)
+    highlight(highlighter, document)
+
+    for _ in range(50):
+        if rng.random() < 0.6 or not len(document):
+            offset = rng.randint(0, len(document))
+            chunk = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 3)))
+            line = document.line_of(offset)
+            document.insert(offset, chunk)
+            highlighter.edit(line, 0, chunk.count("\n"))
+        else:
+            offset = rng.randrange(len(document))
+            chunk = document.get_text(offset, min(len(document), offset + rng.randint(1, 10)))
+            line = document.line_of(offset)
+            document.delete(offset, len(chunk))
+            highlighter.edit(line, chunk.count("\n"), 0)
+        if rng.random() < 0.5:
+            highlight(highlighter, document)
+
+    highlight(highlighter, document)
+    assert (highlighter.tokens, highlighter.states) == full_lex(PYTHON, document.get_text())
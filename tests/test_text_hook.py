@@ -0,0 +1,51 @@
+import tkinter as tk
+
+import pytest
+
+import notefish
+
+
+@pytest.fixture
+def text(tk_root):
+    """Виджет Text с перехватом правок и собранными дельтами"""
+    widget = tk.Text(tk_root)
+    widget.pack()
+    hook = notefish.TextDeltaHook(widget)
+    widget.deltas = []
+    hook.add_listener(widget.deltas.append)
+    return widget
+
+
+def test_edits_produce_deltas(text):
+    text.insert("1.0", "hello world")
+    text.delete("1.0", "1.6")
+    assert [(d.kind, d.index, d.text) for d in text.deltas] == [
+        ("insert", "1.0", "hello world"),
+        ("delete", "1.0", "hello ")
+    ]
+    assert text.get("1.0", "end-1c") == "world"
+
+
+def test_copy_without_selection_keeps_clipboard(tk_root, text):
+    text.insert("1.0", "hello")
+    tk_root.clipboard_clear()
+    tk_root.clipboard_append("kept")
+
+    text.event_generate("<<Copy>>")
+    text.event_generate("<<Cut>>")
+
+    assert tk_root.clipboard_get() == "kept"
+    assert text.get("1.0", "end-1c") == "hello"
+
+
+def test_errors_of_other_commands_propagate(text):
+    with pytest.raises(tk.TclError):
+        text.get("sel.first", "sel.last")
+    with pytest.raises(tk.TclError):
+        text.index("no_such_mark")
+
+
+def test_failed_edit_raises_without_delta(text):
+    with pytest.raises(tk.TclError):
+        text.delete("sel.first", "sel.last")
+    assert text.deltas == []